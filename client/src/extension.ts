@@ -72,7 +72,10 @@ function makeLanguageServerClient(pythonExecutable: string) {
   let clientOptions: LanguageClientOptions = {
     documentSelector: [{ language: "zc-buildout" }],
     synchronize: {
-      fileEvents: workspace.createFileSystemWatcher("**/*.{cfg,in,j2}"),
+      fileEvents: [
+        workspace.createFileSystemWatcher("**/*.{cfg,in,j2}"),
+        workspace.createFileSystemWatcher("**/.gitignore"),
+      ],
     },
   };
 
@@ -0,0 +1,96 @@
+"""Language server independent API to parse and resolve buildout profiles.
+
+This is intended for batch tools and scripts, for example::
+
+  import asyncio
+  from buildoutls import api
+
+  async def main():
+    resolved = await api.resolve("/path/to/buildout.cfg")
+    print(resolved.resolve_value("buildout", "parts"))
+
+  asyncio.run(main())
+
+Profiles can be passed as local paths or as URIs. By default, documents are
+read from the file system and from the network for http:// or https:// URIs,
+another :class:`~buildoutls.documents.DocumentSource` can be passed as
+``documents``.
+
+Parsed and resolved profiles are cached, the cache is shared with the language
+server, so :func:`clear_cache` must be called when a profile is modified.
+"""
+
+import pathlib
+from typing import Optional, Union
+
+from . import buildout
+from .documents import (
+  DocumentSource,
+  FileSystemDocumentSource,
+  HTTPDocumentSource,
+  URI,
+)
+
+default_document_source: DocumentSource = HTTPDocumentSource(FileSystemDocumentSource())
+
+PathOrURI = Union[str, pathlib.Path]
+
+
+def to_uri(path_or_uri: PathOrURI) -> URI:
+  """Return an URI for a local path, URIs are returned unchanged."""
+  if isinstance(path_or_uri, str) and buildout._isurl(path_or_uri):
+    return path_or_uri
+  return pathlib.Path(path_or_uri).absolute().as_uri()
+
+
+async def parse(
+  path_or_uri: PathOrURI,
+  documents: Optional[DocumentSource] = None,
+  allow_errors: bool = True,
+) -> buildout.BuildoutProfile:
+  """Parse a profile, without resolving extends and macros."""
+  return await buildout.parse(
+    documents or default_document_source,
+    to_uri(path_or_uri),
+    allow_errors=allow_errors,
+  )
+
+
+async def resolve(
+  path_or_uri: PathOrURI,
+  documents: Optional[DocumentSource] = None,
+  allow_errors: bool = True,
+) -> buildout.ResolvedBuildout:
+  """Parse a profile, resolving extends and macros."""
+  return await buildout._open(
+    documents or default_document_source,
+    "",
+    to_uri(path_or_uri),
+    [],
+    allow_errors=allow_errors,
+  )
+
+
+async def open(
+  path_or_uri: PathOrURI,
+  documents: Optional[DocumentSource] = None,
+  allow_errors: bool = True,
+) -> Optional[Union[buildout.BuildoutTemplate, buildout.ResolvedBuildout]]:
+  """Open a profile or a template.
+
+  For templates, the profile using this template is searched in the parent
+  directories and the template connected to this profile is returned.
+  """
+  return await buildout.open(
+    documents or default_document_source,
+    to_uri(path_or_uri),
+    allow_errors=allow_errors,
+  )
+
+
+def clear_cache(path_or_uri: Optional[PathOrURI] = None) -> None:
+  """Clear the caches for a modified profile, or all caches."""
+  if path_or_uri is None:
+    buildout.clearAllCaches()
+  else:
+    buildout.clearCache(to_uri(path_or_uri))
@@ -0,0 +1,54 @@
+import asyncio
+import io
+from typing import Any
+
+import pytest
+
+from ..buildout import BuildoutProfile, _extendMacros, _parse
+
+
+def getProfileSource(depth: int, width: int) -> str:
+  """A profile with a chain of `depth` macros, each one extending the previous
+  one and adding options, and `width` sections extending the last macro of the
+  chain.
+  """
+  sections = ["[macro0]\n" + "".join(f"option{i} = value{i}\n" for i in range(20))]
+  for level in range(1, depth):
+    sections.append(
+      f"[macro{level}]\n<= macro{level - 1}\nlevel{level} = {level}\noption0 += more\n"
+    )
+  for user in range(width):
+    sections.append(f"[user{user}]\n<= macro{depth - 1}\nuser = {user}\n")
+  return "\n".join(sections)
+
+
+@pytest.mark.parametrize(
+  "depth,width",
+  (
+    (1, 2000),
+    (20, 500),
+    (100, 100),
+  ),
+  ids=("wide", "wide-and-deep", "deep"),
+)
+def test_macro_expansion(benchmark: Any, depth: int, width: int) -> None:
+  parsed = asyncio.run(
+    _parse(
+      io.StringIO(getProfileSource(depth, width)),
+      "file:///buildout.cfg",
+      allow_errors=False,
+    )
+  )
+
+  def extendMacros() -> BuildoutProfile:
+    extended = parsed.copy()
+    _extendMacros(extended)
+    # sections are extended lazily, when accessed
+    extended.materialize()
+    return extended
+
+  extended = benchmark(extendMacros)
+  assert extended[f"user{width - 1}"]["option0"].value == "value0" + "\nmore" * (
+    depth - 1
+  )
+  assert "<" not in extended[f"user{width - 1}"]
@@ -0,0 +1,75 @@
+import asyncio
+import json
+import pathlib
+import zipfile
+from typing import Any
+
+import pytest
+
+from ..util import cache_dir
+from ..util.osv_database import OSVDatabase
+
+# like the PyPI database of osv.dev, with about 15000 vulnerabilities
+PROJECTS = 5000
+VULNERABILITIES_PER_PROJECT = 3
+PINS = [(f"project{i}", "1.5.0") for i in range(0, PROJECTS, 5)]
+
+
+@pytest.fixture(scope="module")
+def database_zip(tmp_path_factory: pytest.TempPathFactory) -> pathlib.Path:
+  database_zip = tmp_path_factory.mktemp("osv") / "all.zip"
+  with zipfile.ZipFile(database_zip, "w", zipfile.ZIP_DEFLATED) as zf:
+    for i in range(PROJECTS):
+      for j in range(VULNERABILITIES_PER_PROJECT):
+        vulnerability = {
+          "id": f"PYSEC-{i}-{j}",
+          "aliases": [f"CVE-{i}-{j}"],
+          "details": "A vulnerability. " * 50,
+          "affected": [
+            {
+              "package": {"name": f"project{i}", "ecosystem": "PyPI"},
+              "ranges": [
+                {
+                  "type": "ECOSYSTEM",
+                  "events": [{"introduced": "0"}, {"fixed": f"{j + 1}.0"}],
+                }
+              ],
+              "versions": [f"{j}.{k}" for k in range(30)],
+            }
+          ],
+          "references": [{"type": "WEB", "url": "https://example.com"}],
+        }
+        zf.writestr(f"PYSEC-{i}-{j}.json", json.dumps(vulnerability))
+  return database_zip
+
+
+@pytest.mark.parametrize("index", ("build", "memory-mapped"))
+def test_cold_start(
+  benchmark: Any,
+  database_zip: pathlib.Path,
+  tmp_path: pathlib.Path,
+  index: str,
+) -> None:
+  """Load the database and check the pins of a profile, like the first
+  diagnostics after a start of the language server.
+  """
+  cache_dir.set_cache_directory(str(tmp_path))
+
+  def setup() -> Any:
+    if index == "build":
+      for index_path in tmp_path.glob("osv-index-*.idx"):
+        index_path.unlink()
+    return (OSVDatabase(str(database_zip)),), {}
+
+  def run(database: OSVDatabase) -> None:
+    known_vulnerabilities = asyncio.run(
+      database.get_known_vulnerabilities(PINS, asyncio.Semaphore(4))
+    )
+    assert len(known_vulnerabilities["project0", "1.5.0"]) == 2
+    database.close()
+
+  try:
+    run(*setup()[0])
+    benchmark.pedantic(run, setup=setup, rounds=5)
+  finally:
+    cache_dir.set_cache_directory(None)
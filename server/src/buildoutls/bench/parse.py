@@ -0,0 +1,88 @@
+import asyncio
+import io
+from typing import Any
+
+import pytest
+
+from ..buildout import BuildoutProfile, _parse
+from ..cst import SyntaxTree
+from ..jinja import JinjaParser
+
+
+def getProfileSource(lines: int) -> str:
+  """A profile with an inline template of `lines` lines."""
+  return (
+    "[template]\n"
+    "recipe = slapos.recipe.template\n"
+    "output = ${buildout:directory}/script\n"
+    "inline =\n"
+    + "".join(f"  echo line {i} ${{buildout:directory}}\n" for i in range(lines))
+    + "[section]\noption = value\n"
+  )
+
+
+@pytest.mark.parametrize("lines", (100, 1000, 10000))
+def test_parse_inline_template(benchmark: Any, lines: int) -> None:
+  source = getProfileSource(lines)
+
+  def parse() -> BuildoutProfile:
+    parsed = asyncio.run(_parse(io.StringIO(source), "file:///buildout.cfg", False))
+    assert parsed["template"]["inline"].value.startswith("echo line 0")
+    return parsed
+
+  benchmark(parse)
+
+
+def getMixedProfileSource(sections: int) -> str:
+  """A profile with sections, comments, multi line options and some jinja."""
+  return "".join(
+    f"""\
+# component {i}
+[component{i}]
+recipe = slapos.recipe.build:download-unpacked
+url = https://example.com/component-{i}.tar.gz
+md5sum = 0123456789abcdef0123456789abcdef
+environment =
+  PATH=${{buildout:bin-directory}}:%(PATH)s
+  CFLAGS=-I${{buildout:parts-directory}}/component{i}/include
+{{% if component{i} is defined %}}
+option = {{{{ component{i} }}}}
+{{% endif %}}
+"""
+    for i in range(sections)
+  )
+
+
+@pytest.mark.parametrize("parser", ("jinja", "buildout"))
+def test_parse_lines_per_second(benchmark: Any, parser: str) -> None:
+  source = getMixedProfileSource(1000)
+  lines = source.splitlines(keepends=True)
+
+  def feedJinjaParser() -> None:
+    jinja_parser = JinjaParser()
+    for line in lines:
+      jinja_parser.feed(line)
+
+  def parse() -> None:
+    asyncio.run(_parse(io.StringIO(source), "file:///buildout.cfg", False))
+
+  benchmark(feedJinjaParser if parser == "jinja" else parse)
+  benchmark.extra_info["lines_per_second"] = int(
+    len(lines) / benchmark.stats.stats.mean
+  )
+
+
+@pytest.mark.parametrize("incremental", (False, True), ids=("full", "incremental"))
+def test_syntax_tree_edit(benchmark: Any, incremental: bool) -> None:
+  source = getMixedProfileSource(1000)
+  tree = SyntaxTree.parse(source)
+  # typing in the middle of the profile
+  edited = source.replace("component-500.tar.gz", "component-500.tar.xz")
+  assert edited != source
+
+  def parse() -> SyntaxTree:
+    if incremental:
+      return tree.reparse(edited)
+    return SyntaxTree.parse(edited)
+
+  assert benchmark(parse).lines == SyntaxTree.parse(edited).lines
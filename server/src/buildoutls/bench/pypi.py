@@ -0,0 +1,240 @@
+import asyncio
+import collections
+import json
+import pathlib
+import threading
+import tracemalloc
+from typing import Any, AsyncIterator, Iterator, List, Tuple
+
+import pytest
+from aiohttp import web
+
+from ..util import aiohttp_session, cache_dir, json_stream
+from ..util.http_cache import CHUNK_SIZE
+from ..util.pypi import PROJECT_SPEC, PyPIClient
+
+# latency of the stand-in package index, in seconds
+LATENCY = 0.05
+PINS = [(f"project{i}", "1.0.0") for i in range(200)]
+# requests received by the stand-in package index, by path
+received_requests: "collections.Counter[str]" = collections.Counter()
+
+
+def getIndexApplication() -> web.Application:
+  """A stand-in for the JSON API of pypi, answering after LATENCY with
+  support for conditional requests.
+  """
+
+  async def project(request: web.Request) -> web.Response:
+    received_requests[request.path] += 1
+    await asyncio.sleep(LATENCY)
+    etag = '"1"'
+    if request.headers.get("If-None-Match") == etag:
+      return web.Response(status=304)
+    name = request.match_info["project"]
+    data: Any = {
+      "info": {"name": name, "version": "2.0.0", "description": "x" * 10000},
+      "releases": {f"1.{i}.0": [] for i in range(100)} | {"2.0.0": []},
+    }
+    if "version" in request.match_info:
+      data = {
+        "info": {"name": name},
+        "vulnerabilities": [
+          {
+            "aliases": [f"CVE-{i}"],
+            "details": "A vulnerability",
+            "fixed_in": ["1.5.0", "2.0.0"],
+            "id": f"PYSEC-{i}",
+            "link": "https://example.com",
+            "source": "osv",
+          }
+          for i in range(3)
+        ],
+      }
+    return web.json_response(data, headers={"ETag": etag})
+
+  application = web.Application()
+  application.router.add_get("/pypi/{project}/json", project)
+  application.router.add_get("/pypi/{project}/{version}/json", project)
+  return application
+
+
+@pytest.fixture(scope="module")
+def package_index_url() -> Iterator[str]:
+  loop = asyncio.new_event_loop()
+  runner = web.AppRunner(getIndexApplication())
+  loop.run_until_complete(runner.setup())
+  site = web.TCPSite(runner, "127.0.0.1", 0)
+  loop.run_until_complete(site.start())
+  (_, port) = runner.addresses[0]
+  thread = threading.Thread(target=loop.run_forever, daemon=True)
+  thread.start()
+  yield f"http://127.0.0.1:{port}"
+  asyncio.run_coroutine_threadsafe(runner.cleanup(), loop).result()
+  loop.call_soon_threadsafe(loop.stop)
+  thread.join()
+
+
+async def checkPins(client: PyPIClient, pins: List[Tuple[str, str]]) -> None:
+  """Check the pins like diagnostics do."""
+  semaphore = asyncio.Semaphore(20)
+  await asyncio.gather(
+    *[client.get_latest_version(p, v, semaphore) for p, v in pins],
+    *[client.get_known_vulnerabilities(p, v, semaphore) for p, v in pins],
+  )
+
+
+@pytest.mark.parametrize("cache", ("cold", "fresh", "stale"))
+def test_check_pins(
+  benchmark: Any,
+  package_index_url: str,
+  tmp_path: pathlib.Path,
+  cache: str,
+) -> None:
+  """Check pins after a restart of the server.
+
+  With a cold cache, all metadata is fetched. With a fresh cache, it is read
+  from the disk. With a stale cache, it is read from the disk and revalidated
+  in the background with conditional requests, which is not measured.
+  """
+  cache_dir.set_cache_directory(str(tmp_path))
+  loop = asyncio.new_event_loop()
+  clients: List[PyPIClient] = []
+
+  def setup() -> Tuple[Tuple[Any, ...], dict]:
+    for client in clients:
+      loop.run_until_complete(client.cache.wait_for_revalidations())
+    if cache == "cold":
+      PyPIClient(package_index_url).cache.clear()
+    client = PyPIClient(package_index_url)
+    if cache == "stale":
+      client.cache.max_age = 0
+    clients.append(client)
+    return (client, PINS), {}
+
+  def run(client: PyPIClient, pins: List[Tuple[str, str]]) -> None:
+    loop.run_until_complete(checkPins(client, pins))
+
+  try:
+    loop.run_until_complete(checkPins(PyPIClient(package_index_url), PINS))
+    benchmark.pedantic(run, setup=setup, rounds=5)
+  finally:
+    for client in clients:
+      loop.run_until_complete(client.cache.wait_for_revalidations())
+    loop.run_until_complete(aiohttp_session.close_session())
+    loop.close()
+    cache_dir.set_cache_directory(None)
+
+
+def test_check_pins_warm(
+  benchmark: Any,
+  package_index_url: str,
+  tmp_path: pathlib.Path,
+) -> None:
+  """Check pins again with all metadata in memory, like the diagnostics of a
+  profile after each modification. This measures the work done with the
+  versions of the pins and releases.
+  """
+  cache_dir.set_cache_directory(str(tmp_path))
+  loop = asyncio.new_event_loop()
+  client = PyPIClient(package_index_url)
+  try:
+    loop.run_until_complete(checkPins(client, PINS))
+    benchmark(lambda: loop.run_until_complete(checkPins(client, PINS)))
+  finally:
+    loop.run_until_complete(aiohttp_session.close_session())
+    loop.close()
+    cache_dir.set_cache_directory(None)
+
+
+@pytest.mark.parametrize(
+  "use_project_metadata", (False, True), ids=("release-metadata", "project-metadata")
+)
+def test_request_count(
+  benchmark: Any,
+  package_index_url: str,
+  tmp_path: pathlib.Path,
+  use_project_metadata: bool,
+) -> None:
+  """Count the requests to check a [versions] section of 500 pins, with a
+  quarter of the pins at the latest version, from two documents at the same
+  time. Without coalescing, this would be 2000 requests.
+  """
+  pins = [(f"project{i}", "2.0.0" if i % 4 == 0 else "1.0.0") for i in range(500)]
+  cache_dir.set_cache_directory(str(tmp_path))
+
+  async def checkDocuments() -> None:
+    client = PyPIClient(package_index_url, use_project_metadata=use_project_metadata)
+    client.cache.clear()
+    await asyncio.gather(checkPins(client, pins), checkPins(client, pins))
+    await aiohttp_session.close_session()
+
+  def run() -> None:
+    received_requests.clear()
+    asyncio.run(checkDocuments())
+
+  try:
+    benchmark.pedantic(run, rounds=1)
+  finally:
+    cache_dir.set_cache_directory(None)
+  benchmark.extra_info["requests"] = sum(received_requests.values())
+
+
+def getLargeProjectDocument() -> bytes:
+  """The JSON of a project with many releases, like boto3, about 8MB."""
+  return json.dumps(
+    {
+      "info": {"name": "large", "version": "2000.0.0", "description": "x" * 10000},
+      "last_serial": 1,
+      "releases": {
+        f"{i}.0.0": [
+          {
+            "filename": f"large-{i}.0.0-{j}.whl",
+            "digests": {"md5": "0" * 32, "sha256": "0" * 64},
+            "packagetype": "bdist_wheel",
+            "python_version": "py3",
+            "requires_python": ">=3.9",
+            "size": 1000 + j,
+            "upload_time": "2026-01-01T00:00:00",
+            "url": f"https://files.example/large-{i}.0.0-{j}.whl",
+            "yanked": False,
+            "yanked_reason": None,
+          }
+          for j in range(10)
+        ]
+        for i in range(2001)
+      },
+      "urls": [],
+      "vulnerabilities": [],
+    }
+  ).encode()
+
+
+@pytest.mark.parametrize("parser", ("json", "streaming"))
+def test_parse_project_document(benchmark: Any, parser: str) -> None:
+  """Extract the metadata of a project with many releases from the chunks of
+  the response, like `HTTPCache` does. The peak memory is in extra_info.
+  """
+  document = getLargeProjectDocument()
+
+  async def iterChunks() -> AsyncIterator[bytes]:
+    for i in range(0, len(document), CHUNK_SIZE):
+      yield document[i : i + CHUNK_SIZE]
+
+  async def parse() -> Any:
+    if parser == "json":
+      # like aiohttp's ClientResponse.json
+      return json.loads(b"".join([chunk async for chunk in iterChunks()]).decode())
+    return await json_stream.extract(iterChunks(), PROJECT_SPEC)
+
+  def run() -> Any:
+    return asyncio.run(parse())
+
+  benchmark(run)
+  tracemalloc.start()
+  try:
+    assert len(run()["releases"]) == 2001
+    _, peak = tracemalloc.get_traced_memory()
+  finally:
+    tracemalloc.stop()
+  benchmark.extra_info["peak_memory_mb"] = round(peak / (1 << 20), 1)
@@ -1,22 +1,19 @@
 import asyncio
+import gc
+import os
 import pathlib
 import subprocess
-from typing import Any, List, no_type_check
+import tracemalloc
+from typing import Any, List, Optional, no_type_check
 from unittest import mock
 
 import pytest
 from lsprotocol.types import Diagnostic
-from pygls.lsp.server import LanguageServer
-from pygls.workspace import Workspace
-
-from ..buildout import (
-  _extends_dependency_graph,
-  _parse_cache,
-  _resolved_buildout_cache,
-  _resolved_extends_cache,
-  open,
-)
+
+from .. import api, buildout
 from ..diagnostic import getDiagnostics
+from ..tests.test_jinja import assertSameStates
+from ..util.uris import canonical_uri
 
 
 @pytest.fixture
@@ -35,13 +32,6 @@ def slapos_working_copy() -> pathlib.Path:
   return working_copy_path.absolute()
 
 
-def clear_caches() -> None:
-  _resolved_buildout_cache.clear()
-  _resolved_extends_cache.clear()
-  _parse_cache.clear()
-  _extends_dependency_graph.clear()
-
-
 @pytest.fixture
 def no_pypi_diagnostics() -> Any:
   with (
@@ -119,14 +109,11 @@ async def test_open_and_diagnostic(
   cache: Any,
 ) -> None:
   doc_uri = (slapos_working_copy / profile_relative_path).as_uri()
-  workspace = Workspace(slapos_working_copy.as_uri())
-  ls = LanguageServer(name="zc.buildout.languageserver", version="dev")
-  ls.protocol._workspace = workspace
 
   async def open_and_get_diagnostics() -> List[Diagnostic]:
     diags: List[Diagnostic] = []
-    await open(ls, doc_uri)
-    async for diag in getDiagnostics(ls, doc_uri):
+    await api.open(doc_uri)
+    async for diag in getDiagnostics(api.default_document_source, doc_uri):
       diags.append(diag)
     return diags
 
@@ -136,5 +123,91 @@ async def test_open_and_diagnostic(
   @aio_benchmark
   async def open_and_get_diagnostics_bench() -> None:
     if cache == "without_cache":
-      clear_caches()
+      api.clear_cache()
     await open_and_get_diagnostics()
+
+
+def test_cache_hit_rate(
+  no_pypi_diagnostics: Any,
+  slapos_working_copy: pathlib.Path,
+  benchmark: Any,
+) -> None:
+  """Open all the software profiles, and report the hit rate of the caches."""
+  profiles = sorted(slapos_working_copy.glob("software/*/software.cfg"))
+
+  async def open_profiles() -> None:
+    for profile in profiles:
+      await api.open(profile)
+
+  def open_profiles_without_cache() -> None:
+    api.clear_cache()
+    buildout.cache_statistics.clear()
+    asyncio.run(open_profiles())
+
+  benchmark.pedantic(open_profiles_without_cache, rounds=1)
+  for cache_name in ("parse", "resolved", "extends"):
+    hits = buildout.cache_statistics[f"{cache_name}.hit"]
+    misses = buildout.cache_statistics[f"{cache_name}.miss"]
+    benchmark.extra_info[f"{cache_name}_hit_rate"] = hits / ((hits + misses) or 1)
+  benchmark.extra_info["canonical_uri_hit_rate"] = canonical_uri.cache_info().hits / (
+    (canonical_uri.cache_info().hits + canonical_uri.cache_info().misses) or 1
+  )
+
+
+def _getRss() -> Optional[int]:
+  """Resident set size of this process in bytes, on Linux."""
+  try:
+    with open("/proc/self/statm") as f:
+      return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+  except OSError:
+    return None
+
+
+def test_memory_resolved_erp5(
+  no_pypi_diagnostics: Any,
+  slapos_working_copy: pathlib.Path,
+  benchmark: Any,
+) -> None:
+  """Report the memory used by the caches after resolving all the options of
+  the ERP5 software profile.
+  """
+  profile_uri = (slapos_working_copy / "software" / "erp5" / "software.cfg").as_uri()
+
+  async def open_and_resolve() -> None:
+    resolved = await api.open(profile_uri)
+    assert isinstance(resolved, buildout.BuildoutProfile)
+    for section_name, section in list(resolved.items()):
+      for option_name in list(section):
+        resolved.resolve_value(section_name, option_name)
+
+  def measure() -> None:
+    api.clear_cache()
+    gc.collect()
+    rss_before = _getRss()
+    tracemalloc.start()
+    try:
+      asyncio.run(open_and_resolve())
+      gc.collect()
+      benchmark.extra_info["traced_bytes"], _ = tracemalloc.get_traced_memory()
+    finally:
+      tracemalloc.stop()
+    rss_after = _getRss()
+    if rss_before is not None and rss_after is not None:
+      benchmark.extra_info["rss_bytes"] = rss_after - rss_before
+
+  benchmark.pedantic(measure, rounds=1)
+
+
+def test_jinja_fast_path(slapos_working_copy: pathlib.Path) -> None:
+  """Check that the jinja parser gives the same result with its fast path, on
+  all the profiles and templates of the slapos tree.
+  """
+  profiles = [
+    path
+    for pattern in ("**/*.cfg", "**/*.cfg.in", "**/*.cfg.j2", "**/*.cfg.jinja2")
+    for path in slapos_working_copy.glob(pattern)
+  ]
+  assert profiles
+  for profile in profiles:
+    with profile.open(encoding="utf-8", errors="replace") as f:
+      assertSameStates(f)
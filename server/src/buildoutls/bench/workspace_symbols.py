@@ -0,0 +1,79 @@
+import random
+import string
+from typing import Any
+
+import pytest
+from lsprotocol.types import Position, Range
+
+from ..symbol_index import SymbolIndex, WorkspaceSymbol
+
+SYMBOL_COUNT = 100_000
+PROFILE_COUNT = 1_000
+WORDS = (
+  "apache",
+  "backup",
+  "balancer",
+  "frontend",
+  "instance",
+  "mariadb",
+  "monitor",
+  "promise",
+  "server",
+  "zope",
+)
+
+
+@pytest.fixture(scope="module")
+def symbol_index() -> SymbolIndex:
+  """An index of sections named like ``mariadb-backup-xyz``, from a
+  vocabulary of a few hundred words. Like in real workspaces, many sections
+  have the same name in different profiles.
+  """
+  random_ = random.Random(0)
+  words = list(WORDS) + [
+    "".join(random_.choices(string.ascii_lowercase, k=random_.randint(3, 10)))
+    for _ in range(400)
+  ]
+  names = [
+    "-".join(random_.sample(words, random_.randint(1, 3))) for _ in range(20_000)
+  ]
+  index = SymbolIndex()
+  symbols_per_profile = SYMBOL_COUNT // PROFILE_COUNT
+  for profile in range(PROFILE_COUNT):
+    uri = f"file:///workspace/software-{profile}/instance.cfg"
+    index.set(
+      uri,
+      [
+        WorkspaceSymbol(
+          random_.choice(names),
+          None,
+          uri,
+          Range(
+            start=Position(line=line, character=1),
+            end=Position(line=line, character=1),
+          ),
+        )
+        for line in range(symbols_per_profile)
+      ],
+    )
+  assert len(index) == SYMBOL_COUNT
+  return index
+
+
+@pytest.mark.parametrize(
+  "query",
+  (
+    "m",
+    "ma",
+    "mariadb",
+    "mariadb-srv",
+    "zope-backup-instance",
+    "not-found",
+  ),
+)
+def test_workspace_symbols_search(
+  benchmark: Any,
+  symbol_index: SymbolIndex,
+  query: str,
+) -> None:
+  benchmark(symbol_index.search, query)
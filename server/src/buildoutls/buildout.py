@@ -15,46 +15,52 @@
 ##############################################################################
 
 import collections
-import copy
+import itertools
 import enum
+import functools
 import io
 import logging
-import os
 import pathlib
 import re
+import sys
 import textwrap
-import urllib.parse
+import weakref
 from typing import (
   TYPE_CHECKING,
+  AbstractSet,
   AsyncIterator,
+  Callable,
   Dict,
+  FrozenSet,
   Iterator,
   List,
+  Mapping,
   Match,
+  NamedTuple,
   Optional,
+  Sequence,
   Set,
   TextIO,
   Tuple,
+  TypeVar,
   Union,
   cast,
 )
 
 import aiohttp.client_exceptions
 from lsprotocol.types import Location, Position, Range
-from pygls.lsp.server import LanguageServer
-from pygls.workspace import TextDocument
 from typing_extensions import TypeAlias
 from zc.buildout.buildout import _buildout_default_options
 from zc.buildout.configparser import (
   MissingSectionHeaderError,
   ParsingError,
   leading_blank_lines,
-  option_start,
   section_header,
 )
 
-from . import jinja, recipes
-from .util import aiohttp_session
+from . import cst, jinja, recipes
+from .documents import DocumentSource, DocumentSourceLike, get_document_source
+from .util.uris import canonical_uri, join_uri
 
 logger = logging.getLogger(__name__)
 
@@ -133,6 +139,10 @@ class BuildoutOptionDefinition:
   `default_value` are default values that are not defined
   in profiles, but are implicit, such as buildout default
   values or sections added by slapos instance.
+
+  The current value of an option defined on multiple lines
+  is kept as the list of its lines, it is joined and normalized
+  when accessed for the first time.
   """
 
   def __init__(
@@ -142,8 +152,22 @@ class BuildoutOptionDefinition:
     default_value: bool = False,
   ):
     self.locations: Tuple[Location, ...] = (location,)
-    self.values: Tuple[str, ...] = (value,)
+    self._values: Tuple[str, ...] = (value,)
     self.default_values: Tuple[bool, ...] = (default_value,)
+    # lines of the current value, when it is not joined yet
+    self._lines: Optional[List[str]] = None
+
+  @property
+  def values(self) -> Tuple[str, ...]:
+    if self._lines is not None:
+      self._values = self._values[:-1] + (_joinLines(self._lines),)
+      self._lines = None
+    return self._values
+
+  @values.setter
+  def values(self, values: Tuple[str, ...]) -> None:
+    self._values = values
+    self._lines = None
 
   @property
   def value(self) -> str:
@@ -167,6 +191,19 @@ class BuildoutOptionDefinition:
     self.locations = self.locations + (location,)
     self.default_values = self.default_values + (False,)
 
+  def appendLine(self, line: str) -> None:
+    """Add a continuation line to the current value, used when parsing."""
+    if self._lines is None:
+      self._lines = [self._values[-1]]
+    self._lines.append(line)
+
+  def updateLocationEnd(self, end: Position) -> None:
+    """Move the end of the current location, used when parsing."""
+    location = self.locations[-1]
+    self.locations = self.locations[:-1] + (
+      Location(uri=location.uri, range=Range(start=location.range.start, end=end)),
+    )
+
   def updateValue(
     self,
     value: str,
@@ -381,17 +418,19 @@ class BuildoutTemplate:
       self.second_level_buildout,
     )
 
+  @property
+  def syntax_tree(self) -> cst.SyntaxTree:
+    """The concrete syntax tree of the source."""
+    return cst.getSyntaxTree(self.uri, self.source)
+
   def _getSymbolAtPosition(
     self,
     position: Position,
     current_section_name: Optional[str] = None,
     current_option_name: Optional[str] = None,
   ) -> Optional[Symbol]:
-    lines = self.source.splitlines()
     # extract line for the position.
-    line = ""
-    if position.line < len(lines):
-      line = lines[position.line]
+    line = self.syntax_tree.getLineText(position.line)
 
     if comment_re.match(line[: position.character]):
       return Symbol(kind=SymbolKind.Comment, buildout=self.buildout, value="")
@@ -491,7 +530,8 @@ class BuildoutTemplate:
     self,
   ) -> AsyncIterator[OptionReferenceSymbolWithPosition]:
     """Return all symbols of kind OptionReference in this profile."""
-    for lineno, line in enumerate(self.source.splitlines()):
+    for lineno, syntax_line in enumerate(self.syntax_tree.lines):
+      line = syntax_line.text.rstrip("\r\n")
       if line and line[0] in "#;":
         continue
       for match in option_reference_re.finditer(line):
@@ -532,16 +572,76 @@ class BuildoutTemplate:
         yield symbol
 
 
+class _LazySection:
+  """A section computed when it is accessed for the first time.
+
+  The computed section is shared by the copies of a profile, each profile
+  accessing the section gets its own copy of it.
+  """
+
+  __slots__ = ("_compute", "_section")
+
+  def __init__(
+    self,
+    compute: Optional[Callable[[], BuildoutSection]] = None,
+    section: Optional[BuildoutSection] = None,
+  ):
+    self._compute = compute
+    self._section = section
+
+  def get(self) -> BuildoutSection:
+    if self._section is None:
+      assert self._compute is not None
+      self._section = self._compute()
+      self._compute = None
+    return self._section
+
+  @property
+  def computed(self) -> bool:
+    return self._section is not None
+
+
+class _LazySections(Mapping[str, BuildoutSection]):
+  """Read only mapping of lazy sections, without copying them."""
+
+  def __init__(self, sections: Dict[str, _LazySection]):
+    self._sections = sections
+
+  def __getitem__(self, section_name: str) -> BuildoutSection:
+    return self._sections[section_name].get()
+
+  def __iter__(self) -> Iterator[str]:
+    return iter(self._sections)
+
+  def __len__(self) -> int:
+    return len(self._sections)
+
+
 class BuildoutProfile(Dict[str, BuildoutSection], BuildoutTemplate):
-  """A parsed buildout file, without extends."""
+  """A parsed buildout file, without extends.
+
+  Sections can be lazy, they are computed when accessed for the first time.
+  This way, resolving a profile does not merge and extend the sections that
+  are never used. Copying a profile does not copy its sections, they are
+  copied when accessed for the first time, so sections must not be modified
+  in place after the profile was copied.
+  """
 
   def copy(self) -> "BuildoutProfile":
     copied = self.__class__(self.uri, self.source)
     copied.section_header_locations = self.section_header_locations.copy()
     copied.has_dynamic_extends = self.has_dynamic_extends
     copied.has_jinja = self.has_jinja
-    for k, v in self.items():
-      copied[k] = v.copy()
+    copied.dependencies = self.dependencies
+    for section_name in self.keys():
+      dict.__setitem__(
+        cast(Dict[str, object], copied),
+        section_name,
+        self._getLazySection(section_name),
+      )
+    if self._resolved_values is not None:
+      self._resolved_values.shared = True
+      copied._resolved_values = self._resolved_values
     return copied
 
   def __init__(self, uri: URI, source: str):
@@ -562,10 +662,14 @@ class BuildoutProfile(Dict[str, BuildoutSection], BuildoutTemplate):
     """Flag true if this resolved buildout is a jinja template.
     This only happens with SlapOS instance buildout which are templates of profiles.
     """
+    self.dependencies: FrozenSet[URI] = frozenset((uri,))
+    """URIs of all the profiles this buildout was built from.
+    """
+    self._resolved_values: Optional[_ResolvedValues] = None
 
   async def getTemplate(
     self,
-    ls: LanguageServer,
+    ls: DocumentSourceLike,
     uri: URI,
   ) -> Optional[BuildoutTemplate]:
     """Returns the template from this uri, if it is a template for this profile.
@@ -581,7 +685,7 @@ class BuildoutProfile(Dict[str, BuildoutSection], BuildoutTemplate):
 
     if not _isurl(uri):
       base = self.uri[: self.uri.rfind("/")] + "/"
-      uri = urllib.parse.urljoin(base, uri)
+      uri = join_uri(base, uri)
       uris.add(uri)
     else:
       if not uri.startswith("file://"):
@@ -594,68 +698,80 @@ class BuildoutProfile(Dict[str, BuildoutSection], BuildoutTemplate):
         str(uri_path.relative_to(pathlib.Path(self.uri[len("file://") :]).parent))
       )
 
-    document = ls.workspace.get_text_document(uri)
-    if not os.path.exists(document.path):
+    documents = get_document_source(ls)
+    if not documents.exists(uri):
       return None
 
+    for _, _, template_option_value_uri in self._getTemplateOptionValues():
+      if template_option_value_uri in uris:
+        return await self._openTemplate(documents, uri)
+    return None
+
+  async def _openTemplate(
+    self,
+    documents: DocumentSource,
+    uri: URI,
+  ) -> BuildoutTemplate:
+    """Open the template at absolute uri, used by this profile."""
+    if slapos_instance_profile_filename_re.match(uri):
+      # a slapos "buildout profile as a template"
+      slapos_instance_profile = await open(
+        documents,
+        uri,
+        allow_errors=True,
+        force_open_as_buildout_profile=True,
+      )
+      assert isinstance(slapos_instance_profile, BuildoutProfile)
+      slapos_instance_profile.second_level_buildout = slapos_instance_profile
+      slapos_instance_profile.buildout = self
+      return slapos_instance_profile
+    return BuildoutTemplate(
+      uri=uri,
+      source=await documents.read(uri),
+      buildout=self,
+    )
+
+  def _getTemplateOptionValues(self) -> Iterator[Tuple[str, str, str]]:
+    """Iterate on the options of template recipes, with their resolved and
+    normalized value.
+    """
     for section_name, section_value in self.items():
       recipe = section_value.getRecipe()
       if recipe is not None:
         for template_option_name in recipe.template_options:
           template_option_value = section_value.get(template_option_name)
           if template_option_value is not None:
-            template_option_value_uri = self.resolve_value(
-              section_name, template_option_name
-            )
-
             # Normalize URI path, in case it contain double slashes, ./ or ..
-            template_option_value_parsed = urllib.parse.urlparse(
-              template_option_value_uri
-            )
-            template_option_value_uri = urllib.parse.urlunparse(
-              template_option_value_parsed._replace(
-                path=os.path.normpath(template_option_value_parsed.path)
-              )
+            template_option_value_uri = canonical_uri(
+              self.resolve_value(section_name, template_option_name)
             )
-
-            if template_option_value_uri in uris:
-              if slapos_instance_profile_filename_re.match(uri):
-                # a slapos "buildout profile as a template"
-                slapos_instance_profile = await open(
-                  ls,
-                  uri,
-                  allow_errors=True,
-                  force_open_as_buildout_profile=True,
-                )
-                assert isinstance(slapos_instance_profile, BuildoutProfile)
-                slapos_instance_profile.second_level_buildout = slapos_instance_profile
-                slapos_instance_profile.buildout = self
-                return slapos_instance_profile
-              return BuildoutTemplate(
-                uri=uri,
-                source=document.source,
-                buildout=self,
-              )
-    return None
+            yield section_name, template_option_name, template_option_value_uri
+
+  def getTemplateReferences(self) -> Dict[URI, "TemplateReference"]:
+    """Return the templates used by this profile, by absolute URI."""
+    base = self.uri[: self.uri.rfind("/")] + "/"
+    references: Dict[URI, TemplateReference] = {}
+    for section_name, option_name, value in self._getTemplateOptionValues():
+      if _isurl(value):
+        template_uri = value
+      elif value.startswith(("/", "..")):
+        # getTemplate only matches absolute URIs or paths relative to the profile
+        continue
+      else:
+        template_uri = join_uri(base, value)
+      references.setdefault(
+        template_uri, TemplateReference(self.uri, section_name, option_name)
+      )
+    return references
 
   async def getSymbolAtPosition(self, position: Position) -> Optional[Symbol]:
     """Return the symbol at given position."""
 
-    lines = self.source.splitlines()
-    # parse until this line to find out what is the current section.
-    buildout_for_current_section = await _parse(
-      uri=self.uri,
-      fp=io.StringIO("\n".join(lines[: position.line + 1])),
-      allow_errors=True,
-    )
-    current_section_name, current_section_value = buildout_for_current_section.popitem()
-    # find current option in current_section
-    current_option_name = None
-    for k, v in current_section_value.items():
-      for loc in v.locations:
-        if loc.range.start.line <= position.line <= loc.range.end.line:
-          current_option_name = k
-          break
+    syntax_tree = self.syntax_tree
+    current_section_name, current_option_name = syntax_tree.getContext(position.line)
+    if current_section_name is None:
+      # before the first section header
+      current_section_name = "buildout"
     logger.debug(
       "current_section_name: %s current_option_name: %s",
       current_section_name,
@@ -671,9 +787,7 @@ class BuildoutProfile(Dict[str, BuildoutSection], BuildoutTemplate):
       return symbol
 
     # extract line for the position.
-    line = ""
-    if position.line < len(lines):
-      line = lines[position.line]
+    line = syntax_tree.getLineText(position.line)
 
     line_offset = 0
     remaining_line = line
@@ -821,49 +935,38 @@ class BuildoutProfile(Dict[str, BuildoutSection], BuildoutTemplate):
     option = self[section_name][option_name]
     location = option.locations[-1]
     if location.uri == self.uri:
-      start_line = location.range.start.line
-      lines = self.source.splitlines()[start_line : location.range.end.line + 1]
-      is_multi_line_option = len(lines) > 1
-      for line_offset, option_value_text in enumerate(lines):
-        if option_value_text and option_value_text[0] not in "#;":
-          start_character = 0
-
-          if option_value_text.startswith(option_name):
-            option_name_text, option_value_text = option_value_text.split("=", 1)
-            start_character += len(option_name_text) + 1
-
-          start_character += len(option_value_text) - len(option_value_text.lstrip())
-          option_value_text = option_value_text.strip()
-          if option_value_text:
-            if is_multi_line_option:
-              yield (
-                option_value_text,
-                Range(
-                  start=Position(
-                    line=start_line + line_offset,
-                    character=start_character,
-                  ),
-                  end=Position(
-                    line=start_line + line_offset,
-                    character=start_character + len(option_value_text),
-                  ),
+      syntax_tree = self.syntax_tree
+      option_node = syntax_tree.getOption(location.range.start.line)
+      if option_node is None:
+        return
+      is_multi_line_option = option_node.end_line > option_node.start_line
+      for line, (start_character, end_character) in syntax_tree.getOptionValueSpans(
+        option_node
+      ):
+        option_value_text = syntax_tree.getText(line, (start_character, end_character))
+        if is_multi_line_option:
+          yield (
+            option_value_text,
+            Range(
+              start=Position(line=line, character=start_character),
+              end=Position(line=line, character=end_character),
+            ),
+          )
+        else:
+          for match in re.finditer(r"([^\s]+)", option_value_text):
+            yield (
+              match.group(),
+              Range(
+                start=Position(
+                  line=line,
+                  character=start_character + match.start(),
                 ),
-              )
-            else:
-              for match in re.finditer(r"([^\s]+)", option_value_text):
-                yield (
-                  match.group(),
-                  Range(
-                    start=Position(
-                      line=start_line + line_offset,
-                      character=start_character + match.start(),
-                    ),
-                    end=Position(
-                      line=start_line + line_offset,
-                      character=start_character + match.start() + len(match.group()),
-                    ),
-                  ),
-                )
+                end=Position(
+                  line=line,
+                  character=start_character + match.end(),
+                ),
+              ),
+            )
 
   @staticmethod
   def looksLikeBuildoutProfile(uri: URI) -> bool:
@@ -879,48 +982,223 @@ class BuildoutProfile(Dict[str, BuildoutSection], BuildoutTemplate):
     """Get the value of an option, after substituting references.
 
     If substitution is not possible, the original value is returned.
+
+    Resolved values are memoized, see `invalidate_value`.
     """
+    return self._getResolvedValues().resolve(self, section_name, option_name)
 
-    def _get_section(section_name: str) -> BuildoutSection:
-      section = self[section_name]
-      if "<" in section:
-        macro = copy.copy(self[section["<"].value])
-        macro.update(**section)
-        return macro
+  def invalidate_value(
+    self, section_name: str, option_name: Optional[str] = None
+  ) -> None:
+    """Forget the memoized resolved value of an option, and of the options
+    referencing it.
+
+    This must be called after modifying an option in place. Replacing or
+    removing a section invalidates the values of all its options.
+    """
+    if self._resolved_values is None:
+      return
+    if self._resolved_values.shared:
+      # copy on write, the values might still be valid for other copies
+      self._resolved_values = self._resolved_values.copy()
+    self._resolved_values.invalidate(section_name, option_name)
+
+  def _getResolvedValues(self) -> "_ResolvedValues":
+    if self._resolved_values is None:
+      self._resolved_values = _ResolvedValues()
+    return self._resolved_values
+
+  def _getLazySection(self, section_name: str) -> _LazySection:
+    """Get a section without computing it or copying it."""
+    section = dict.__getitem__(self, section_name)
+    if isinstance(section, _LazySection):
       return section
+    return _LazySection(section=section)
 
-    def _resolve_value(
-      section_name: str,
-      option_name: str,
-      value: str,
-      seen: Set[Tuple[str, str]],
-    ) -> str:
-      if (section_name, option_name) in seen:
-        return value
-      seen.add((section_name, option_name))
-
-      def _sub(match: Match[str]) -> str:
-        referenced_section_name = match.group("section") or section_name
-        if referenced_section_name in self:
-          referenced_section = _get_section(referenced_section_name)
-          referenced_option = match.group("option")
-          if referenced_option in referenced_section:
-            return _resolve_value(
-              referenced_section_name,
-              referenced_option,
-              referenced_section[referenced_option].value,
-              seen,
-            )
-        return value
+  def _setLazySection(self, section_name: str, section: _LazySection) -> None:
+    dict.__setitem__(cast(Dict[str, object], self), section_name, section)
+    self.invalidate_value(section_name)
+
+  def __getitem__(self, section_name: str) -> BuildoutSection:
+    section = dict.__getitem__(self, section_name)
+    if isinstance(section, _LazySection):
+      section = section.get().copy()
+      dict.__setitem__(self, section_name, section)
+    return section
 
-      return option_reference_strict_re.sub(_sub, value)
+  def __setitem__(self, section_name: str, section: BuildoutSection) -> None:
+    super().__setitem__(section_name, section)
+    self.invalidate_value(section_name)
 
-    return _resolve_value(
-      section_name,
-      option_name,
-      _get_section(section_name)[option_name].value,
-      set(),
+  def __delitem__(self, section_name: str) -> None:
+    super().__delitem__(section_name)
+    self.invalidate_value(section_name)
+
+  def __eq__(self, other: object) -> bool:
+    if isinstance(other, BuildoutProfile):
+      other.materialize()
+    self.materialize()
+    return super().__eq__(other)
+
+  __hash__ = None  # type: ignore
+
+  def materialize(self) -> None:
+    """Compute all the lazy sections."""
+    for section_name in self.keys():
+      self[section_name]
+
+  if not TYPE_CHECKING:
+
+    def get(self, section_name, default=None):
+      if section_name in self:
+        return self[section_name]
+      return default
+
+    def values(self):
+      self.materialize()
+      return super().values()
+
+    def items(self):
+      self.materialize()
+      return super().items()
+
+    def pop(self, section_name, *default):
+      if section_name in self:
+        self[section_name]
+      section = super().pop(section_name, *default)
+      self.invalidate_value(section_name)
+      return section
+
+    def setdefault(self, section_name, default=None):
+      if section_name in self:
+        return self[section_name]
+      self[section_name] = default
+      return default
+
+    def popitem(self):
+      if self:
+        self[next(reversed(self.keys()))]
+      section_name, section = super().popitem()
+      self.invalidate_value(section_name)
+      return section_name, section
+
+
+_OptionKey = Tuple[str, str]
+
+
+class _ResolvedValues:
+  """Memo table of the values of a profile, after substituting references.
+
+  Each value is memoized with the options it was substituted from, so that
+  modifying an option only invalidates the values depending on it, and
+  resolving all the options of a profile resolves each reference once.
+
+  The table is shared between copies of a profile, until one of the copies
+  invalidates some values.
+  """
+
+  def __init__(self) -> None:
+    self.values: Dict[_OptionKey, str] = {}
+    # the options whose value was resolved from this option
+    self.dependents: Dict[_OptionKey, Set[_OptionKey]] = collections.defaultdict(set)
+    self.shared = False
+    self._resolving: Set[_OptionKey] = set()
+
+  def copy(self) -> "_ResolvedValues":
+    copied = _ResolvedValues()
+    copied.values = self.values.copy()
+    copied.dependents.update(
+      (key, dependents.copy()) for key, dependents in self.dependents.items()
     )
+    return copied
+
+  def invalidate(self, section_name: str, option_name: Optional[str]) -> None:
+    if option_name is None:
+      pending = [
+        key
+        for key in itertools.chain(self.values, self.dependents)
+        if key[0] == section_name
+      ]
+    else:
+      pending = [(section_name, option_name)]
+    while pending:
+      key = pending.pop()
+      self.values.pop(key, None)
+      pending.extend(self.dependents.pop(key, ()))
+
+  def _getOption(
+    self,
+    profile: BuildoutProfile,
+    key: _OptionKey,
+  ) -> Optional[BuildoutOptionDefinition]:
+    """Get an option of a section, or of the macro extended by this section."""
+    section_name, option_name = key
+    section = profile[section_name]
+    option = section.get(option_name)
+    if option is None and "<" in section:
+      macro_name = section["<"].value
+      self.dependents[(section_name, "<")].add(key)
+      self.dependents[(macro_name, option_name)].add(key)
+      option = profile[macro_name].get(option_name)
+    return option
+
+  def resolve(
+    self,
+    profile: BuildoutProfile,
+    section_name: str,
+    option_name: str,
+  ) -> str:
+    key = (section_name, option_name)
+    value = self.values.get(key)
+    if value is None:
+      option = self._getOption(profile, key)
+      if option is None:
+        raise KeyError(option_name)
+      value, _ = self._resolve(profile, key, option.value)
+    return value
+
+  def _resolve(
+    self,
+    profile: BuildoutProfile,
+    key: _OptionKey,
+    value: str,
+  ) -> Tuple[str, bool]:
+    """Substitute the references in `value` of option `key`.
+
+    Returns the substituted value and a flag true if the value can be
+    memoized. Values depending on a circular reference are not memoized,
+    because they depend on the option where resolution started.
+    """
+    memoized = self.values.get(key)
+    if memoized is not None:
+      return memoized, True
+    if key in self._resolving:
+      return value, False
+    self._resolving.add(key)
+    memoizable = True
+    section_name = key[0]
+
+    def _sub(match: Match[str]) -> str:
+      nonlocal memoizable
+      referenced_key = (match.group("section") or section_name, match.group("option"))
+      self.dependents[referenced_key].add(key)
+      if referenced_key[0] in profile:
+        referenced_option = self._getOption(profile, referenced_key)
+        if referenced_option is not None:
+          resolved, referenced_memoizable = self._resolve(
+            profile, referenced_key, referenced_option.value
+          )
+          memoizable = memoizable and referenced_memoizable
+          return resolved
+      return value
+
+    try:
+      resolved = option_reference_strict_re.sub(_sub, value)
+    finally:
+      self._resolving.discard(key)
+    if memoizable:
+      self.values[key] = resolved
+    return resolved, memoizable
 
 
 class ResolvedBuildout(BuildoutProfile):
@@ -931,6 +1209,64 @@ class ResolvedBuildout(BuildoutProfile):
     def copy(self) -> "ResolvedBuildout": ...
 
 
+class SectionDiff(NamedTuple):
+  """Options added, removed or changed in a section."""
+
+  added_options: FrozenSet[str]
+  removed_options: FrozenSet[str]
+  changed_options: FrozenSet[str]
+
+
+class ProfileDiff(NamedTuple):
+  """Sections added, removed or changed between two versions of a profile."""
+
+  added_sections: FrozenSet[str]
+  removed_sections: FrozenSet[str]
+  changed_sections: Dict[str, SectionDiff]
+
+  @property
+  def sections(self) -> FrozenSet[str]:
+    """Names of all the sections added, removed or changed."""
+    return self.added_sections | self.removed_sections | self.changed_sections.keys()
+
+
+def _getOptionState(
+  option: BuildoutOptionDefinition,
+) -> Tuple[Tuple[str, ...], Tuple[Location, ...], Tuple[bool, ...]]:
+  return option.values, option.locations, option.default_values
+
+
+def diffProfiles(old: BuildoutProfile, new: BuildoutProfile) -> ProfileDiff:
+  """Compare two versions of a parsed profile.
+
+  An option is changed when its value or its location changed, so inserting
+  lines in a section also changes the sections after it.
+  """
+  changed_sections: Dict[str, SectionDiff] = {}
+  for section_name in new.keys():
+    if section_name not in old:
+      continue
+    old_section = old[section_name]
+    new_section = new[section_name]
+    section_diff = SectionDiff(
+      added_options=frozenset(new_section.keys() - old_section.keys()),
+      removed_options=frozenset(old_section.keys() - new_section.keys()),
+      changed_options=frozenset(
+        option_name
+        for option_name in old_section.keys() & new_section.keys()
+        if _getOptionState(old_section[option_name])
+        != _getOptionState(new_section[option_name])
+      ),
+    )
+    if any(section_diff):
+      changed_sections[section_name] = section_diff
+  return ProfileDiff(
+    added_sections=frozenset(new.keys() - old.keys()),
+    removed_sections=frozenset(old.keys() - new.keys()),
+    changed_sections=changed_sections,
+  )
+
+
 ### cache ###
 
 # a cache of un-resolved buildouts by uri
@@ -946,16 +1282,282 @@ _resolved_extends_cache: Dict[Tuple[URI, ...], BuildoutProfile] = {}
 # a mapping of dependencies between extends, so that we can clear caches when
 # a profile is modified.
 _extends_dependency_graph: Dict[URI, Set[URI]] = collections.defaultdict(set)
+# number of hits and misses of the caches, like ``{"parse.hit": 3}``
+cache_statistics: Dict[str, int] = collections.Counter()
+
+
+class TemplateReference(NamedTuple):
+  """A template used by a profile, in the `option_name` of `section_name`."""
+
+  profile_uri: URI
+  section_name: str
+  option_name: str
+
+
+class TemplateIndex:
+  """Index of the templates used by the profiles.
+
+  Profiles are indexed when they are resolved, so that the profile using a
+  template is found from the references to this template, without resolving
+  all the candidate profiles again.
+  The templates of a profile are collected the first time the index is
+  queried, so that indexing does not compute all the lazy sections of
+  profiles.
+  """
+
+  def __init__(self) -> None:
+    # profiles added and not indexed yet
+    self._pending: Dict[URI, BuildoutProfile] = {}
+    # templates used by each indexed profile, with the profile dependencies
+    self._profiles: Dict[URI, Tuple[FrozenSet[URI], Dict[URI, TemplateReference]]] = {}
+    # references to each template
+    self._templates: Dict[URI, Dict[URI, TemplateReference]] = collections.defaultdict(
+      dict
+    )
+
+  def add(self, profile: BuildoutProfile) -> None:
+    self.remove(profile.uri)
+    self._pending[profile.uri] = profile
+
+  def _indexPending(self) -> None:
+    """Index all the profiles added."""
+    while self._pending:
+      _, profile = self._pending.popitem()
+      self._index(profile)
+
+  def _index(self, profile: BuildoutProfile) -> None:
+    try:
+      references = profile.getTemplateReferences()
+    except Exception:
+      logger.debug("Error indexing templates of %s", profile.uri, exc_info=True)
+      return
+    self._profiles[profile.uri] = (profile.dependencies, references)
+    for template_uri, reference in references.items():
+      self._templates[template_uri][profile.uri] = reference
+
+  def remove(self, profile_uri: URI) -> None:
+    self._pending.pop(profile_uri, None)
+    _, references = self._profiles.pop(profile_uri, (frozenset(), {}))
+    for template_uri in references:
+      self._templates[template_uri].pop(profile_uri, None)
+      if not self._templates[template_uri]:
+        del self._templates[template_uri]
+
+  def getProfileTemplates(
+    self,
+    profile_uri: URI,
+    session: Optional["SessionCache"] = None,
+  ) -> Optional[Dict[URI, TemplateReference]]:
+    """Return the templates used by a profile, or None if the profile is not
+    indexed.
+
+    Profiles depending on documents opened in `session` are not indexed.
+    """
+    # only this profile is indexed, the other profiles added are indexed
+    # when they are queried
+    profile = self._pending.pop(profile_uri, None)
+    if profile is not None:
+      self._index(profile)
+    indexed = self._profiles.get(profile_uri)
+    if indexed is None:
+      return None
+    dependencies, references = indexed
+    if session is not None and not session.open_uris.isdisjoint(dependencies):
+      return None
+    return references
+
+  def getReferences(
+    self,
+    template_uri: URI,
+    session: Optional["SessionCache"] = None,
+  ) -> List[TemplateReference]:
+    """Return the references to a template from indexed profiles.
+
+    Profiles depending on documents opened in `session` are not indexed.
+    """
+    self._indexPending()
+    references = sorted(self._templates.get(template_uri, {}).values())
+    if session is not None:
+      open_uris = session.open_uris
+      references = [
+        reference
+        for reference in references
+        if open_uris.isdisjoint(self._profiles[reference.profile_uri][0])
+      ]
+    return references
+
+  def clearCache(self, uri: URI) -> None:
+    """Remove the profiles depending on uri."""
+    for profile_uri, profile in list(self._pending.items()):
+      if uri in profile.dependencies:
+        del self._pending[profile_uri]
+    for profile_uri, (dependencies, _) in list(self._profiles.items()):
+      if uri in dependencies:
+        self.remove(profile_uri)
+
+  def clear(self) -> None:
+    self._pending.clear()
+    self._profiles.clear()
+    self._templates.clear()
+
+
+_template_index = TemplateIndex()
+
+
+class SessionCache:
+  """Caches of a client session, when a language server is shared between clients.
+
+  Documents opened in a client can have unsaved modifications, so the profiles
+  parsed from these documents and the buildouts resolved from these profiles are
+  cached in the session, other profiles and buildouts are cached in the shared
+  caches.
+  """
+
+  def __init__(self, open_uris: Callable[[], AbstractSet[URI]]):
+    self._open_uris = open_uris
+    self.parse_cache: Dict[URI, BuildoutProfile] = {}
+    self.resolved_buildout_cache: Dict[URI, ResolvedBuildout] = {}
+    self.resolved_extends_cache: Dict[Tuple[URI, ...], BuildoutProfile] = {}
+    _session_caches.add(self)
+
+  @property
+  def open_uris(self) -> AbstractSet[URI]:
+    """URIs of the documents opened in this session."""
+    return self._open_uris()
+
+  def isPrivate(self, buildout: BuildoutProfile) -> bool:
+    """Check if buildout depends on documents opened in this session."""
+    return not self.open_uris.isdisjoint(buildout.dependencies)
+
+  def clearCache(self, uri: URI) -> None:
+    """Clear the caches of this session for uri and the buildouts depending on uri."""
+    self.parse_cache.pop(uri, None)
+    for resolved_uri, resolved in list(self.resolved_buildout_cache.items()):
+      if uri in resolved.dependencies:
+        del self.resolved_buildout_cache[resolved_uri]
+    for extends, extended in list(self.resolved_extends_cache.items()):
+      if uri in extended.dependencies:
+        del self.resolved_extends_cache[extends]
+
+  def clear(self) -> None:
+    self.parse_cache.clear()
+    self.resolved_buildout_cache.clear()
+    self.resolved_extends_cache.clear()
 
 
-def clearCache(uri: URI) -> None:
+_session_caches: "weakref.WeakSet[SessionCache]" = weakref.WeakSet()
+
+
+def clearCache(uri: URI, ls: Optional[DocumentSourceLike] = None) -> None:
   """Clear all caches for uri.
 
   This is to be called when the document is modified.
+
+  When `ls` has a session, only the caches of this session are cleared, this is
+  for modifications that are not saved. Otherwise, the shared caches and the
+  caches of all sessions are cleared.
   """
+  uri = canonical_uri(uri)
   logger.debug("Clearing cache for %s", uri)
+  session = get_document_source(ls).session if ls is not None else None
+  if session is not None:
+    session.clearCache(uri)
+    return
   _parse_cache.pop(uri, None)
   _clearExtendCache(uri, set())
+  _template_index.clearCache(uri)
+  for session in list(_session_caches):
+    session.clearCache(uri)
+
+
+def clearAllCaches() -> None:
+  """Clear all caches."""
+  _parse_cache.clear()
+  _resolved_buildout_cache.clear()
+  _resolved_extends_cache.clear()
+  _extends_dependency_graph.clear()
+  _template_index.clear()
+  cst.clearCache()
+  for session in list(_session_caches):
+    session.clear()
+
+
+async def updateCache(ls: DocumentSourceLike, uri: URI) -> None:
+  """Update the caches for uri after the document was modified.
+
+  This clears the caches like `clearCache`, then resolves again the cached
+  buildouts depending on uri. The sections they already computed are kept,
+  unless they are changed in the new version of the document, directly or
+  through a macro, so that modifying a section of a profile extended by many
+  profiles only merges this section again.
+  """
+  uri = canonical_uri(uri)
+  documents = get_document_source(ls)
+  session = documents.session
+  parse_cache = _parse_cache
+  if session is not None and uri in session.open_uris:
+    parse_cache = session.parse_cache
+  session_resolved_buildout_cache = session.resolved_buildout_cache if session else None
+  session_resolved_extends_cache = session.resolved_extends_cache if session else None
+  previous_profile = parse_cache.get(uri)
+  stale_buildouts = {
+    resolved_uri: resolved
+    for resolved_uri, resolved in (
+      session_resolved_buildout_cache
+      if session_resolved_buildout_cache is not None
+      else _resolved_buildout_cache
+    ).items()
+    if uri in resolved.dependencies
+  }
+  stale_extends = {
+    extends: extended
+    for extends, extended in (
+      session_resolved_extends_cache
+      if session_resolved_extends_cache is not None
+      else _resolved_extends_cache
+    ).items()
+    if uri in extended.dependencies
+  }
+  clearCache(uri, ls)
+  if previous_profile is None or not stale_buildouts:
+    return
+
+  profile = await parse(documents, uri)
+  if _getExtends(previous_profile) != _getExtends(profile):
+    return
+  diff = diffProfiles(previous_profile, profile)
+  logger.debug("Updating cache for %s, changed sections: %s", uri, diff.sections)
+
+  for resolved_uri in stale_buildouts:
+    try:
+      await _open(documents, "", resolved_uri, [], allow_errors=True)
+    except Exception:
+      logger.debug("Error resolving %s", resolved_uri, exc_info=True)
+
+  profiles = {uri: (previous_profile, profile)}
+  _reuseCachedSections(
+    stale_buildouts,
+    _resolved_buildout_cache,
+    session,
+    session_resolved_buildout_cache,
+    diff,
+    profiles,
+  )
+  _reuseCachedSections(
+    stale_extends,
+    _resolved_extends_cache,
+    session,
+    session_resolved_extends_cache,
+    diff,
+    profiles,
+  )
+
+
+def _getExtends(profile: BuildoutProfile) -> Optional[str]:
+  if "buildout" not in profile:
+    return None
+  extends = profile["buildout"].get("extends")
+  return extends.value if extends is not None else None
 
 
 def _clearExtendCache(uri: URI, done: Set[URI]) -> None:
@@ -988,51 +1590,60 @@ def _clearExtendCache(uri: URI, done: Set[URI]) -> None:
 
 _isurl = re.compile("([a-zA-Z0-9+.-]+)://").match
 
+# Section names, option names and URIs are repeated in all the profiles, they
+# are interned so that profiles share one string for each.
+_intern = sys.intern
+# values longer than this, or on multiple lines, are rarely repeated
+_INTERNED_VALUE_MAX_LENGTH = 128
+
+
+def _internValue(value: str) -> str:
+  """Intern short option values, like recipe names."""
+  if len(value) <= _INTERNED_VALUE_MAX_LENGTH and "\n" not in value:
+    return _intern(value)
+  return value
+
 
 async def parse(
-  ls: LanguageServer,
+  ls: DocumentSourceLike,
   uri: URI,
   allow_errors: bool = True,
 ) -> BuildoutProfile:
   """
   Parse a sectioned setup file and return a non-resolved buildout.
 
-  This is a wrapper over _parse which uses language server's workspace to access documents.
+  This is a wrapper over _parse which uses a document source to access documents.
   Returned value changed to a BuildoutProfile instance.
 
   """
+  uri = canonical_uri(uri)
+  documents = get_document_source(ls)
+  parse_cache = _parse_cache
+  if documents.session is not None and uri in documents.session.open_uris:
+    parse_cache = documents.session.parse_cache
   try:
-    return _parse_cache[uri].copy()
+    cached = parse_cache[uri]
   except KeyError:
-    pass
-
-  parsed_uri = urllib.parse.urlparse(uri)
-  if parsed_uri.scheme in (
-    "http",
-    "https",
-  ):
-    try:
-      async with aiohttp_session.get_session().get(uri) as resp:
-        resp.raise_for_status()
-        fp = io.StringIO(await resp.text())
-    except aiohttp.client_exceptions.ClientError:
-      logger.warning("Error parsing from uri %s", uri, exc_info=True)
-      fp = io.StringIO("")
+    cache_statistics["parse.miss"] += 1
   else:
-    document = ls.workspace.get_text_document(uri)
-    try:
-      src = document.source
-    except (UnicodeDecodeError, IOError):
-      if not allow_errors:
-        raise
-      src = ""
-    fp = io.StringIO(src)
+    cache_statistics["parse.hit"] += 1
+    return cached.copy()
+
+  try:
+    src = await documents.read(uri)
+  except aiohttp.client_exceptions.ClientError:
+    logger.warning("Error parsing from uri %s", uri, exc_info=True)
+    src = ""
+  except (UnicodeDecodeError, IOError):
+    if not allow_errors:
+      raise
+    src = ""
   parsed = await _parse(
-    fp,
+    io.StringIO(src),
     uri,
     allow_errors,
   )
-  _parse_cache[uri] = parsed
+  parse_cache[uri] = parsed
   return parsed.copy()
 
 
@@ -1058,8 +1669,14 @@ async def _parse(
   The returned value changed to a BuildoutProfile instance.
 
   """
+  uri = _intern(uri)
   sections = BuildoutProfile(uri, fp.read())
   fp.seek(0)
+  # location of default values, shared by all the default options
+  default_location = Location(
+    uri=uri,
+    range=Range(start=Position(line=0, character=0), end=Position(line=0, character=0)),
+  )
 
   # buildout default values
   sections["buildout"] = BuildoutSection()
@@ -1070,22 +1687,12 @@ async def _parse(
       value = v.value
     sections["buildout"][k] = BuildoutOptionDefinition(
       value=value,
-      location=Location(
-        uri=uri,
-        range=Range(
-          start=Position(line=0, character=0), end=Position(line=0, character=0)
-        ),
-      ),
+      location=default_location,
       default_value=True,
     )
   sections["buildout"]["directory"] = BuildoutOptionDefinition(
     value=".",
-    location=Location(
-      uri=uri,
-      range=Range(
-        start=Position(line=0, character=0), end=Position(line=0, character=0)
-      ),
-    ),
+    location=default_location,
     default_value=True,
   )
   sections.section_header_locations["buildout"] = Location(
@@ -1117,12 +1724,7 @@ async def _parse(
     ):
       slap_connection[k] = BuildoutOptionDefinition(
         value="",
-        location=Location(
-          uri=uri,
-          range=Range(
-            start=Position(line=0, character=0), end=Position(line=0, character=0)
-          ),
-        ),
+        location=default_location,
         default_value=True,
       )
     sections.setdefault("slap-connection", slap_connection)
@@ -1148,20 +1750,24 @@ async def _parse(
     ):
       slap_network_information[k] = BuildoutOptionDefinition(
         value="",
-        location=Location(
-          uri=uri,
-          range=Range(
-            start=Position(line=0, character=0), end=Position(line=0, character=0)
-          ),
-        ),
+        location=default_location,
         default_value=True,
       )
     sections.setdefault("slap-network-information", slap_network_information)
 
+  # _profile_base_location_ is a slapos.buildout extension
+  base_location = "."
+  if "/" in uri:
+    base_location = _intern(uri[: uri.rfind("/")] + "/")
+
   jinja_parser = jinja.JinjaParser()
   cursect: Optional[Dict[str, BuildoutOptionDefinition]] = None
   blockmode = False
   optname: Optional[str] = None
+  # the option continued on the current line, with the end of this line. The
+  # location of the option is updated once, at the end of the option.
+  continued_option: Optional[BuildoutOptionDefinition] = None
+  continued_option_end = (0, 0)
   lineno = -1
   e: Optional[ParsingError] = None
   while True:
@@ -1175,147 +1781,121 @@ async def _parse(
       sections.has_jinja = True
       continue
     line = jinja_parser.line
+    kind, mo = cst.classifyLine(line, cursect is not None, bool(optname), blockmode)
 
-    if line[0] in "#;":
-      continue  # comment
+    if kind in (cst.LineKind.Comment, cst.LineKind.Blank):
+      continue
 
-    if line[0].isspace() and (cursect is not None) and optname:
+    if kind == cst.LineKind.Continuation:
       _line = line
-      # continuation line
       if blockmode:
         line = line.rstrip()
       else:
         line = line.strip()
-        if not line:
-          continue
       assert cursect is not None
       assert optname is not None
-      option_def = cursect[optname]
       # update current option in case of multi line option
-      option_def.updateValue(
-        value=("%s\n%s" % (option_def.value, line)),
-        location=Location(
-          uri=option_def.location.uri,
-          range=Range(
-            start=option_def.location.range.start,
-            end=Position(line=lineno, character=len(_line) - 1),
+      continued_option = cursect[optname]
+      continued_option.appendLine(line)
+      continued_option_end = (lineno, len(_line) - 1)
+      continue
+
+    if continued_option is not None:
+      continued_option.updateLocationEnd(Position(*continued_option_end))
+      continued_option = None
+    if kind == cst.LineKind.SectionHeader:
+      assert mo is not None
+      sectname = _intern(mo.group("name"))
+      sections.section_header_locations[sectname] = Location(
+        uri=uri,
+        range=Range(
+          start=Position(line=lineno, character=0),
+          end=Position(line=lineno + 1, character=0),
+        ),
+      )
+      if sectname in sections:
+        cursect = sections[sectname]
+      else:
+        sections[sectname] = cursect = BuildoutSection()
+        # initialize buildout default options
+        cursect["_buildout_section_name_"] = BuildoutOptionDefinition(
+          location=default_location,
+          value=sectname,
+          default_value=True,
+        )
+        cursect["_profile_base_location_"] = BuildoutOptionDefinition(
+          location=default_location,
+          value=base_location,
+          default_value=True,
+        )
+
+      # So sections can't start with a continuation line
+      optname = None
+    elif kind == cst.LineKind.Option:
+      assert mo is not None
+      assert cursect is not None
+      # option start line, mo.string is the line where => is replaced
+      optname, optval = mo.group("name", "value")
+      assert optname
+      optname = _intern(optname.rstrip())
+      optval = _internValue(optval.strip())
+      optlocation = Location(
+        uri=uri,
+        range=Range(
+          start=Position(
+            line=lineno,
+            character=len(mo.groups()[0]) + 1,
+          ),
+          end=Position(
+            line=lineno,
+            character=len(mo.string) - 1,
           ),
         ),
       )
+      if optname in cursect:
+        option_def = cursect[optname]
+        option_def.overrideValue(optval, optlocation)
+      else:
+        option_def = BuildoutOptionDefinition(value=optval, location=optlocation)
       cursect[optname] = option_def
-
+      blockmode = not optval
+    elif cursect is None:
+      # no section header in the file?
+      if allow_errors:
+        continue
+      raise MissingSectionHeaderError(uri, lineno, line)
     else:
-      header = section_header(line)
-      if header:
-        sectname = header.group("name")
-        sections.section_header_locations[sectname] = Location(
-          uri=uri,
-          range=Range(
-            start=Position(line=lineno, character=0),
-            end=Position(line=lineno + 1, character=0),
-          ),
-        )
-        if sectname in sections:
-          cursect = sections[sectname]
-        else:
-          sections[sectname] = cursect = BuildoutSection()
-          # initialize buildout default options
-          cursect["_buildout_section_name_"] = BuildoutOptionDefinition(
-            location=Location(
-              uri=uri,
-              range=Range(
-                start=Position(line=0, character=0), end=Position(line=0, character=0)
-              ),
-            ),
-            value=sectname,
-            default_value=True,
-          )
-          # _profile_base_location_ is a slapos.buildout extension
-          base_location = "."
-          if "/" in uri:
-            base_location = uri[: uri.rfind("/")] + "/"
-          cursect["_profile_base_location_"] = BuildoutOptionDefinition(
-            location=Location(
-              uri=uri,
-              range=Range(
-                start=Position(line=0, character=0), end=Position(line=0, character=0)
-              ),
-            ),
-            value=base_location,
-            default_value=True,
-          )
+      # a non-fatal parsing error occurred.  set up the
+      # exception but keep going. the exception will be
+      # raised at the end of the file and will contain a
+      # list of all bogus lines
+      if not e:
+        e = ParsingError(uri)
+      e.append(lineno, repr(line))
 
-        # So sections can't start with a continuation line
-        optname = None
-      elif cursect is None:
-        if not line.strip():
-          continue
-        # no section header in the file?
-        if allow_errors:
-          continue
-        raise MissingSectionHeaderError(uri, lineno, line)
-      else:
-        if line[:2] == "=>":
-          line = "<part-dependencies> = " + line[2:]
-        mo = option_start(line)
-        if mo:
-          # option start line
-          optname, optval = mo.group("name", "value")
-          assert optname
-          optname = optname.rstrip()
-          optval = optval.strip()
-          optlocation = Location(
-            uri=uri,
-            range=Range(
-              start=Position(
-                line=lineno,
-                character=len(mo.groups()[0]) + 1,
-              ),
-              end=Position(
-                line=lineno,
-                character=len(line) - 1,
-              ),
-            ),
-          )
-          if optname in cursect:
-            option_def = cursect[optname]
-            option_def.overrideValue(optval, optlocation)
-          else:
-            option_def = BuildoutOptionDefinition(value=optval, location=optlocation)
-          cursect[optname] = option_def
-          blockmode = not optval
-        elif not (optname or line.strip()):
-          # blank line after section start
-          continue
-        else:
-          # a non-fatal parsing error occurred.  set up the
-          # exception but keep going. the exception will be
-          # raised at the end of the file and will contain a
-          # list of all bogus lines
-          if not e:
-            e = ParsingError(uri)
-          e.append(lineno, repr(line))
+  if continued_option is not None:
+    continued_option.updateLocationEnd(Position(*continued_option_end))
 
   # if any parsing errors occurred, raise an exception
   if e and not allow_errors:
     raise e
 
-  # normalize spaces
-  for section in sections.values():
-    for name in section:
-      value = section[name].value
-      if value[:1].isspace():
-        section[name].updateValue(
-          leading_blank_lines.sub("", textwrap.dedent(value.rstrip()))
-        )
-
   return sections
 
 
+def _joinLines(lines: List[str]) -> str:
+  """Join the lines of a multi line value, and normalize spaces."""
+  value = "\n".join(lines)
+  if value[:1].isspace():
+    value = leading_blank_lines.sub("", textwrap.dedent(value.rstrip()))
+  return _internValue(value)
+
+
 async def getProfileForTemplate(
-  ls: LanguageServer,
-  document: TextDocument,
-) -> Optional[URI]:
+  ls: DocumentSourceLike,
+  uri: URI,
+  path: str,
+) -> Optional[TemplateReference]:
   """Find the profile for template.
 
   For example when there's a buildout.cfg containing:
@@ -1325,52 +1905,58 @@ async def getProfileForTemplate(
     input = template.in
     output = template
 
-  when called with `uri` template.in, this function would return `buildout.cfg`.
+  when called with `uri` template.in, this function would return the reference
+  to the template from the ``input`` option of ``[template]`` in
+  ``buildout.cfg``.
 
   """
-  uri = document.uri
+  documents = get_document_source(ls)
 
   def getCandidateBuildoutProfiles() -> Iterator[pathlib.Path]:
-    path = pathlib.Path(document.path).parent
+    candidate_path = pathlib.Path(path).parent
     for _ in range(3):  # look for buildouts up to 3 levels
       # we sort just to have stable behavior
-      for profile in sorted(path.glob("*.cfg")):
+      for profile in sorted(candidate_path.glob("*.cfg")):
         yield profile
-      path = path.parent
+      candidate_path = candidate_path.parent
 
   if slapos_instance_profile_filename_re.match(uri) or not uri.endswith(".cfg"):
+    if not uri.startswith("file://") or not documents.exists(uri):
+      return None
+    # the profiles already resolved are looked up in the template index,
+    # candidate profiles are only resolved if no profile using the template
+    # was resolved yet
+    references = _template_index.getReferences(uri, documents.session)
+    if references:
+      return references[0]
     for buildout_path in getCandidateBuildoutProfiles():
-      resolved_path = str(buildout_path.resolve())
-      # For paths in workspace, we don't use buildout_path.resolve().as_uri(),
-      # because we have fake uri -> path mapping in tests
-      if resolved_path.startswith(ls.workspace.root_path) and ls.workspace.root_uri:
-        buildout_uri = resolved_path.replace(
-          ls.workspace.root_path,
-          ls.workspace.root_uri,
-          1,
+      buildout_uri = documents.path_to_uri(buildout_path)
+      templates = _template_index.getProfileTemplates(buildout_uri, documents.session)
+      if templates is None:
+        logger.debug(
+          "Trying to find templates's buildout with %s -> %s",
+          buildout_path,
+          buildout_uri,
         )
-      else:
-        # but we still need to support the case where the path is outside the workspace
-        buildout_uri = buildout_path.resolve().as_uri()
-      logger.debug(
-        "Trying to find templates's buildout with %s -> %s", buildout_path, buildout_uri
-      )
-      buildout = await _open(
-        ls,
-        "",
-        buildout_uri,
-        [],
-        allow_errors=True,
-      )
-      assert isinstance(buildout, BuildoutProfile)
-      template = await buildout.getTemplate(ls, uri)
-      if template is not None:
-        return buildout_uri
+        buildout = await _open(
+          documents,
+          "",
+          buildout_uri,
+          [],
+          allow_errors=True,
+        )
+        assert isinstance(buildout, BuildoutProfile)
+        templates = _template_index.getProfileTemplates(buildout_uri, documents.session)
+        if templates is None:
+          templates = buildout.getTemplateReferences()
+      reference = templates.get(uri)
+      if reference is not None:
+        return reference
   return None
 
 
 async def open(
-  ls: LanguageServer,
+  ls: DocumentSourceLike,
   uri: URI,
   allow_errors: bool = True,
   force_open_as_buildout_profile: bool = False,
@@ -1384,31 +1970,32 @@ async def open(
   force_open_as_buildout_profile is used to force assuming that this file is a
   buildout profile (and not a buildout template).
 
-  For buildout, it is a wrapper over _open which uses language server's workspace
+  For buildout, it is a wrapper over _open which uses a document source.
   """
-  document = ls.workspace.get_text_document(uri)
+  documents = get_document_source(ls)
+  path = documents.get_path(uri)
   logger.debug("open %s", uri)
   if not force_open_as_buildout_profile:
     # First, try to read as a template, because buildout profiles can be templates.
-    buildout_uri = await getProfileForTemplate(ls, document)
-    if buildout_uri is not None:
+    reference = await getProfileForTemplate(documents, uri, path)
+    if reference is not None:
       buildout = await _open(
-        ls,
+        documents,
         "",
-        buildout_uri,
+        reference.profile_uri,
         [],
         allow_errors=allow_errors,
       )
-      return await buildout.getTemplate(ls, uri)
+      return await buildout._openTemplate(documents, uri)
 
   if BuildoutProfile.looksLikeBuildoutProfile(uri) or force_open_as_buildout_profile:
-    return await _open(ls, "", uri, [], allow_errors=allow_errors)
+    return await _open(documents, "", uri, [], allow_errors=allow_errors)
 
   return None
 
 
 async def _open(
-  ls: LanguageServer,
+  ls: DocumentSourceLike,
   base: str,
   uri: URI,
   seen: List[str],
@@ -1421,14 +2008,24 @@ async def _open(
   This is equivalent of zc.buildout.buildout._open
   """
   logger.debug("_open %r %r", base, uri)
+  documents = get_document_source(ls)
+  session = documents.session
 
-  if not _isurl(uri):
+  if _isurl(uri):
+    uri = canonical_uri(uri)
+  else:
     assert base
-    uri = urllib.parse.urljoin(base, uri)
-  try:
-    return _resolved_buildout_cache[uri].copy()
-  except KeyError:
-    pass
+    uri = join_uri(base, uri)
+  cached = _getCached(
+    uri,
+    _resolved_buildout_cache,
+    session,
+    session.resolved_buildout_cache if session else None,
+  )
+  if cached is not None:
+    cache_statistics["resolved.hit"] += 1
+    return cached.copy()
+  cache_statistics["resolved.miss"] += 1
 
   base = uri[: uri.rfind("/")] + "/"
 
@@ -1439,10 +2036,12 @@ async def _open(
 
   seen.append(uri)
 
-  profile = await parse(ls, uri, allow_errors=allow_errors)
+  profile = await parse(documents, uri, allow_errors=allow_errors)
   extends_option = (
     profile["buildout"].pop("extends", None) if "buildout" in profile else None
   )
+  if extends_option:
+    profile.invalidate_value("buildout", "extends")
 
   result = profile
   has_dynamic_extends = False
@@ -1454,47 +2053,190 @@ async def _open(
     )
     if extends:
       # buildout:extends, as absolute URI that we can use as cache key
-      absolute_extends: Tuple[URI, ...] = tuple(
-        urllib.parse.urljoin(base, x) for x in extends
+      absolute_extends: Tuple[URI, ...] = tuple(join_uri(base, x) for x in extends)
+      cached_eresult = _getCached(
+        absolute_extends,
+        _resolved_extends_cache,
+        session,
+        session.resolved_extends_cache if session else None,
       )
-      if absolute_extends in _resolved_extends_cache:
+      if cached_eresult is not None:
         logger.debug("_open %r was in cache", absolute_extends)
-        eresult = _resolved_extends_cache[absolute_extends]
+        cache_statistics["extends.hit"] += 1
+        eresult = cached_eresult
       else:
-        eresult = await _open(ls, base, extends.pop(0), seen, allow_errors)
+        cache_statistics["extends.miss"] += 1
+        eresult = await _open(documents, base, extends.pop(0), seen, allow_errors)
         for fname in extends:
           has_dynamic_extends = has_dynamic_extends or eresult.has_dynamic_extends
           has_jinja = has_jinja or eresult.has_jinja
-          eresult = _update(eresult, await _open(ls, base, fname, seen, allow_errors))
+          eresult = _update(
+            eresult, await _open(documents, base, fname, seen, allow_errors)
+          )
         for absolute_extend in absolute_extends:
           _extends_dependency_graph[absolute_extend].add(uri)
 
       if not has_dynamic_extends:
-        _resolved_extends_cache[absolute_extends] = eresult
+        _setCached(
+          absolute_extends,
+          eresult,
+          _resolved_extends_cache,
+          session,
+          session.resolved_extends_cache if session else None,
+        )
       result = _update(eresult, profile)
 
   seen.pop()
 
-  for section_name, options in result.items():
-    if "<" in options:
-      try:
-        result[section_name] = _do_extend_raw(
-          section_name,
-          options,
-          result,
-          [],
-        )
-      except ResolveError:
-        # this happens with non top-level buildout
-        pass
+  _extendMacros(result)
 
   result.has_dynamic_extends = has_dynamic_extends
   result.has_jinja = has_jinja
   resolved = cast(ResolvedBuildout, result)
-  _resolved_buildout_cache[uri] = resolved
+  _setCached(
+    uri,
+    resolved,
+    _resolved_buildout_cache,
+    session,
+    session.resolved_buildout_cache if session else None,
+  )
+  if session is None or not session.isPrivate(resolved):
+    _template_index.add(resolved)
   return resolved.copy()
 
 
+_CacheKey = TypeVar("_CacheKey")
+_CachedBuildout = TypeVar("_CachedBuildout", bound=BuildoutProfile)
+
+
+def _getCached(
+  key: _CacheKey,
+  shared_cache: Dict[_CacheKey, _CachedBuildout],
+  session: Optional[SessionCache],
+  session_cache: Optional[Dict[_CacheKey, _CachedBuildout]],
+) -> Optional[_CachedBuildout]:
+  """Lookup a buildout in the session cache, then in the shared cache.
+
+  Buildouts from the shared cache depending on documents opened in the
+  session are ignored, because they were not built from the session
+  version of these documents.
+  """
+  if session is not None:
+    assert session_cache is not None
+    cached = session_cache.get(key)
+    if cached is not None:
+      return cached
+    cached = shared_cache.get(key)
+    if cached is not None and session.isPrivate(cached):
+      return None
+    return cached
+  return shared_cache.get(key)
+
+
+def _setCached(
+  key: _CacheKey,
+  value: _CachedBuildout,
+  shared_cache: Dict[_CacheKey, _CachedBuildout],
+  session: Optional[SessionCache],
+  session_cache: Optional[Dict[_CacheKey, _CachedBuildout]],
+) -> None:
+  """Store a buildout in the session cache if it depends on documents opened
+  in the session, otherwise in the shared cache.
+  """
+  if session is not None and session.isPrivate(value):
+    assert session_cache is not None
+    session_cache[key] = value
+  else:
+    shared_cache[key] = value
+
+
+def _reuseCachedSections(
+  stale: Dict[_CacheKey, _CachedBuildout],
+  shared_cache: Dict[_CacheKey, _CachedBuildout],
+  session: Optional[SessionCache],
+  session_cache: Optional[Dict[_CacheKey, _CachedBuildout]],
+  diff: ProfileDiff,
+  profiles: Dict[URI, Tuple[BuildoutProfile, BuildoutProfile]],
+) -> None:
+  """Reuse the sections of `stale` buildouts in the buildouts cached again
+  with the same keys.
+  """
+  for key, previous in stale.items():
+    resolved = _getCached(key, shared_cache, session, session_cache)
+    if resolved is None:
+      continue
+    changed_sections = _getChangedSections(
+      diff,
+      previous.dependencies | resolved.dependencies,
+      profiles,
+      session,
+    )
+    if changed_sections is not None:
+      _reuseSections(resolved, previous, changed_sections)
+
+
+def _getChangedSections(
+  diff: ProfileDiff,
+  dependencies: AbstractSet[URI],
+  profiles: Dict[URI, Tuple[BuildoutProfile, BuildoutProfile]],
+  session: Optional[SessionCache],
+) -> Optional[Set[str]]:
+  """Return the sections of `diff` and the sections using them as macros in
+  the profiles of `dependencies`, or None if some of these profiles are not
+  cached.
+
+  `profiles` are the previous and new versions of modified profiles.
+  """
+  macro_users: Dict[str, Set[str]] = collections.defaultdict(set)
+  for dependency in dependencies:
+    if dependency in profiles:
+      versions: Sequence[BuildoutProfile] = profiles[dependency]
+    else:
+      parse_cache = _parse_cache
+      if session is not None and dependency in session.open_uris:
+        parse_cache = session.parse_cache
+      if dependency not in parse_cache:
+        return None
+      versions = (parse_cache[dependency],)
+    for profile in versions:
+      for section_name in profile.keys():
+        macros = profile._getLazySection(section_name).get().get("<")
+        if macros is not None:
+          for macro_name in macros.value.split("\n"):
+            macro_users[macro_name.strip()].add(section_name)
+
+  changed_sections = set(diff.sections)
+  pending = list(changed_sections)
+  while pending:
+    for section_name in macro_users.get(pending.pop(), ()):
+      if section_name not in changed_sections:
+        changed_sections.add(section_name)
+        pending.append(section_name)
+  return changed_sections
+
+
+def _reuseSections(
+  resolved: BuildoutProfile,
+  previous: BuildoutProfile,
+  changed_sections: AbstractSet[str],
+) -> None:
+  """Replace the sections of `resolved` by the sections already computed in
+  `previous`, except `changed_sections`, and keep the resolved values of the
+  options of these sections.
+  """
+  for section_name in resolved.keys():
+    if section_name in changed_sections or section_name not in previous:
+      continue
+    section = previous._getLazySection(section_name)
+    if section.computed:
+      dict.__setitem__(cast(Dict[str, object], resolved), section_name, section)
+  if previous._resolved_values is not None:
+    resolved_values = previous._resolved_values.copy()
+    for section_name in changed_sections:
+      resolved_values.invalidate(section_name, None)
+    resolved._resolved_values = resolved_values
+
+
 def _update_section(
   s1: BuildoutSection,
   s2: BuildoutSection,
@@ -1505,7 +2247,7 @@ def _update_section(
     if k == "_profile_base_location_":
       continue
     if k.endswith("-"):
-      k = k.rstrip(" -")
+      k = _intern(k.rstrip(" -"))
       # Find v1 in s2 first; it may have been set by a += operation first
       option_def = s2.get(k, s1.get(k, v))
       new_option_def = option_def.copy()
@@ -1520,7 +2262,7 @@ def _update_section(
       )
       s1[k] = new_option_def
     elif k.endswith("+"):
-      k = k.rstrip(" +")
+      k = _intern(k.rstrip(" +"))
       # Find v1 in s2 first; it may have been defined locally too.
       option_def = s2.get(k, s1.get(k, v))
       option_values = [] if option_def.default_value else option_def.value.split("\n")
@@ -1542,25 +2284,72 @@ def _update_section(
   return s1
 
 
+def _updateLazySection(s1: _LazySection, s2: _LazySection) -> BuildoutSection:
+  return _update_section(s1.get(), s2.get())
+
+
 def _update(d1: BuildoutProfile, d2: BuildoutProfile) -> BuildoutProfile:
-  """update d1 with values from d2"""
+  """update d1 with values from d2
+
+  Sections are updated when they are accessed.
+  """
   d1 = d1.copy()
   d1.uri = d2.uri
   d1.source = d2.source
+  d1.dependencies = d1.dependencies | d2.dependencies
   for section in d2:
     d1.section_header_locations[section] = d2.section_header_locations[section]
+    s2 = d2._getLazySection(section)
     if section in d1:
-      d1[section] = _update_section(d1[section], d2[section])
+      s1 = d1._getLazySection(section)
+      d1._setLazySection(
+        section, _LazySection(functools.partial(_updateLazySection, s1, s2))
+      )
     else:
-      d1[section] = d2[section]
+      d1._setLazySection(section, s2)
   return d1
 
 
+def _extendMacros(buildout: BuildoutProfile) -> None:
+  """Replace the sections using macros by their expansion, in place.
+
+  Sections are expanded when they are accessed.
+  """
+  sections = _LazySections(
+    {section_name: buildout._getLazySection(section_name) for section_name in buildout}
+  )
+  # macros expanded so far, shared by the sections extending them
+  expanded_macros: Dict[str, BuildoutSection] = {}
+  for section_name in sections:
+    buildout._setLazySection(
+      section_name,
+      _LazySection(
+        functools.partial(_extendSection, section_name, sections, expanded_macros)
+      ),
+    )
+
+
+def _extendSection(
+  section_name: str,
+  sections: Mapping[str, BuildoutSection],
+  expanded_macros: Dict[str, BuildoutSection],
+) -> BuildoutSection:
+  section = sections[section_name]
+  if "<" in section:
+    try:
+      return _do_extend_raw(section_name, section, sections, [], expanded_macros)
+    except ResolveError:
+      # this happens with non top-level buildout
+      pass
+  return section
+
+
 def _do_extend_raw(
   name: str,
   section: BuildoutSection,
-  buildout: BuildoutProfile,
+  buildout: Mapping[str, BuildoutSection],
   doing: List[str],
+  expanded: Dict[str, BuildoutSection],
 ) -> BuildoutSection:
   """Extends macros:
 
@@ -1569,9 +2358,16 @@ def _do_extend_raw(
       <= macro
 
   this is zc.buildout.buildout.Option._do_extend_raw
+
+  Expanded sections are memoized in `expanded`, so that a macro used by
+  many sections is expanded once. The returned sections share their option
+  definitions with the macros, this is safe because option definitions are
+  copied before being modified.
   """
   if name == "buildout":
     return section
+  if name in expanded:
+    return expanded[name]
   if name in doing:
     raise RecursiveMacroError("Infinite extending loop %r" % name)
   doing.append(name)
@@ -1589,11 +2385,10 @@ def _do_extend_raw(
       raw = buildout.get(iname)
       if raw is None:
         raise MissingExtendedSection("No section named %r" % iname)
-      result.update(
-        {k: v.copy() for (k, v) in _do_extend_raw(iname, raw, buildout, doing).items()}
-      )
+      result.update(_do_extend_raw(iname, raw, buildout, doing, expanded))
     result = _update_section(result, section)
     result.pop("<", None)
+    expanded[name] = result
     return result
   finally:
     assert doing.pop() == name
@@ -1,8 +1,10 @@
 import argparse
+import asyncio
 import logging
 import sys
 
 from .server import server
+from .util import aiohttp_session, cache_dir, osv
 
 
 def main() -> None:
@@ -26,11 +28,65 @@ def main() -> None:
     help="Include pygls messages in the log",
     action="store_true",
   )
+  parser.add_argument(
+    "--cache-dir",
+    help="Directory for persistent caches, empty to disable persistent caches. "
+    "Defaults to buildoutls in $XDG_CACHE_HOME or ~/.cache",
+    type=str,
+  )
+  parser.add_argument(
+    "--osv-url",
+    help="URL of an OSV compatible vulnerability database, queried in batches "
+    "for known vulnerabilities instead of the package index. "
+    "For example https://api.osv.dev",
+    type=str,
+  )
+  parser.add_argument(
+    "--osv-database",
+    help="Directory or zip file of vulnerabilities in the OSV format, used for "
+    "known vulnerabilities without network access. "
+    "For example https://osv-vulnerabilities.storage.googleapis.com/PyPI/all.zip",
+    type=str,
+  )
+  parser.add_argument(
+    "--http-connect-timeout",
+    help="Timeout to connect to the package index and other hosts, in seconds. "
+    f"Defaults to {aiohttp_session.CONNECT_TIMEOUT:g}",
+    type=float,
+  )
+  parser.add_argument(
+    "--http-read-timeout",
+    help="Timeout between two reads of a response, in seconds. "
+    f"Defaults to {aiohttp_session.READ_TIMEOUT:g}",
+    type=float,
+  )
+  parser.add_argument(
+    "--http-total-timeout",
+    help="Timeout of a whole request, in seconds. "
+    f"Defaults to {aiohttp_session.TOTAL_TIMEOUT:g}",
+    type=float,
+  )
+  parser.add_argument(
+    "--http-connections-per-host",
+    help="Maximum number of connections to each host. "
+    f"Defaults to {aiohttp_session.CONNECTIONS_PER_HOST}",
+    type=int,
+  )
   parser.add_argument(
     "--tcp",
     help="listen on tcp port or hostname:port on IPv4.",
     type=str,
   )
+  parser.add_argument(
+    "--unix-socket",
+    help="listen on unix socket at this path, only in daemon mode.",
+    type=str,
+  )
+  parser.add_argument(
+    "--daemon",
+    help="Accept many clients on --tcp or --unix-socket, sharing caches between clients.",
+    action="store_true",
+  )
 
   options = parser.parse_args()
   if options.check_install:
@@ -48,11 +104,40 @@ def main() -> None:
     if not options.log_pygls:
       logging.getLogger("pygls").setLevel(logging.CRITICAL)
 
-  if options.tcp:
-    host = "localhost"
-    port = options.tcp
-    if ":" in options.tcp:
-      host, port = options.tcp.split(":")
+  if options.cache_dir is not None:
+    cache_dir.set_cache_directory(options.cache_dir)
+  if options.osv_url:
+    osv.set_osv_url(options.osv_url)
+  if options.osv_database:
+    osv.set_osv_database(options.osv_database)
+  aiohttp_session.set_timeouts(
+    options.http_connect_timeout,
+    options.http_read_timeout,
+    options.http_total_timeout,
+  )
+  aiohttp_session.set_connections_per_host(options.http_connections_per_host)
+
+  if options.daemon and not (options.tcp or options.unix_socket):
+    parser.error("--daemon requires --tcp or --unix-socket")
+  if options.unix_socket and not options.daemon:
+    parser.error("--unix-socket requires --daemon")
+
+  host = "localhost"
+  port = options.tcp
+  if options.tcp and ":" in options.tcp:
+    host, port = options.tcp.split(":")
+
+  if options.daemon:
+    from .daemon import Daemon
+
+    daemon = Daemon()
+    if options.unix_socket:
+      print("Listening on {}".format(options.unix_socket))
+      asyncio.run(daemon.serveUnix(options.unix_socket))
+    else:
+      print("Listening on {}:{}".format(host, port))
+      asyncio.run(daemon.serveTCP(host, int(port)))
+  elif options.tcp:
     print("Listening on {}:{}".format(host, port))
     server.start_tcp(host, int(port))
   else:
@@ -127,4 +127,22 @@ async def getCodeActions(
             is_preferred=True,
           ),
         )
+      if package_info.latest_version_in_series:
+        code_actions.insert(
+          1,
+          CodeAction(
+            title=f"Use version {package_info.latest_version_in_series}",
+            kind=CodeActionKind.QuickFix,
+            edit=WorkspaceEdit(
+              changes={
+                params.text_document.uri: [
+                  TextEdit(
+                    range=diagnostic.range,
+                    new_text=" " + package_info.latest_version_in_series,
+                  ),
+                ]
+              }
+            ),
+          ),
+        )
   return code_actions
@@ -2,3 +2,5 @@ COMMAND_OPEN_PYPI_PAGE = "command/openPypiPage"
 COMMAND_UPDATE_MD5SUM = "command/updateMD5sum"
 COMMAND_START_PROFILING = "command/startProfiling"
 COMMAND_STOP_PROFILING = "command/stopProfiling"
+COMMAND_MEMORY_REPORT = "command/memoryReport"
+COMMAND_HTTP_REPORT = "command/httpReport"
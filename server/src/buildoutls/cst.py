@@ -0,0 +1,421 @@
+"""Lossless concrete syntax tree of buildout profiles.
+
+The syntax tree keeps every line of the source, with its kind and the spans of
+section names, option keys, operators and values, so that the exact text and
+offsets of everything in a profile are available without scanning the source
+again. Lines are classified by `classifyLine`, which is also used by the
+parser, taking jinja into account.
+
+Each line remembers the state of the lexer before it, so after an edit only
+the lines from the first changed line up to the line where this state is the
+same as before the edit are lexed again, the other lines are reused.
+"""
+
+import bisect
+import collections
+import enum
+import itertools
+from typing import Dict, List, Match, NamedTuple, Optional, Tuple
+
+from zc.buildout.configparser import option_start, section_header
+
+from . import jinja
+
+URI = str
+
+# number of syntax trees kept by getSyntaxTree
+CACHE_SIZE = 128
+
+# a span of text, as a start and end offsets in a line
+Span = Tuple[int, int]
+
+# jinja state, in a section, in an option, in a block mode option
+LexerState = Tuple[jinja.JinjaParserState, bool, bool, bool]
+
+_initial_state: LexerState = (jinja.JinjaParser().getState(), False, False, False)
+
+
+class LineKind(str, enum.Enum):
+  Blank = "blank"
+  Comment = "comment"
+  # in a jinja statement, comment or block
+  Jinja = "jinja"
+  SectionHeader = "section_header"
+  # first line of an option
+  Option = "option"
+  # continuation line of a multi line option
+  Continuation = "continuation"
+  # text outside of a section, or a line that is not an option
+  Error = "error"
+
+
+class SyntaxLine(NamedTuple):
+  kind: LineKind
+  # text of the line, with the line ending
+  text: str
+  # state of the lexer before this line
+  state: LexerState
+  # name of the section or of the option, as understood by the parser
+  name: Optional[str] = None
+  # section name or option key
+  key: Optional[Span] = None
+  # =, += or -= for options, => for part dependencies
+  operator: Optional[Span] = None
+  # value of options and continuation lines, without surrounding spaces
+  value: Optional[Span] = None
+
+
+class OptionNode(NamedTuple):
+  name: str
+  # lines of the option, the first line and the last continuation line
+  start_line: int
+  end_line: int
+
+
+class SectionNode(NamedTuple):
+  name: str
+  # line of the section header
+  start_line: int
+  # last line before the next section header
+  end_line: int
+  options: List[OptionNode]
+
+
+def _splitLines(source: str) -> List[str]:
+  """Split source in lines with their line ending, like the parser reading
+  lines from a file.
+  """
+  lines = source.split("\n")
+  last_line = lines.pop()
+  result = [line + "\n" for line in lines]
+  if last_line:
+    result.append(last_line)
+  return result
+
+
+def _getStrippedSpan(text: str, start: int, end: int) -> Span:
+  """The span of text[start:end] without surrounding spaces."""
+  value = text[start:end]
+  stripped = value.lstrip()
+  start += len(value) - len(stripped)
+  return start, start + len(stripped.rstrip())
+
+
+def _getLineEnd(text: str) -> int:
+  return len(text.rstrip("\r\n"))
+
+
+def classifyLine(
+  line: str,
+  in_section: bool,
+  in_option: bool,
+  blockmode: bool,
+) -> Tuple[LineKind, Optional[Match[str]]]:
+  """Classify a line outside of jinja, like zc.buildout's parser.
+
+  `line` is the line with its jinja expressions replaced, see
+  `jinja.JinjaParser.line`. The match of `section_header` is returned for
+  section headers and the match of `option_start` for options, ``=>`` being
+  replaced by ``<part-dependencies> =``.
+  """
+  if line[0] in "#;":
+    return LineKind.Comment, None
+
+  if line[0].isspace() and in_section and in_option:
+    if not blockmode and not line.strip():
+      return LineKind.Blank, None
+    return LineKind.Continuation, None
+
+  header = section_header(line) if line[0] == "[" else None
+  if header:
+    return LineKind.SectionHeader, header
+  if not in_section:
+    if not line.strip():
+      return LineKind.Blank, None
+    return LineKind.Error, None
+
+  if line[:2] == "=>":
+    line = "<part-dependencies> = " + line[2:]
+  match = option_start(line)
+  if match:
+    return LineKind.Option, match
+  if not (in_option or line.strip()):
+    return LineKind.Blank, None
+  return LineKind.Error, None
+
+
+def _lexLine(
+  text: str,
+  state: LexerState,
+  jinja_parser: jinja.JinjaParser,
+) -> Tuple[SyntaxLine, LexerState]:
+  """Lex a line, with jinja_parser in the jinja state of state."""
+  jinja_state, in_section, in_option, blockmode = state
+  jinja_parser.feed(text)
+  next_state = state
+  # the jinja state can only change on lines with jinja, or when a multi line
+  # jinja comment, expression or statement is open.
+  if "{" in text or any(jinja_state[2:]):
+    next_jinja_state = jinja_parser.getState()
+    if next_jinja_state != jinja_state:
+      next_state = (next_jinja_state, in_section, in_option, blockmode)
+  if jinja_parser.is_in_jinja:
+    return SyntaxLine(LineKind.Jinja, text, state), next_state
+
+  kind, match = classifyLine(jinja_parser.line, in_section, in_option, blockmode)
+  if kind == LineKind.Continuation:
+    return (
+      SyntaxLine(kind, text, state, value=_getStrippedSpan(text, 0, _getLineEnd(text))),
+      next_state,
+    )
+
+  if kind == LineKind.SectionHeader:
+    assert match is not None
+    key = None
+    if not jinja_parser.has_expression:
+      key = match.span("name")
+    return (
+      SyntaxLine(kind, text, state, match.group("name"), key),
+      (next_state[0], True, False, False),
+    )
+
+  if kind == LineKind.Option:
+    assert match is not None
+    name, value = match.group("name", "value")
+    next_state = (next_state[0], True, True, not value.strip())
+    if text[:2] == "=>":
+      return (
+        SyntaxLine(
+          kind,
+          text,
+          state,
+          "<part-dependencies>",
+          operator=(0, 2),
+          value=_getStrippedSpan(text, 2, _getLineEnd(text)),
+        ),
+        next_state,
+      )
+    key = operator = value_span = None
+    # spans are in the text of the line, where jinja expressions are not
+    # replaced
+    text_match = option_start(text) if jinja_parser.has_expression else match
+    if text_match:
+      name_start, name_end = text_match.span("name")
+      key_end = name_start + len(text_match.group("name").rstrip(" \t+-"))
+      operator = (name_end, name_end + 1)
+      if text[name_end - 1] in "+-":
+        operator = (name_end - 1, name_end + 1)
+      key = (name_start, key_end)
+      value_span = _getStrippedSpan(text, name_end + 1, _getLineEnd(text))
+    return (
+      SyntaxLine(kind, text, state, name.rstrip(), key, operator, value_span),
+      next_state,
+    )
+  return SyntaxLine(kind, text, state), next_state
+
+
+def _lex(
+  texts: List[str],
+  state: LexerState,
+) -> Tuple[List[SyntaxLine], LexerState]:
+  jinja_parser = jinja.JinjaParser()
+  jinja_parser.setState(state[0])
+  lines = []
+  for text in texts:
+    line, state = _lexLine(text, state, jinja_parser)
+    lines.append(line)
+  return lines, state
+
+
+class SyntaxTree:
+  """The concrete syntax tree of a profile.
+
+  Lines are numbered from 0 like in the language server protocol and offsets
+  are in characters from the start of the source.
+  """
+
+  def __init__(
+    self,
+    source: str,
+    lines: List[SyntaxLine],
+    end_state: LexerState,
+  ) -> None:
+    self.source = source
+    self.lines = lines
+    # state of the lexer after the last line
+    self._end_state = end_state
+    self._line_offsets: Optional[List[int]] = None
+    self._sections: Optional[List[SectionNode]] = None
+    self._options: Optional[Dict[int, OptionNode]] = None
+    self._section_start_lines: List[int] = []
+
+  @classmethod
+  def parse(cls, source: str) -> "SyntaxTree":
+    return cls(source, *_lex(_splitLines(source), _initial_state))
+
+  def reparse(self, source: str) -> "SyntaxTree":
+    """Return the syntax tree of source, an edited version of this tree's
+    source, reusing the lines that are not changed by the edit.
+    """
+    if source == self.source:
+      return self
+    texts = _splitLines(source)
+    old_lines = self.lines
+    common_length = min(len(texts), len(old_lines))
+    prefix = 0
+    while prefix < common_length and old_lines[prefix].text == texts[prefix]:
+      prefix += 1
+    suffix = 0
+    while (
+      suffix < common_length - prefix
+      and old_lines[-1 - suffix].text == texts[-1 - suffix]
+    ):
+      suffix += 1
+
+    lines = old_lines[:prefix]
+    state = old_lines[prefix].state if prefix < len(old_lines) else self._end_state
+    jinja_parser = jinja.JinjaParser()
+    jinja_parser.setState(state[0])
+    # lines after the edit are reused as soon as the state before them is the
+    # same as before the edit.
+    unchanged_start = len(texts) - suffix
+    shift = len(old_lines) - len(texts)
+    for line_number in range(prefix, len(texts)):
+      if line_number >= unchanged_start:
+        old_line = old_lines[line_number + shift]
+        if old_line.state == state:
+          lines.extend(old_lines[line_number + shift :])
+          return SyntaxTree(source, lines, self._end_state)
+      line, state = _lexLine(texts[line_number], state, jinja_parser)
+      lines.append(line)
+    return SyntaxTree(source, lines, state)
+
+  @property
+  def line_offsets(self) -> List[int]:
+    """The offset of the start of each line."""
+    if self._line_offsets is None:
+      self._line_offsets = [0]
+      self._line_offsets.extend(
+        itertools.accumulate(len(line.text) for line in self.lines)
+      )
+      self._line_offsets.pop()
+    return self._line_offsets
+
+  def getOffset(self, line: int, character: int) -> int:
+    """The offset of a position in the source."""
+    return self.line_offsets[line] + character
+
+  def getLineText(self, line: int) -> str:
+    """The text of a line, without the line ending. Empty for lines after the
+    end of the source.
+    """
+    if 0 <= line < len(self.lines):
+      return self.lines[line].text.rstrip("\r\n")
+    return ""
+
+  def getText(self, line: int, span: Span) -> str:
+    """The text of a span of a line."""
+    return self.lines[line].text[span[0] : span[1]]
+
+  @property
+  def sections(self) -> List[SectionNode]:
+    """The sections, in the order of the source. A section can appear more
+    than once.
+    """
+    if self._sections is None:
+      self._buildNodes()
+      assert self._sections is not None
+    return self._sections
+
+  def _buildNodes(self) -> None:
+    sections: List[SectionNode] = []
+    options: Dict[int, OptionNode] = {}
+    section: Optional[SectionNode] = None
+    option: Optional[OptionNode] = None
+
+    def endOption() -> None:
+      if option is not None and section is not None:
+        section.options.append(option)
+        options[option.start_line] = option
+
+    for line_number, line in enumerate(self.lines):
+      kind = line.kind
+      if kind is LineKind.Continuation and option is not None:
+        option = option._replace(end_line=line_number)
+      elif kind is LineKind.Option:
+        endOption()
+        assert line.name is not None
+        option = OptionNode(line.name, line_number, line_number)
+      elif kind is LineKind.SectionHeader:
+        endOption()
+        option = None
+        if section is not None:
+          sections.append(section._replace(end_line=line_number - 1))
+        assert line.name is not None
+        section = SectionNode(line.name, line_number, line_number, [])
+    endOption()
+    if section is not None:
+      sections.append(section._replace(end_line=len(self.lines) - 1))
+    self._sections = sections
+    self._options = options
+    self._section_start_lines = [section.start_line for section in sections]
+
+  def getOption(self, start_line: int) -> Optional[OptionNode]:
+    """The option starting at start_line."""
+    if self._options is None:
+      self._buildNodes()
+      assert self._options is not None
+    return self._options.get(start_line)
+
+  def getSection(self, line: int) -> Optional[SectionNode]:
+    """The section containing line."""
+    sections = self.sections
+    index = bisect.bisect_right(self._section_start_lines, line) - 1
+    if index < 0:
+      return None
+    return sections[index]
+
+  def getContext(self, line: int) -> Tuple[Optional[str], Optional[str]]:
+    """The names of the section and option containing line."""
+    section = self.getSection(line)
+    if section is None:
+      return None, None
+    for option in section.options:
+      if option.start_line <= line <= option.end_line:
+        return section.name, option.name
+    return section.name, None
+
+  def getOptionValueSpans(self, option: OptionNode) -> List[Tuple[int, Span]]:
+    """The line numbers and spans of the non empty values of an option."""
+    spans = []
+    for line_number in range(option.start_line, option.end_line + 1):
+      line = self.lines[line_number]
+      value = line.value
+      if value is not None and value[0] != value[1]:
+        spans.append((line_number, value))
+    return spans
+
+
+_syntax_trees: "collections.OrderedDict[URI, SyntaxTree]" = collections.OrderedDict()
+
+
+def getSyntaxTree(uri: URI, source: str) -> SyntaxTree:
+  """The syntax tree of the profile at uri with this source.
+
+  The syntax tree of the previous version of the profile is reused for the
+  lines that did not change.
+  """
+  tree = _syntax_trees.get(uri)
+  if tree is None:
+    tree = SyntaxTree.parse(source)
+  elif tree.source is not source:
+    tree = tree.reparse(source)
+  _syntax_trees[uri] = tree
+  _syntax_trees.move_to_end(uri)
+  while len(_syntax_trees) > CACHE_SIZE:
+    _syntax_trees.popitem(last=False)
+  return tree
+
+
+def clearCache() -> None:
+  _syntax_trees.clear()
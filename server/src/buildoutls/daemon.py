@@ -0,0 +1,251 @@
+"""Language server shared between several clients.
+
+In daemon mode, the language server accepts many clients over TCP or a unix
+socket. Each client connection is a session with its own language server
+instance and its own workspace, so that documents opened in an editor, with
+their unsaved modifications, are only visible to this editor.
+
+The caches of parsed and resolved profiles and the PyPI caches are shared
+between all sessions. Profiles depending on documents opened in a session are
+cached in the session, see `buildoutls.buildout.SessionCache`.
+"""
+
+import asyncio
+import logging
+import sys
+import threading
+import types
+from typing import (
+  AbstractSet,
+  Any,
+  Callable,
+  Dict,
+  Generator,
+  Iterable,
+  List,
+  Optional,
+  Set,
+)
+
+from lsprotocol.types import EXIT, LogMessageParams, MessageType
+from pygls.io_ import run_async
+from pygls.lsp.server import LanguageServer
+from pygls.protocol import LanguageServerProtocol
+from pygls.protocol.language_server import lsp_method
+
+from . import buildout, code_actions, commands, diagnostic, prefetch
+from .documents import DocumentSource, HTTPDocumentSource, WorkspaceDocumentSource
+from .server import server as shared_server
+
+logger = logging.getLogger(__name__)
+
+
+class SessionProtocol(LanguageServerProtocol):
+  """Protocol of a session, where `exit` only ends the session."""
+
+  @lsp_method(EXIT)
+  def lsp_exit(self, *args: Any) -> Generator[Any, Any, None]:
+    if (user_handler := self.fm.features.get(EXIT)) is not None:
+      yield user_handler, args, None
+    self._server.shutdown()
+    if self.writer is not None:
+      self.writer.close()
+
+
+class SessionServer(LanguageServer):
+  """The language server of one client session."""
+
+  def __init__(self, session_id: int):
+    super().__init__(
+      name=shared_server.name,
+      version=shared_server.version,
+      protocol_cls=SessionProtocol,
+    )
+    self.session_id = session_id
+    self.session_cache = buildout.SessionCache(self._getOpenUris)
+    self._document_source: Optional[DocumentSource] = None
+
+    # register the same features as the language server
+    feature_manager = shared_server.protocol.fm
+    for feature_name, feature in feature_manager.features.items():
+      self.feature(feature_name, feature_manager.feature_options.get(feature_name))(
+        _unwrap(feature)
+      )
+    for command_name, command in feature_manager.commands.items():
+      self.command(command_name)(_unwrap(command))
+
+  def _getOpenUris(self) -> AbstractSet[str]:
+    if self.protocol._workspace is None:
+      return frozenset()
+    text_documents: Dict[str, Any] = self.protocol._workspace.text_documents
+    return text_documents.keys()
+
+  @property
+  def document_source(self) -> DocumentSource:
+    """Document source using the caches of this session."""
+    if self._document_source is None:
+      self._document_source = HTTPDocumentSource(
+        WorkspaceDocumentSource(self.workspace, self.session_cache)
+      )
+    return self._document_source
+
+
+def _unwrap(f: Callable[..., Any]) -> Callable[..., Any]:
+  """Return the function registered with `LanguageServer.feature`, before it
+  was bound to the language server."""
+  return getattr(f, "func", f)
+
+
+def _approximateSize(objects: Iterable[Any], seen: Set[int]) -> int:
+  """Approximate the memory used by objects and everything they reference,
+  skipping objects in `seen`.
+  """
+  size = 0
+  stack = list(objects)
+  while stack:
+    obj = stack.pop()
+    if id(obj) in seen or isinstance(
+      obj, (type, types.ModuleType, types.FunctionType, types.MethodType)
+    ):
+      continue
+    seen.add(id(obj))
+    size += sys.getsizeof(obj)
+    if isinstance(obj, dict):
+      stack.extend(obj.keys())
+      stack.extend(obj.values())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+      stack.extend(obj)
+    if hasattr(obj, "__dict__"):
+      stack.append(obj.__dict__)
+    for klass in type(obj).__mro__:
+      for slot in getattr(klass, "__slots__", ()):
+        if hasattr(obj, slot):
+          stack.append(getattr(obj, slot))
+  return size
+
+
+class Daemon:
+  """Accept language server clients and manage their sessions."""
+
+  def __init__(self) -> None:
+    self.sessions: Dict[int, SessionServer] = {}
+    self._next_session_id = 0
+
+  def createSession(self) -> SessionServer:
+    self._next_session_id += 1
+    session = SessionServer(self._next_session_id)
+
+    @session.command(commands.COMMAND_MEMORY_REPORT)
+    def commandMemoryReport(ls: LanguageServer, *args: Any) -> Dict[str, Any]:
+      return self._commandMemoryReport(ls)
+
+    self.sessions[session.session_id] = session
+    return session
+
+  def closeSession(self, session: SessionServer) -> None:
+    self.sessions.pop(session.session_id, None)
+    session.session_cache.clear()
+    if session.protocol._workspace is not None:
+      prefetch.cancelPrefetch(session.protocol._workspace)
+
+  async def handleConnection(
+    self,
+    reader: asyncio.StreamReader,
+    writer: asyncio.StreamWriter,
+  ) -> None:
+    session = self.createSession()
+    logger.info(
+      "Session %s started, %s active sessions", session.session_id, len(self.sessions)
+    )
+    session._stop_event = stop_event = threading.Event()
+    session.protocol.set_writer(writer)
+    try:
+      await run_async(
+        stop_event=stop_event,
+        reader=reader,
+        protocol=session.protocol,
+        logger=logger,
+        error_handler=session.report_server_error,
+      )
+    finally:
+      self.closeSession(session)
+      writer.close()
+      logger.info(
+        "Session %s ended, %s active sessions", session.session_id, len(self.sessions)
+      )
+
+  async def serveTCP(self, host: str, port: int) -> None:
+    server = await asyncio.start_server(self.handleConnection, host, port)
+    async with server:
+      await server.serve_forever()
+
+  async def serveUnix(self, path: str) -> None:
+    server = await asyncio.start_unix_server(self.handleConnection, path)
+    async with server:
+      await server.serve_forever()
+
+  def memoryReport(self) -> Dict[str, Any]:
+    """Report the approximate memory used by shared caches and by each session.
+
+    The memory of a session only counts what is not shared with other sessions.
+    """
+    seen: Set[int] = set()
+    shared_size = _approximateSize(
+      [
+        buildout._parse_cache,
+        buildout._resolved_buildout_cache,
+        buildout._resolved_extends_cache,
+        diagnostic.pypi_client,
+        code_actions.pypi_client,
+      ],
+      seen,
+    )
+    sessions: List[Dict[str, Any]] = []
+    for session_id, session in sorted(self.sessions.items()):
+      session_cache = session.session_cache
+      open_documents = session._getOpenUris()
+      sessions.append(
+        {
+          "session_id": session_id,
+          "open_documents": len(open_documents),
+          "cached_profiles": len(session_cache.parse_cache)
+          + len(session_cache.resolved_buildout_cache),
+          "bytes": _approximateSize(
+            [
+              session_cache.parse_cache,
+              session_cache.resolved_buildout_cache,
+              session_cache.resolved_extends_cache,
+              [
+                session.workspace.get_text_document(uri).source
+                for uri in open_documents
+              ],
+            ],
+            set(seen),
+          ),
+        }
+      )
+    return {
+      "shared": {
+        "cached_profiles": len(buildout._parse_cache)
+        + len(buildout._resolved_buildout_cache),
+        "bytes": shared_size,
+      },
+      "sessions": sessions,
+    }
+
+  def _commandMemoryReport(self, ls: LanguageServer) -> Dict[str, Any]:
+    report = self.memoryReport()
+    lines = [
+      f"shared: {report['shared']['bytes']} bytes, "
+      f"{report['shared']['cached_profiles']} cached profiles"
+    ]
+    for session in report["sessions"]:
+      lines.append(
+        f"session {session['session_id']}: {session['bytes']} bytes, "
+        f"{session['cached_profiles']} cached profiles, "
+        f"{session['open_documents']} open documents"
+      )
+    ls.window_log_message(
+      LogMessageParams(message="\n".join(lines), type=MessageType.Info)
+    )
+    return report
@@ -2,7 +2,16 @@ import asyncio
 import logging
 import re
 import urllib.parse
-from typing import AsyncIterable, Awaitable, List, Optional, Set, Tuple
+from typing import (
+  AsyncIterable,
+  Awaitable,
+  Dict,
+  Iterator,
+  List,
+  Optional,
+  Set,
+  Tuple,
+)
 import packaging
 
 from lsprotocol.types import (
@@ -13,11 +22,11 @@ from lsprotocol.types import (
   Position,
   Range,
 )
-from pygls.lsp.server import LanguageServer
 from zc.buildout.configparser import MissingSectionHeaderError, ParsingError
 
 from . import buildout, jinja, types
-from .util import pypi
+from .documents import DocumentSourceLike, get_document_source
+from .util import http_cache, osv, pypi
 
 # this is a function to be patched in unittest
 from os.path import exists as os_path_exists
@@ -31,16 +40,59 @@ _profile_base_location_re = re.compile(
 pypi_client = pypi.PyPIClient()
 
 
+def getVersionPins(
+  versions: buildout.BuildoutSection,
+) -> Iterator[Tuple[str, str, buildout.BuildoutOptionDefinition]]:
+  """The projects pinned in a versions section, with their versions and the
+  options pinning them.
+  """
+  for package_name, option in versions.items():
+    if package_name in (
+      "_buildout_section_name_",
+      "_profile_base_location_",
+    ):
+      continue
+
+    package_version = option.value
+
+    # handle some slapos markers in versions
+    if package_version.endswith(":whl"):
+      package_version = package_version[:-4]
+    if "+slapos" in package_version.lower():
+      continue
+    yield package_name, package_version, option
+
+
+async def _getKnownVulnerabilitiesFromOSV(
+  package_name: str,
+  package_version: str,
+  osv_vulnerabilities: "asyncio.Future[Dict[Tuple[str, str], Tuple[types.KnownVulnerability, ...]]]",
+  sem: asyncio.Semaphore,
+  check_release: bool,
+) -> Tuple[types.KnownVulnerability, ...]:
+  """Known vulnerabilities of a pin, looked up in the OSV database with the
+  other pins of the profile. With `check_release`, the package index is
+  still used to check that the version exists.
+  """
+  if check_release:
+    try:
+      await pypi_client.find_release(package_name, package_version, sem)
+    except http_cache.FETCH_ERRORS:
+      logger.debug("Error fetching project %s", package_name, exc_info=True)
+  return (await osv_vulnerabilities).get((package_name, package_version), ())
+
+
 async def getDiagnostics(
-  ls: LanguageServer,
+  ls: DocumentSourceLike,
   uri: str,
 ) -> AsyncIterable[Diagnostic]:
+  documents = get_document_source(ls)
   parsed = None
   if buildout.BuildoutProfile.looksLikeBuildoutProfile(uri):
     # parse errors
     try:
       parsed = await buildout.parse(
-        ls=ls,
+        ls=documents,
         uri=uri,
         allow_errors=False,
       )
@@ -71,7 +123,7 @@ async def getDiagnostics(
           )
 
   resolved_buildout = await buildout.open(
-    ls=ls,
+    ls=documents,
     uri=uri,
   )
   assert resolved_buildout is not None
@@ -275,25 +327,13 @@ async def getDiagnostics(
         ] = []
         known_vulnerabilities_coros: List[
           Awaitable[Tuple[types.KnownVulnerability, ...]]
-        ] = []
+        ]
         latest_version_coros: List[Awaitable[Optional[packaging.version.Version]]] = []
-        for package_name, option in resolved_buildout["versions"].items():
+        for package_name, package_version, option in getVersionPins(
+          resolved_buildout["versions"]
+        ):
           if option.location.uri != uri:
             continue
-          if package_name in (
-            "_buildout_section_name_",
-            "_profile_base_location_",
-          ):
-            continue
-
-          package_version = option.value
-
-          # handle some slapos markers in versions
-          if package_version.endswith(":whl"):
-            package_version = package_version[:-4]
-          if "+slapos" in package_version.lower():
-            continue
-
           logger.debug(
             "Found package %s at version %s @ %s",
             package_name,
@@ -301,20 +341,39 @@ async def getDiagnostics(
             option.location,
           )
           package_version_options.append((package_name, package_version, option))
-          known_vulnerabilities_coros.append(
-            pypi_client.get_known_vulnerabilities(
+          latest_version_coros.append(
+            pypi_client.get_latest_version(
               package_name,
               package_version,
               sem,
             )
           )
-          latest_version_coros.append(
-            pypi_client.get_latest_version(
-              package_name,
-              package_version,
+        osv_client = osv.get_osv_client()
+        if osv_client is None:
+          known_vulnerabilities_coros = [
+            pypi_client.get_known_vulnerabilities(package_name, package_version, sem)
+            for package_name, package_version, _ in package_version_options
+          ]
+        else:
+          # all pins are looked up together
+          osv_vulnerabilities = asyncio.ensure_future(
+            osv_client.get_known_vulnerabilities(
+              [
+                (package_name, package_version)
+                for package_name, package_version, _ in package_version_options
+              ],
               sem,
             )
           )
+          # a local copy of the OSV database is used offline, without
+          # checking the versions on the package index
+          check_release = isinstance(osv_client, osv.OSVClient)
+          known_vulnerabilities_coros = [
+            _getKnownVulnerabilitiesFromOSV(
+              package_name, package_version, osv_vulnerabilities, sem, check_release
+            )
+            for package_name, package_version, _ in package_version_options
+          ]
         logger.debug(
           "gathering %d known vulnerabilities", len(known_vulnerabilities_coros)
         )
@@ -379,8 +438,14 @@ async def getDiagnostics(
               known_vulnerabilities,
               latest_version,
             )
-            continue
-          if latest_version:
+            # known vulnerabilities are reported even when the package index
+            # is not available
+            if isinstance(known_vulnerabilities, BaseException) or not (
+              known_vulnerabilities
+            ):
+              continue
+            latest_version = None
+          if latest_version or known_vulnerabilities:
             severity = DiagnosticSeverity.Hint
             message = f"Newer version available ({latest_version})"
             if known_vulnerabilities:
@@ -391,6 +456,14 @@ async def getDiagnostics(
                 )
               )
               severity = DiagnosticSeverity.Warning
+            latest_version_in_series = None
+            if latest_version:
+              # the project metadata is cached by get_latest_version
+              latest_version_in_series = await pypi_client.get_latest_version_in_series(
+                package_name, package_version, sem
+              )
+              if latest_version_in_series == latest_version:
+                latest_version_in_series = None
 
             yield Diagnostic(
               message=message,
@@ -398,11 +471,12 @@ async def getDiagnostics(
               source="buildout",
               severity=severity,
               data=types.PyPIPackageInfo(
-                latest_version=str(latest_version),
+                latest_version=str(latest_version or ""),
                 url=pypi_client.get_home_page_url(
                   package_name,
                   package_version,
                 ),
                 known_vulnerabilities=known_vulnerabilities,
+                latest_version_in_series=str(latest_version_in_series or ""),
               ),
             )
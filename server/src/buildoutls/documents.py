@@ -0,0 +1,191 @@
+"""Sources of documents for the buildout parser.
+
+The parsing engine in :mod:`buildoutls.buildout` does not need a language
+server, it only needs to read profiles and templates. A ``DocumentSource``
+is the minimal interface it uses for this. The language server uses a
+``WorkspaceDocumentSource`` adapter over pygls workspace, batch tools can
+use a ``FileSystemDocumentSource`` directly.
+"""
+
+import abc
+import os
+import pathlib
+import urllib.parse
+from typing import TYPE_CHECKING, Dict, Optional, Union
+
+from typing_extensions import TypeAlias
+
+from .util import aiohttp_session, circuit_breaker
+
+if TYPE_CHECKING:
+  from pygls.lsp.server import LanguageServer
+  from pygls.workspace import Workspace
+
+  from .buildout import SessionCache
+
+URI: TypeAlias = str
+
+
+class DocumentSource(abc.ABC):
+  """Read access to documents, by URI.
+
+  Subclasses implement `read` and `get_path`.
+  """
+
+  session: Optional["SessionCache"] = None
+  """Caches of the client session, when the language server is shared between
+  clients, see `buildoutls.daemon`.
+  """
+
+  @abc.abstractmethod
+  async def read(self, uri: URI) -> str:
+    """Return the text of the document at `uri`.
+
+    Raises `IOError` or `UnicodeDecodeError` when the document can not be read.
+    """
+
+  @abc.abstractmethod
+  def get_path(self, uri: URI) -> str:
+    """Return the local path for `uri`."""
+
+  def exists(self, uri: URI) -> bool:
+    """Check if the document at `uri` exists."""
+    return os.path.exists(self.get_path(uri))
+
+  def path_to_uri(self, path: pathlib.Path) -> URI:
+    """Return the URI for a local path."""
+    return path.resolve().as_uri()
+
+
+class FileSystemDocumentSource(DocumentSource):
+  """Read documents from the local file system."""
+
+  async def read(self, uri: URI) -> str:
+    with open(self.get_path(uri), encoding="utf-8") as f:
+      return f.read()
+
+  def get_path(self, uri: URI) -> str:
+    return urllib.parse.unquote(urllib.parse.urlparse(uri).path)
+
+
+class OverlayDocumentSource(DocumentSource):
+  """In-memory documents, shadowing the documents from another source.
+
+  This is typically used to represent unsaved modifications of documents.
+  """
+
+  def __init__(self, base: DocumentSource):
+    self._base = base
+    self.session = base.session
+    self._overlay: Dict[URI, str] = {}
+
+  def set(self, uri: URI, text: str) -> None:
+    self._overlay[uri] = text
+
+  def remove(self, uri: URI) -> None:
+    self._overlay.pop(uri, None)
+
+  async def read(self, uri: URI) -> str:
+    try:
+      return self._overlay[uri]
+    except KeyError:
+      return await self._base.read(uri)
+
+  def get_path(self, uri: URI) -> str:
+    return self._base.get_path(uri)
+
+  def exists(self, uri: URI) -> bool:
+    return uri in self._overlay or self._base.exists(uri)
+
+  def path_to_uri(self, path: pathlib.Path) -> URI:
+    return self._base.path_to_uri(path)
+
+
+class HTTPDocumentSource(DocumentSource):
+  """Read http:// and https:// documents from the network, other documents
+  from another source.
+
+  Network errors are raised as `aiohttp.ClientError`.
+  """
+
+  def __init__(self, base: DocumentSource):
+    self._base = base
+    self.session = base.session
+
+  @staticmethod
+  def _is_http(uri: URI) -> bool:
+    return uri.startswith(("http://", "https://"))
+
+  async def read(self, uri: URI) -> str:
+    if self._is_http(uri):
+      with circuit_breaker.get_circuit_breaker(uri).guard():
+        async with aiohttp_session.request(
+          "GET", uri, aiohttp_session.Lane.INTERACTIVE
+        ) as resp:
+          resp.raise_for_status()
+          return await resp.text()
+    return await self._base.read(uri)
+
+  def get_path(self, uri: URI) -> str:
+    if self._is_http(uri):
+      return urllib.parse.urlparse(uri).path
+    return self._base.get_path(uri)
+
+  def exists(self, uri: URI) -> bool:
+    if self._is_http(uri):
+      return True
+    return self._base.exists(uri)
+
+  def path_to_uri(self, path: pathlib.Path) -> URI:
+    return self._base.path_to_uri(path)
+
+
+class WorkspaceDocumentSource(DocumentSource):
+  """Adapter reading documents from a pygls workspace.
+
+  Documents opened in the editor are read from the workspace, so that
+  unsaved modifications are taken into account.
+  """
+
+  def __init__(
+    self,
+    workspace: "Workspace",
+    session: Optional["SessionCache"] = None,
+  ):
+    self._workspace = workspace
+    self.session = session
+
+  async def read(self, uri: URI) -> str:
+    return self._workspace.get_text_document(uri).source
+
+  def get_path(self, uri: URI) -> str:
+    return self._workspace.get_text_document(uri).path
+
+  def path_to_uri(self, path: pathlib.Path) -> URI:
+    resolved_path = str(path.resolve())
+    root_path = self._workspace.root_path
+    root_uri = self._workspace.root_uri
+    # For paths in workspace, we don't use path.resolve().as_uri(),
+    # because we have fake uri -> path mapping in tests
+    if root_path and root_uri and resolved_path.startswith(root_path):
+      return resolved_path.replace(root_path, root_uri, 1)
+    # but we still need to support the case where the path is outside the workspace
+    return path.resolve().as_uri()
+
+
+DocumentSourceLike: TypeAlias = Union[DocumentSource, "LanguageServer"]
+
+
+def get_document_source(documents: DocumentSourceLike) -> DocumentSource:
+  """Return a document source, adapting a language server if needed.
+
+  Language servers can provide their own source as `document_source`.
+  """
+  if isinstance(documents, DocumentSource):
+    return documents
+  document_source: Optional[DocumentSource] = getattr(
+    documents, "document_source", None
+  )
+  if document_source is not None:
+    return document_source
+  return HTTPDocumentSource(WorkspaceDocumentSource(documents.workspace))
@@ -2,7 +2,7 @@
 
 import enum
 import re
-from typing import List
+from typing import List, Tuple
 
 
 # https://jinja.palletsprojects.com/en/2.11.x/templates/#list-of-control-structures
@@ -17,7 +17,7 @@ class JinjaStatement(str, enum.Enum):
   EndRaw = "endraw"
 
 
-jinja_statements = set(JinjaStatement)
+jinja_statements = {statement.value: statement for statement in JinjaStatement}
 
 end_block_statement = {
   "endfor": JinjaStatement.For,
@@ -34,6 +34,9 @@ multiline_expression_end_re = re.compile(r"\}\}")
 multiline_statement_start_re = re.compile(r"^\s*\{%")
 multiline_statement_end_re = re.compile(r"%\}")
 
+# the state of the parser between two lines
+JinjaParserState = Tuple[Tuple[JinjaStatement, ...], bool, bool, bool, bool]
+
 
 class JinjaParser:
   """A very simple jinja parser which allow skipping lines containing jinja blocks."""
@@ -56,9 +59,22 @@ class JinjaParser:
 
   def feed(self, line: str) -> None:
     """Feeds a line and update the state."""
+    if "{" not in line and not (
+      self._in_comment or self._in_multiline_expression or self._in_multiline_statement
+    ):
+      # Fast path for lines without jinja, which are most of the lines. None of
+      # the expressions, statements or comments can start on this line.
+      self._current_line_was_in_jinja = False
+      self.has_expression = False
+      self.is_error = False
+      self.line = line
+      return
+    self._feed(line)
+
+  def _feed(self, line: str) -> None:
     self._current_line_was_in_jinja = False
-    self.has_expression = bool(expression_re.search(line)) and not self._in_raw
     expression_re_match = expression_re.search(line)
+    self.has_expression = bool(expression_re_match) and not self._in_raw
     if expression_re_match:
       if expression_re_match.start() == 0 and expression_re_match.end() == len(
         line.strip()
@@ -73,7 +89,7 @@ class JinjaParser:
       self._current_line_was_in_jinja = True
       self._in_comment = "#}" not in line
 
-    statement_match = statement_re.match(line)
+    statement_match = statement_re.match(line) if "{%" in line else None
     if statement_match:
       self._current_line_was_in_jinja = not self._in_raw
       statement = statement_match.group("statement")
@@ -82,7 +98,7 @@ class JinjaParser:
       elif statement == JinjaStatement.EndRaw:
         self._in_raw = False
       elif statement in jinja_statements:
-        self._stack.append(JinjaStatement(statement))
+        self._stack.append(jinja_statements[statement])
       elif statement in end_block_statement:
         self.is_error = True
         if self._stack:
@@ -99,6 +115,26 @@ class JinjaParser:
       self._current_line_was_in_jinja = True
       self._in_multiline_statement = multiline_statement_end_re.search(line) is None
 
+  def getState(self) -> JinjaParserState:
+    """The state of the parser, to restore it with `setState`."""
+    return (
+      tuple(self._stack),
+      self._in_raw,
+      self._in_comment,
+      self._in_multiline_expression,
+      self._in_multiline_statement,
+    )
+
+  def setState(self, state: JinjaParserState) -> None:
+    (
+      stack,
+      self._in_raw,
+      self._in_comment,
+      self._in_multiline_expression,
+      self._in_multiline_statement,
+    ) = state
+    self._stack = list(stack)
+
   @property
   def is_in_jinja(self) -> bool:
     return bool(self._stack) or self._current_line_was_in_jinja
@@ -0,0 +1,168 @@
+"""Prefetch of the metadata of pinned projects.
+
+When a profile is opened or modified, the projects pinned in the
+``[versions]`` section of the profiles it extends, directly or not, are
+looked up on the package index in the background, so that their metadata is
+already in the HTTP cache when these profiles are opened in turn. The
+projects pinned in the opened profile are not prefetched, diagnostics of
+this profile look them up right away.
+
+Prefetching has a low priority: all workspaces share a small concurrency
+budget, smaller than the one of diagnostics. The prefetches of a workspace
+are cancelled when the workspace is closed.
+"""
+
+import asyncio
+import logging
+import weakref
+from typing import Any, AsyncIterator, Awaitable, List, Set, Tuple
+
+from pygls.lsp.server import LanguageServer
+from pygls.workspace import Workspace
+
+from . import buildout, diagnostic, jinja, types
+from .buildout import URI
+from .util import osv
+from .util.uris import join_uri
+
+logger = logging.getLogger(__name__)
+
+# concurrent requests of all prefetches
+PREFETCH_CONCURRENCY = 2
+
+_budgets: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = (
+  weakref.WeakKeyDictionary()
+)
+
+
+def _getBudget() -> asyncio.Semaphore:
+  """The concurrency budget of prefetches, shared by all workspaces."""
+  loop = asyncio.get_running_loop()
+  budget = _budgets.get(loop)
+  if budget is None:
+    budget = _budgets[loop] = asyncio.Semaphore(PREFETCH_CONCURRENCY)
+  return budget
+
+
+async def _iterExtendedProfiles(
+  ls: LanguageServer,
+  uri: URI,
+) -> AsyncIterator[buildout.BuildoutProfile]:
+  """The profiles extended by profile, directly or not.
+
+  Profiles are only parsed, not resolved, and dynamic extends are skipped.
+  """
+  seen = {uri}
+  uris = [uri]
+  while uris:
+    profile_uri = uris.pop()
+    try:
+      profile = await buildout.parse(ls, profile_uri)
+    except Exception:
+      logger.debug("Error parsing %s for prefetch", profile_uri, exc_info=True)
+      continue
+    if profile_uri != uri:
+      yield profile
+    if "buildout" not in profile or "extends" not in profile["buildout"]:
+      continue
+    base = profile_uri[: profile_uri.rfind("/")] + "/"
+    for extends in profile["buildout"]["extends"].value.split():
+      if "${" in extends or jinja.JinjaParser.jinja_value in extends:
+        continue
+      extended_uri = join_uri(base, extends)
+      if extended_uri not in seen:
+        seen.add(extended_uri)
+        uris.append(extended_uri)
+
+
+class Prefetcher:
+  """The prefetches of a workspace."""
+
+  def __init__(self) -> None:
+    self._tasks: Set["asyncio.Task[None]"] = set()
+    # pins already prefetched or being prefetched
+    self._pins: Set[Tuple[str, str]] = set()
+
+  def prefetchProfile(self, ls: LanguageServer, uri: URI) -> None:
+    """Start prefetching the pins of the profiles extended by profile."""
+    if not buildout.BuildoutProfile.looksLikeBuildoutProfile(uri):
+      return
+    task = asyncio.ensure_future(self._prefetchProfile(ls, uri))
+    self._tasks.add(task)
+    task.add_done_callback(self._tasks.discard)
+
+  async def _prefetchProfile(self, ls: LanguageServer, uri: URI) -> None:
+    pins: List[Tuple[str, str]] = []
+    async for profile in _iterExtendedProfiles(ls, uri):
+      if "versions" not in profile:
+        continue
+      for package_name, package_version, _ in diagnostic.getVersionPins(
+        profile["versions"]
+      ):
+        pin = (package_name, package_version)
+        if "${" not in package_version and pin not in self._pins:
+          self._pins.add(pin)
+          pins.append(pin)
+    if not pins:
+      return
+    logger.debug("prefetching %d pins extended by %s", len(pins), uri)
+    try:
+      await self._prefetchPins(pins, _getBudget())
+    except asyncio.CancelledError:
+      # the pins which were not fetched can be prefetched again
+      self._pins.difference_update(pins)
+      raise
+
+  async def _prefetchPins(
+    self,
+    pins: List[Tuple[str, str]],
+    budget: asyncio.Semaphore,
+  ) -> None:
+    pypi_client = diagnostic.pypi_client
+    coros: List[Awaitable[Any]] = [
+      pypi_client.get_latest_version(package_name, package_version, budget)
+      for package_name, package_version in pins
+    ]
+    osv_client = osv.get_osv_client()
+    if osv_client is None:
+      coros.extend(
+        pypi_client.get_known_vulnerabilities(package_name, package_version, budget)
+        for package_name, package_version in pins
+      )
+    else:
+      coros.append(osv_client.get_known_vulnerabilities(pins, budget))
+    for result in await asyncio.gather(*coros, return_exceptions=True):
+      if isinstance(result, BaseException) and not isinstance(
+        result, (types.ProjectNotFound, types.VersionNotFound)
+      ):
+        logger.debug("Error prefetching", exc_info=result)
+
+  async def wait(self) -> None:
+    """Wait for the prefetches started so far."""
+    await asyncio.gather(*self._tasks, return_exceptions=True)
+
+  def cancel(self) -> None:
+    """Cancel all the prefetches."""
+    for task in self._tasks:
+      task.cancel()
+
+
+_prefetchers: "weakref.WeakKeyDictionary[Workspace, Prefetcher]" = (
+  weakref.WeakKeyDictionary()
+)
+
+
+def getPrefetcher(ls: LanguageServer) -> Prefetcher:
+  """Return the prefetcher for the workspace of this language server."""
+  workspace = ls.workspace
+  prefetcher = _prefetchers.get(workspace)
+  if prefetcher is None:
+    prefetcher = _prefetchers[workspace] = Prefetcher()
+  return prefetcher
+
+
+def cancelPrefetch(workspace: Workspace) -> None:
+  """Cancel the prefetches of a closed workspace."""
+  prefetcher = _prefetchers.pop(workspace, None)
+  if prefetcher is not None:
+    prefetcher.cancel()
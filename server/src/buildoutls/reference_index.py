@@ -0,0 +1,613 @@
+"""Index of the sections and options defined and referenced in workspace profiles.
+
+Find references and rename query this index instead of parsing all the
+profiles of the workspace for each request. The sections and options defined
+in profiles are also kept in a `symbol_index.SymbolIndex`, for
+``workspace/symbol``.
+
+The index is stored in a SQLite database in the cache directory, so that it
+persists between sessions. Each profile is indexed with the modification time
+and size of its file. When the index is used for the first time in a session,
+profiles modified since they were indexed are indexed again; after that, the
+index is updated from ``workspace/didChangeWatchedFiles`` notifications.
+
+The database only contains the profiles as saved on disk. Profiles opened in
+the editor, which might have unsaved modifications, are indexed in memory.
+"""
+
+import asyncio
+import enum
+import hashlib
+import io
+import logging
+import os
+import pathlib
+import sqlite3
+import weakref
+from typing import (
+  AsyncIterator,
+  Callable,
+  Dict,
+  Iterable,
+  Iterator,
+  List,
+  NamedTuple,
+  Optional,
+  Sequence,
+  Set,
+  Tuple,
+)
+
+from lsprotocol.types import FileEvent, Location, Position, Range
+from pygls.lsp.server import LanguageServer
+from pygls.workspace import Workspace
+from zc.buildout.configparser import option_start, section_header
+
+from . import buildout, symbol_index, workspace_index
+from .util import cache_dir
+
+logger = logging.getLogger(__name__)
+
+URI = str
+
+SCHEMA_VERSION = 1
+# seconds to wait for the database when it is written by another server
+BUSY_TIMEOUT = 0.1
+
+
+class IndexedSymbolKind(enum.IntEnum):
+  # [section]
+  SectionDefinition = 1
+  # option = value
+  OptionDefinition = 2
+  # the section in ${section:option}
+  SectionReference = 3
+  # the option in ${section:option}
+  OptionReference = 4
+  # a section listed in ${buildout:parts}
+  Part = 5
+  # the value of <= section
+  Macro = 6
+  # the section name in <= section
+  MacroSectionName = 7
+
+
+class IndexedSymbol(NamedTuple):
+  kind: IndexedSymbolKind
+  section_name: str
+  option_name: Optional[str]
+  range: Range
+
+
+async def getProfileSymbols(profile: buildout.BuildoutProfile) -> List[IndexedSymbol]:
+  """Collect the indexed symbols of a profile."""
+  symbols: List[IndexedSymbol] = []
+  # lines as split by the parser, str.splitlines also splits on form feeds
+  lines = profile.source.split("\n")
+
+  for section_name, location in profile.section_header_locations.items():
+    if location.uri != profile.uri:
+      continue
+    lineno = location.range.start.line
+    header = section_header(lines[lineno])
+    if header:
+      symbols.append(
+        IndexedSymbol(
+          IndexedSymbolKind.SectionDefinition,
+          section_name,
+          None,
+          Range(
+            start=Position(line=lineno, character=header.start("name")),
+            end=Position(line=lineno, character=header.end("name")),
+          ),
+        )
+      )
+
+  for section_name, section in profile.items():
+    for option_key, option in section.items():
+      for option_location, option_value, default_value in zip(
+        option.locations, option.values, option.default_values
+      ):
+        if default_value or option_location.uri != profile.uri:
+          continue
+        lineno = option_location.range.start.line
+        line = lines[lineno]
+        if option_key == "<":
+          start = line.find(option_value, option_location.range.start.character)
+          if start != -1:
+            symbols.append(
+              IndexedSymbol(
+                IndexedSymbolKind.MacroSectionName,
+                option_value,
+                None,
+                Range(
+                  start=Position(line=lineno, character=start),
+                  end=Position(line=lineno, character=start + len(option_value)),
+                ),
+              )
+            )
+          continue
+        match = option_start(line)
+        if not match:
+          continue
+        option_name = match.group("name").rstrip()
+        if option_name.endswith(("+", "-")):
+          option_name = option_name[:-1].rstrip()
+        symbols.append(
+          IndexedSymbol(
+            IndexedSymbolKind.OptionDefinition,
+            section_name,
+            option_name,
+            Range(
+              start=Position(line=lineno, character=0),
+              end=Position(line=lineno, character=len(option_name)),
+            ),
+          )
+        )
+      if option_key == "<" and option.location.uri == profile.uri:
+        symbols.append(
+          IndexedSymbol(
+            IndexedSymbolKind.Macro, option.value, None, option.location.range
+          )
+        )
+
+  if "parts" in profile.get("buildout", {}):
+    for part, part_range in profile.getOptionValues("buildout", "parts"):
+      symbols.append(IndexedSymbol(IndexedSymbolKind.Part, part, None, part_range))
+
+  async for symbol in profile.getAllOptionReferenceSymbols():
+    if not symbol.referenced_section_name:
+      continue
+    symbols.append(
+      IndexedSymbol(
+        IndexedSymbolKind.SectionReference,
+        symbol.referenced_section_name,
+        symbol.referenced_option_name,
+        symbol.section_range,
+      )
+    )
+    symbols.append(
+      IndexedSymbol(
+        IndexedSymbolKind.OptionReference,
+        symbol.referenced_section_name,
+        symbol.referenced_option_name,
+        symbol.option_range,
+      )
+    )
+  return symbols
+
+
+def _getWorkspaceSymbols(
+  uri: URI,
+  symbols: Iterable[IndexedSymbol],
+) -> Iterator[symbol_index.WorkspaceSymbol]:
+  for symbol in symbols:
+    if symbol.kind == IndexedSymbolKind.SectionDefinition:
+      yield symbol_index.WorkspaceSymbol(symbol.section_name, None, uri, symbol.range)
+    elif symbol.kind == IndexedSymbolKind.OptionDefinition:
+      assert symbol.option_name is not None
+      yield symbol_index.WorkspaceSymbol(
+        symbol.option_name, symbol.section_name, uri, symbol.range
+      )
+
+
+class SymbolQuery(NamedTuple):
+  """Query symbols of `kinds` for this section, and for this option if
+  `option_name` is not None."""
+
+  kinds: Tuple[IndexedSymbolKind, ...]
+  section_name: str
+  option_name: Optional[str] = None
+
+
+def getSymbolAtPosition(
+  symbols: Iterable[IndexedSymbol],
+  position: Position,
+) -> Optional[IndexedSymbol]:
+  """Return the symbol at position."""
+  for symbol in symbols:
+    if (
+      symbol.range.start.line == position.line
+      and symbol.range.start.character <= position.character
+      and position.character <= symbol.range.end.character
+    ):
+      return symbol
+  return None
+
+
+def _filterSymbols(
+  symbols: Iterable[IndexedSymbol],
+  kinds: Tuple[IndexedSymbolKind, ...],
+  section_name: str,
+  option_name: Optional[str],
+) -> Iterator[IndexedSymbol]:
+  for symbol in symbols:
+    if (
+      symbol.kind in kinds
+      and symbol.section_name == section_name
+      and (option_name is None or symbol.option_name == option_name)
+    ):
+      yield symbol
+
+
+class ReferenceIndex:
+  """Index of the symbols of the profiles of a workspace."""
+
+  def __init__(self, profiles: workspace_index.WorkspaceIndex, database: str):
+    self.profiles = profiles
+    self._database = database
+    self._connection: Optional[sqlite3.Connection] = None
+    # profiles modified since they were indexed
+    self._modified: Set[URI] = set()
+    # profiles in the database, None until the first refresh
+    self._indexed: Optional[Set[URI]] = None
+    # modification time and size of profiles in the database, not yet checked
+    self._stamps: Dict[URI, Tuple[int, int]] = {}
+    # symbols of documents opened in the editor, by document version
+    self._open_documents: Dict[URI, Tuple[Optional[int], List[IndexedSymbol]]] = {}
+    # sections and options defined in the profiles of the database
+    self.workspace_symbols = symbol_index.SymbolIndex()
+    # sections and options defined in documents opened in the editor
+    self._open_document_symbols = symbol_index.SymbolIndex()
+
+  def _connect(self) -> sqlite3.Connection:
+    if self._connection is None:
+      try:
+        connection = sqlite3.connect(self._database, timeout=BUSY_TIMEOUT)
+        # readers do not block the writer of another server
+        connection.execute("PRAGMA journal_mode = WAL")
+        (user_version,) = connection.execute("PRAGMA user_version").fetchone()
+      except sqlite3.Error:
+        logger.warning("Could not open %s", self._database, exc_info=True)
+        connection = sqlite3.connect(":memory:")
+        user_version = 0
+      if user_version != SCHEMA_VERSION:
+        connection.executescript(
+          f"""
+          DROP TABLE IF EXISTS files;
+          DROP TABLE IF EXISTS symbols;
+          CREATE TABLE files (
+            uri TEXT PRIMARY KEY,
+            mtime_ns INTEGER NOT NULL,
+            size INTEGER NOT NULL
+          );
+          CREATE TABLE symbols (
+            uri TEXT NOT NULL,
+            kind INTEGER NOT NULL,
+            section TEXT NOT NULL,
+            option TEXT,
+            start_line INTEGER NOT NULL,
+            start_character INTEGER NOT NULL,
+            end_line INTEGER NOT NULL,
+            end_character INTEGER NOT NULL
+          );
+          CREATE INDEX symbols_section_option ON symbols (section, option);
+          CREATE INDEX symbols_uri ON symbols (uri);
+          PRAGMA user_version = {SCHEMA_VERSION};
+          """
+        )
+      self._connection = connection
+    return self._connection
+
+  def close(self) -> None:
+    if self._connection is not None:
+      self._connection.close()
+      self._connection = None
+
+  def update(self, changes: Iterable[FileEvent]) -> None:
+    """Mark profiles modified on disk."""
+    for change in changes:
+      if change.uri.endswith(workspace_index.PROFILE_SUFFIX):
+        self._modified.add(change.uri)
+
+  async def refresh(
+    self,
+    progress: Optional[Callable[[int, int], None]] = None,
+    cancelled: Optional[Callable[[], bool]] = None,
+  ) -> bool:
+    """Index the profiles modified since last refresh.
+
+    `progress` is called with the number of profiles checked and the total
+    number of profiles to check. Indexing stops when `cancelled` returns
+    True, the remaining profiles are indexed on next refresh.
+
+    The database is written in a short transaction for each profile, once it
+    is parsed. If the database is locked by another server, indexing stops
+    and the remaining profiles are indexed on next refresh.
+
+    Returns False if indexing was cancelled.
+    """
+    connection = self._connect()
+    profiles = {path.as_uri(): path for path in self.profiles.getProfiles()}
+    if self._indexed is None:
+      # first refresh, check all profiles for modifications since the
+      # database was written.
+      self._stamps = {
+        uri: (mtime_ns, size)
+        for uri, mtime_ns, size in connection.execute(
+          "SELECT uri, mtime_ns, size FROM files"
+        )
+      }
+      self._indexed = set(self._stamps)
+      self._loadWorkspaceSymbols(connection)
+      self._modified.update(profiles)
+    modified = sorted(
+      self._modified
+      | (profiles.keys() - self._indexed)
+      | (self._indexed - profiles.keys())
+    )
+    for count, uri in enumerate(modified):
+      if cancelled is not None and cancelled():
+        return False
+      if progress is not None:
+        progress(count, len(modified))
+      path = profiles.get(uri)
+      stamp: Optional[Tuple[int, int]] = None
+      symbols: List[IndexedSymbol] = []
+      try:
+        if path is None:
+          raise FileNotFoundError(uri)
+        stat = path.stat()
+      except OSError:
+        # the profile is removed from the database
+        modified_on_disk = True
+      else:
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        modified_on_disk = self._stamps.get(uri) != stamp
+        if modified_on_disk:
+          symbols = await self._getSymbols(uri, path)
+      if modified_on_disk:
+        try:
+          self._store(connection, uri, stamp, symbols)
+        except sqlite3.OperationalError:
+          logger.warning(
+            "Could not index %s, will retry on next refresh", uri, exc_info=True
+          )
+          break
+      # profiles are marked as processed only once indexed, so that they
+      # are indexed again on next refresh if this one is cancelled.
+      self._modified.discard(uri)
+      self._stamps.pop(uri, None)
+      # let other requests run, and this one be cancelled, while indexing
+      # a large workspace
+      await asyncio.sleep(0)
+    return True
+
+  def _loadWorkspaceSymbols(self, connection: sqlite3.Connection) -> None:
+    symbols: Dict[URI, List[IndexedSymbol]] = {}
+    for (
+      uri,
+      kind,
+      section_name,
+      option_name,
+      start_line,
+      start_character,
+      end_line,
+      end_character,
+    ) in connection.execute(
+      "SELECT * FROM symbols WHERE kind IN (?, ?)",
+      (IndexedSymbolKind.SectionDefinition, IndexedSymbolKind.OptionDefinition),
+    ):
+      symbols.setdefault(uri, []).append(
+        IndexedSymbol(
+          IndexedSymbolKind(kind),
+          section_name,
+          option_name,
+          Range(
+            start=Position(line=start_line, character=start_character),
+            end=Position(line=end_line, character=end_character),
+          ),
+        )
+      )
+    self.workspace_symbols.clear()
+    for uri, profile_symbols in symbols.items():
+      self.workspace_symbols.set(uri, _getWorkspaceSymbols(uri, profile_symbols))
+
+  async def _getSymbols(self, uri: URI, path: pathlib.Path) -> List[IndexedSymbol]:
+    logger.debug("Indexing %s", uri)
+    try:
+      source = path.read_text(encoding="utf-8")
+    except (OSError, UnicodeDecodeError):
+      source = ""
+    # parse the saved document, without the parse cache which might contain
+    # the document opened in the editor.
+    profile = await buildout._parse(io.StringIO(source), uri, allow_errors=True)
+    return await getProfileSymbols(profile)
+
+  def _store(
+    self,
+    connection: sqlite3.Connection,
+    uri: URI,
+    stamp: Optional[Tuple[int, int]],
+    symbols: List[IndexedSymbol],
+  ) -> None:
+    """Replace the symbols of a profile in the database, or remove the
+    profile if `stamp` is None.
+    """
+    assert self._indexed is not None
+    # the transaction is committed before the next profile is parsed
+    with connection:
+      connection.execute("DELETE FROM files WHERE uri = ?", (uri,))
+      connection.execute("DELETE FROM symbols WHERE uri = ?", (uri,))
+      if stamp is not None:
+        connection.execute(
+          "INSERT INTO files (uri, mtime_ns, size) VALUES (?, ?, ?)", (uri, *stamp)
+        )
+        connection.executemany(
+          "INSERT INTO symbols VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+          [
+            (
+              uri,
+              symbol.kind,
+              symbol.section_name,
+              symbol.option_name,
+              symbol.range.start.line,
+              symbol.range.start.character,
+              symbol.range.end.line,
+              symbol.range.end.character,
+            )
+            for symbol in symbols
+          ],
+        )
+    if stamp is None:
+      self._indexed.discard(uri)
+      self.workspace_symbols.remove(uri)
+    else:
+      self._indexed.add(uri)
+      self.workspace_symbols.set(uri, _getWorkspaceSymbols(uri, symbols))
+
+  async def _getOpenDocumentSymbols(
+    self,
+    ls: LanguageServer,
+  ) -> Dict[URI, List[IndexedSymbol]]:
+    """Index the profiles opened in the editor."""
+    profiles = {path.as_uri() for path in self.profiles.getProfiles()}
+    open_documents: Dict[URI, List[IndexedSymbol]] = {}
+    for uri, document in list(ls.workspace.text_documents.items()):
+      if uri not in profiles:
+        continue
+      cached = self._open_documents.get(uri)
+      if cached is None or document.version is None or cached[0] != document.version:
+        profile = await buildout.parse(ls, uri)
+        cached = (document.version, await getProfileSymbols(profile))
+        self._open_documents[uri] = cached
+        self._open_document_symbols.set(uri, _getWorkspaceSymbols(uri, cached[1]))
+      open_documents[uri] = cached[1]
+    for uri in self._open_documents.keys() - open_documents.keys():
+      del self._open_documents[uri]
+      self._open_document_symbols.remove(uri)
+    return open_documents
+
+  async def iterSymbols(
+    self,
+    ls: LanguageServer,
+    queries: Sequence[SymbolQuery],
+    progress: Optional[Callable[[int, int], None]] = None,
+    cancelled: Optional[Callable[[], bool]] = None,
+  ) -> AsyncIterator[Tuple[URI, List[Location]]]:
+    """Iterate on the locations of symbols matching `queries`, by profile.
+
+    The index is refreshed first. `progress` is called with the number of
+    profiles processed and the total number of profiles, first while
+    indexing, then while collecting results. Iteration stops when `cancelled`
+    returns True.
+    """
+
+    def indexingProgress(done: int, total: int) -> None:
+      if progress is not None:
+        progress(done, total * 2)
+
+    if not await self.refresh(indexingProgress, cancelled):
+      return
+    open_documents = await self._getOpenDocumentSymbols(ls)
+
+    results: Dict[URI, List[Location]] = {}
+    for query in queries:
+      sql = (
+        "SELECT uri, start_line, start_character, end_line, end_character"
+        " FROM symbols WHERE section = ? AND kind IN ({})".format(
+          ", ".join("?" * len(query.kinds))
+        )
+      )
+      parameters: Tuple[object, ...] = (query.section_name, *query.kinds)
+      if query.option_name is not None:
+        sql += " AND option = ?"
+        parameters += (query.option_name,)
+      for (
+        uri,
+        start_line,
+        start_character,
+        end_line,
+        end_character,
+      ) in self._connect().execute(sql, parameters):
+        if uri not in open_documents:
+          results.setdefault(uri, []).append(
+            Location(
+              uri=uri,
+              range=Range(
+                start=Position(line=start_line, character=start_character),
+                end=Position(line=end_line, character=end_character),
+              ),
+            )
+          )
+      for uri, symbols in open_documents.items():
+        for symbol in _filterSymbols(
+          symbols, query.kinds, query.section_name, query.option_name
+        ):
+          results.setdefault(uri, []).append(Location(uri=uri, range=symbol.range))
+
+    for count, uri in enumerate(sorted(results)):
+      if cancelled is not None and cancelled():
+        return
+      if progress is not None:
+        progress(len(results) + count, len(results) * 2)
+      yield (
+        uri,
+        sorted(
+          results[uri],
+          key=lambda location: (
+            location.range.start.line,
+            location.range.start.character,
+          ),
+        ),
+      )
+      await asyncio.sleep(0)
+
+  async def getSymbols(
+    self,
+    ls: LanguageServer,
+    kinds: Iterable[IndexedSymbolKind],
+    section_name: str,
+    option_name: Optional[str] = None,
+  ) -> List[Location]:
+    """Return the locations of symbols of `kinds` for this section, and for
+    this option if `option_name` is not None.
+    """
+    locations: List[Location] = []
+    async for _, profile_locations in self.iterSymbols(
+      ls, [SymbolQuery(tuple(kinds), section_name, option_name)]
+    ):
+      locations.extend(profile_locations)
+    return locations
+
+  async def searchWorkspaceSymbols(
+    self,
+    ls: LanguageServer,
+    query: str,
+  ) -> List[symbol_index.WorkspaceSymbol]:
+    """Return the sections and options defined in the workspace matching
+    `query`, best matches first.
+    """
+    await self.refresh()
+    open_documents = await self._getOpenDocumentSymbols(ls)
+    query = query.lower()
+    return symbol_index.rank(
+      self.workspace_symbols.getScoredSymbols(query, excluded_uris=open_documents)
+      + self._open_document_symbols.getScoredSymbols(query)
+    )
+
+
+def _getDatabasePath(root_path: str) -> str:
+  directory = cache_dir.get_cache_directory()
+  if directory is None:
+    return ":memory:"
+  key = hashlib.sha256(os.path.normpath(root_path).encode()).hexdigest()[:16]
+  return str(directory / f"references-{key}.sqlite")
+
+
+_reference_indexes: "weakref.WeakKeyDictionary[Workspace, ReferenceIndex]" = (
+  weakref.WeakKeyDictionary()
+)
+
+
+def getReferenceIndex(ls: LanguageServer) -> ReferenceIndex:
+  """Return the reference index for the workspace of this language server."""
+  profiles = workspace_index.getWorkspaceIndex(ls)
+  index = _reference_indexes.get(ls.workspace)
+  if index is None or index.profiles is not profiles:
+    if index is not None:
+      index.close()
+    index = _reference_indexes[ls.workspace] = ReferenceIndex(
+      profiles, _getDatabasePath(profiles.root_path)
+    )
+  return index
@@ -1,6 +1,5 @@
 from typing import List, Optional
 import logging
-import itertools
 
 from lsprotocol.types import SemanticTokens
 import pygments.lexers
@@ -61,21 +60,18 @@ def get_semantic_tokens(
               continue
             lexer = pygments.lexers.get_lexer_by_name("python")
 
-            doc = ls.workspace.get_text_document(option_value_location.uri)
-            source_code = "".join(
-              itertools.chain(
-                (
-                  doc.lines[option_value_location.range.start.line][
-                    option_value_location.range.start.character :
-                  ],
-                ),
-                doc.lines[
-                  option_value_location.range.start.line
-                  + 1 : option_value_location.range.end.line
-                ],
-                (doc.lines[option_value_location.range.end.line].rstrip(),),
+            # the value, from the start of the option value to the end of its
+            # last line.
+            syntax_tree = parsed.syntax_tree
+            start = option_value_location.range.start
+            end_line = option_value_location.range.end.line
+            source_code = syntax_tree.source[
+              syntax_tree.getOffset(start.line, start.character) : (
+                syntax_tree.getOffset(
+                  end_line, len(syntax_tree.lines[end_line].text.rstrip())
+                )
               )
-            )
+            ]
             this_block_start = option_value.location.range.start.line
             delta_line += this_block_start - last_block_end
             last_block_end = option_value.location.range.end.line
@@ -3,21 +3,25 @@ import logging
 import os
 import pathlib
 import re
-import urllib.parse
-from typing import Iterable, List, Optional, Tuple, Union
+from typing import Dict, Iterable, List, Optional, Tuple, Union
 
 from lsprotocol.types import (
+  SHUTDOWN,
   TEXT_DOCUMENT_CODE_ACTION,
   TEXT_DOCUMENT_COMPLETION,
   TEXT_DOCUMENT_DEFINITION,
   TEXT_DOCUMENT_DID_CHANGE,
+  TEXT_DOCUMENT_DID_CLOSE,
   TEXT_DOCUMENT_DID_OPEN,
   TEXT_DOCUMENT_SEMANTIC_TOKENS_FULL,
   TEXT_DOCUMENT_DOCUMENT_LINK,
   TEXT_DOCUMENT_DOCUMENT_SYMBOL,
   TEXT_DOCUMENT_HOVER,
+  TEXT_DOCUMENT_PREPARE_RENAME,
   TEXT_DOCUMENT_REFERENCES,
+  TEXT_DOCUMENT_RENAME,
   WORKSPACE_DID_CHANGE_WATCHED_FILES,
+  WORKSPACE_SYMBOL,
   CodeAction,
   CodeActionKind,
   CodeActionOptions,
@@ -31,6 +35,7 @@ from lsprotocol.types import (
   Diagnostic,
   DidChangeTextDocumentParams,
   DidChangeWatchedFilesParams,
+  DidCloseTextDocumentParams,
   DidOpenTextDocumentParams,
   DocumentLink,
   DocumentLinkParams,
@@ -42,19 +47,29 @@ from lsprotocol.types import (
   Hover,
   WorkDoneProgressBegin,
   WorkDoneProgressEnd,
+  WorkDoneProgressReport,
   Location,
+  LogMessageParams,
   MarkupContent,
   MarkupKind,
+  MessageType,
   Position,
+  PrepareRenameParams,
+  ProgressParams,
   PublishDiagnosticsParams,
   Range,
   ShowDocumentParams,
   ReferenceOptions,
   ReferenceParams,
+  RenameParams,
+  SymbolInformation,
   SymbolKind,
   TextDocumentPositionParams,
   TextEdit,
+  WorkspaceEdit,
+  WorkspaceSymbolParams,
 )
+from pygls.exceptions import JsonRpcInvalidParams
 from pygls.lsp.server import LanguageServer
 from pygls.workspace import TextDocument
 
@@ -63,13 +78,17 @@ from . import (
   code_actions,
   commands,
   diagnostic,
+  prefetch,
   profiling,
   recipes,
+  reference_index,
   semantic_tokens,
   types,
+  workspace_index,
 )
 
-from .util import md5sum
+from .util import aiohttp_session, md5sum
+from .util.uris import join_uri
 
 
 server = LanguageServer(name="zc.buildout.languageserver", version="0.9.0")
@@ -81,6 +100,9 @@ reference_start = "${"
 reference_re = re.compile(
   r"\${(?P<section>[-a-zA-Z0-9 ._]*):(?P<option>[-a-zA-Z0-9 ._]+)}"
 )
+# names that can be referenced as ${section:option}
+section_name_re = re.compile(r"^[-a-zA-Z0-9._]+$")
+option_name_re = re.compile(r"^[-a-zA-Z0-9._]+$")
 logger = logging.getLogger(__name__)
 
 
@@ -118,6 +140,27 @@ async def command_open_pypi_page(
   )
 
 
+@server.command(commands.COMMAND_HTTP_REPORT)
+def command_http_report(
+  ls: LanguageServer, *args: object
+) -> Dict[str, Dict[str, float]]:
+  report = aiohttp_session.get_metrics()
+  ls.window_log_message(
+    LogMessageParams(
+      message="\n".join(
+        f"{lane}: {metrics['requests']} requests, {metrics['errors']} errors, "
+        f"{metrics['bytes_received']} bytes, "
+        f"{metrics['average_latency'] * 1000:.0f} ms average latency, "
+        f"{metrics['max_latency'] * 1000:.0f} ms max latency, "
+        f"{metrics['average_wait'] * 1000:.0f} ms average wait for a connection"
+        for lane, metrics in report.items()
+      ),
+      type=MessageType.Info,
+    )
+  )
+  return report
+
+
 @server.command(commands.COMMAND_UPDATE_MD5SUM)
 async def command_update_md5sum(
   ls: LanguageServer,
@@ -146,6 +189,7 @@ async def did_open(
   ls: LanguageServer,
   params: DidOpenTextDocumentParams,
 ) -> None:
+  prefetch.getPrefetcher(ls).prefetchProfile(ls, params.text_document.uri)
   await parseAndSendDiagnostics(ls, params.text_document.uri)
 
 
@@ -154,10 +198,25 @@ async def did_change(
   ls: LanguageServer,
   params: DidChangeTextDocumentParams,
 ) -> None:
-  buildout.clearCache(params.text_document.uri)
+  await buildout.updateCache(ls, params.text_document.uri)
+  prefetch.getPrefetcher(ls).prefetchProfile(ls, params.text_document.uri)
   await parseAndSendDiagnostics(ls, params.text_document.uri)
 
 
+@server.feature(TEXT_DOCUMENT_DID_CLOSE)
+async def did_close(
+  ls: LanguageServer,
+  params: DidCloseTextDocumentParams,
+) -> None:
+  # unsaved modifications are discarded
+  buildout.clearCache(params.text_document.uri, ls)
+
+
+@server.feature(SHUTDOWN)
+def lsp_shutdown(ls: LanguageServer, params: None) -> None:
+  prefetch.cancelPrefetch(ls.workspace)
+
+
 @server.feature(WORKSPACE_DID_CHANGE_WATCHED_FILES)
 async def did_change_watched_file(
   ls: LanguageServer,
@@ -165,6 +224,8 @@ async def did_change_watched_file(
 ) -> None:
   for change in params.changes:
     buildout.clearCache(change.uri)
+  workspace_index.getWorkspaceIndex(ls).update(params.changes)
+  reference_index.getReferenceIndex(ls).update(params.changes)
 
 
 @server.feature(TEXT_DOCUMENT_DOCUMENT_SYMBOL)
@@ -234,6 +295,24 @@ async def lsp_symbols(
   return symbols
 
 
+@server.feature(WORKSPACE_SYMBOL)
+async def lsp_workspace_symbols(
+  ls: LanguageServer,
+  params: WorkspaceSymbolParams,
+) -> List[SymbolInformation]:
+  return [
+    SymbolInformation(
+      name=symbol.name,
+      kind=SymbolKind.Class if symbol.container_name is None else SymbolKind.Field,
+      location=Location(uri=symbol.uri, range=symbol.range),
+      container_name=symbol.container_name,
+    )
+    for symbol in await reference_index.getReferenceIndex(ls).searchWorkspaceSymbols(
+      ls, params.query
+    )
+  ]
+
+
 @server.feature(
   TEXT_DOCUMENT_COMPLETION, CompletionOptions(trigger_characters=["{", ":"])
 )
@@ -550,10 +629,7 @@ async def lsp_completion(
         if symbol.current_option_name == "extends":
           # complete extends = | with local files
           doc_path = pathlib.Path(doc.path)
-          root_path = pathlib.Path(ls.workspace.root_path)
-          for profile in itertools.chain(
-            root_path.glob("**/*.cfg"), root_path.glob("*.cfg")
-          ):
+          for profile in workspace_index.getWorkspaceIndex(ls).getProfiles():
             profile_relative_path = os.path.relpath(profile, doc_path.parent)
             items.append(
               CompletionItem(
@@ -641,7 +717,7 @@ async def lsp_definition(
           base = uri[: uri.rfind("/")] + "/"
           locations.append(
             Location(
-              uri=urllib.parse.urljoin(base, extend),
+              uri=join_uri(base, extend),
               range=Range(
                 start=Position(line=0, character=0), end=Position(line=1, character=0)
               ),
@@ -656,15 +732,37 @@ async def lsp_references(
   params: ReferenceParams,
 ) -> List[Location]:
   references: List[Location] = []
-  if params.work_done_token:
+  work_done_token = params.work_done_token
+  partial_result_token = params.partial_result_token
+  if work_done_token:
     server.work_done_progress.begin(
-      params.work_done_token,
-      WorkDoneProgressBegin(title="Finding references", cancellable=True),
+      work_done_token,
+      WorkDoneProgressBegin(title="Finding references", cancellable=True, percentage=0),
     )
-  searched_document = await buildout.parse(server, params.text_document.uri)
-  assert searched_document is not None
-  searched_symbol = await searched_document.getSymbolAtPosition(params.position)
-  if searched_symbol is not None:
+
+  def progress(done: int, total: int) -> None:
+    if work_done_token and total:
+      server.work_done_progress.report(
+        work_done_token,
+        WorkDoneProgressReport(percentage=done * 100 // total),
+      )
+
+  def cancelled() -> bool:
+    """Check if the client cancelled the progress.
+
+    Cancelling the request itself with $/cancelRequest cancels the task
+    running this coroutine.
+    """
+    if not work_done_token:
+      return False
+    return server.work_done_progress.tokens[work_done_token].cancelled()
+
+  try:
+    searched_document = await buildout.parse(server, params.text_document.uri)
+    assert searched_document is not None
+    searched_symbol = await searched_document.getSymbolAtPosition(params.position)
+    if searched_symbol is None:
+      return references
     searched_option = None
     if searched_symbol.kind in (
       buildout.SymbolKind.SectionDefinition,
@@ -684,37 +782,116 @@ async def lsp_references(
       searched_option,
     )
     assert searched_section
-    for profile_path in pathlib.Path(server.workspace.root_path).glob("**/*.cfg"):
-      profile = await buildout.parse(server, profile_path.as_uri())
-      if profile is not None:
-        assert isinstance(profile, buildout.BuildoutProfile)
-
-        # listing a section in ${buildout:parts} is a reference
-        parts = profile["buildout"].get("parts")
-        if parts is not None and searched_section in parts.value:
-          for option_text, option_range in profile.getOptionValues("buildout", "parts"):
-            if searched_section == option_text:
-              references.append(Location(uri=profile.uri, range=option_range))
-
-        async for symbol in profile.getAllOptionReferenceSymbols():
-          if symbol.referenced_section_name == searched_section:
-            if searched_option is None:
-              references.append(Location(uri=profile.uri, range=symbol.section_range))
-            elif symbol.referenced_option_name == searched_option:
-              references.append(Location(uri=profile.uri, range=symbol.option_range))
-
-        if searched_option is None:
-          # find references in <= macros
-          for options in profile.values():
-            for option_key, option_value in options.items():
-              if option_key == "<":
-                if option_value.value == searched_section:
-                  loc = option_value.locations[-1]
-                  assert loc.uri == profile.uri
-                  references.append(loc)
-  if params.work_done_token:
-    server.work_done_progress.end(params.work_done_token, WorkDoneProgressEnd())
-  return references
+    queries = [
+      reference_index.SymbolQuery(
+        (reference_index.IndexedSymbolKind.Part,), searched_section
+      )
+    ]
+    if searched_option is None:
+      queries.append(
+        reference_index.SymbolQuery(
+          (
+            reference_index.IndexedSymbolKind.SectionReference,
+            reference_index.IndexedSymbolKind.Macro,
+          ),
+          searched_section,
+        )
+      )
+    else:
+      queries.append(
+        reference_index.SymbolQuery(
+          (reference_index.IndexedSymbolKind.OptionReference,),
+          searched_section,
+          searched_option,
+        )
+      )
+    async for _, locations in reference_index.getReferenceIndex(server).iterSymbols(
+      server, queries, progress, cancelled
+    ):
+      if partial_result_token:
+        # stream the references of each profile as soon as they are found
+        server.progress(ProgressParams(token=partial_result_token, value=locations))
+      else:
+        references.extend(locations)
+    return references
+  finally:
+    if work_done_token:
+      server.work_done_progress.end(work_done_token, WorkDoneProgressEnd())
+
+
+async def getRenamedSymbol(
+  ls: LanguageServer,
+  uri: str,
+  position: Position,
+) -> Optional[reference_index.IndexedSymbol]:
+  """Return the symbol that can be renamed at position."""
+  profile = await buildout.parse(ls, uri)
+  return reference_index.getSymbolAtPosition(
+    await reference_index.getProfileSymbols(profile),
+    position,
+  )
+
+
+@server.feature(TEXT_DOCUMENT_PREPARE_RENAME)
+async def lsp_prepare_rename(
+  ls: LanguageServer,
+  params: PrepareRenameParams,
+) -> Optional[Range]:
+  symbol = await getRenamedSymbol(ls, params.text_document.uri, params.position)
+  if symbol is None:
+    return None
+  if symbol.kind == reference_index.IndexedSymbolKind.Macro:
+    # rename from the section name, not from the whole option value
+    return None
+  return symbol.range
+
+
+@server.feature(TEXT_DOCUMENT_RENAME)
+async def lsp_rename(
+  ls: LanguageServer,
+  params: RenameParams,
+) -> Optional[WorkspaceEdit]:
+  symbol = await getRenamedSymbol(ls, params.text_document.uri, params.position)
+  if symbol is None or symbol.kind == reference_index.IndexedSymbolKind.Macro:
+    return None
+  index = reference_index.getReferenceIndex(ls)
+  if symbol.kind in (
+    reference_index.IndexedSymbolKind.OptionDefinition,
+    reference_index.IndexedSymbolKind.OptionReference,
+  ):
+    if not option_name_re.match(params.new_name):
+      raise JsonRpcInvalidParams(f"Invalid option name: {params.new_name}")
+    assert symbol.option_name
+    locations = await index.getSymbols(
+      ls,
+      (
+        reference_index.IndexedSymbolKind.OptionDefinition,
+        reference_index.IndexedSymbolKind.OptionReference,
+      ),
+      symbol.section_name,
+      symbol.option_name,
+    )
+  else:
+    if not section_name_re.match(params.new_name):
+      raise JsonRpcInvalidParams(f"Invalid section name: {params.new_name}")
+    locations = await index.getSymbols(
+      ls,
+      (
+        reference_index.IndexedSymbolKind.SectionDefinition,
+        reference_index.IndexedSymbolKind.SectionReference,
+        reference_index.IndexedSymbolKind.Part,
+        reference_index.IndexedSymbolKind.MacroSectionName,
+      ),
+      symbol.section_name,
+    )
+  changes: Dict[str, List[TextEdit]] = {}
+  for location in locations:
+    # ${:option} references the current section without naming it
+    if location.range.start != location.range.end:
+      changes.setdefault(location.uri, []).append(
+        TextEdit(range=location.range, new_text=params.new_name)
+      )
+  return WorkspaceEdit(changes=changes)
 
 
 @server.feature(TEXT_DOCUMENT_HOVER)
@@ -767,7 +944,7 @@ async def lsp_document_link(
       target = extend
       if target:
         if not buildout._isurl(extend):
-          target = urllib.parse.urljoin(base, extend)
+          target = join_uri(base, extend)
         links.append(DocumentLink(range=extend_range, target=target))
   return links
 
@@ -0,0 +1,237 @@
+"""In memory index of the symbols defined in workspace profiles, for
+``workspace/symbol``.
+
+Symbol names are indexed by trigrams, and by prefixes of their words for
+queries shorter than a trigram. A search first selects the candidate symbols
+sharing enough trigrams with the query, then ranks candidates with a fuzzy
+score, so that searching ``mariadb-srv`` finds ``mariadb-server``.
+"""
+
+import heapq
+import re
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set
+
+from lsprotocol.types import Range
+
+URI = str
+
+# maximum number of symbols returned by a search
+SEARCH_LIMIT = 256
+
+_word_separators = "-_.:/ "
+_word_start_re = re.compile(r"(?:^|(?<=[-_.:/ ]))\w")
+
+
+class WorkspaceSymbol(NamedTuple):
+  name: str
+  # the section of an option, None for sections
+  container_name: Optional[str]
+  uri: URI
+  range: Range
+
+
+class ScoredSymbol(NamedTuple):
+  score: int
+  # lower case name
+  name: str
+  symbol: WorkspaceSymbol
+
+
+def _trigrams(text: str) -> Set[str]:
+  return {text[i : i + 3] for i in range(len(text) - 2)}
+
+
+def _wordPrefixes(text: str) -> Set[str]:
+  """Prefixes of one or two characters of the words of text."""
+  prefixes = set()
+  for match in _word_start_re.finditer(text):
+    start = match.start()
+    prefixes.add(text[start : start + 1])
+    prefixes.add(text[start : start + 2])
+  return prefixes
+
+
+def fuzzyScore(query: str, name: str) -> Optional[int]:
+  """Score how well the lower case `query` matches the lower case `name`.
+
+  Returns None if the characters of query do not appear in name in the same
+  order. Exact matches score best, then prefixes, then matches at the start
+  of a word, then substrings, then other matches with fewer gaps. Shorter
+  names score better.
+  """
+  if not query:
+    return 0
+  if query == name:
+    return 1000
+  position = name.find(query)
+  if position == 0:
+    return 800 - len(name)
+  if position > 0:
+    if name[position - 1] in _word_separators:
+      return 600 - len(name)
+    return 400 - len(name)
+  # characters of query in order, with as few gaps as possible
+  score = 200 - len(name)
+  position = -1
+  for character in query:
+    next_position = name.find(character, position + 1)
+    if next_position == -1:
+      return None
+    if position != -1 and next_position != position + 1:
+      score -= 10
+    position = next_position
+  return score
+
+
+class SymbolIndex:
+  """Symbols of profiles, searchable by fuzzy name.
+
+  Names are indexed once even if many symbols have the same name, like the
+  ``[buildout]`` section of all profiles.
+  """
+
+  def __init__(self) -> None:
+    self._symbols_by_uri: Dict[URI, List[WorkspaceSymbol]] = {}
+    # symbols by lower case name
+    self._symbols_by_name: Dict[str, List[WorkspaceSymbol]] = {}
+    # lower case names by trigram and by word prefix
+    self._trigrams: Dict[str, Set[str]] = {}
+    self._prefixes: Dict[str, Set[str]] = {}
+    self._size = 0
+
+  def __len__(self) -> int:
+    return self._size
+
+  def set(self, uri: URI, symbols: Iterable[WorkspaceSymbol]) -> None:
+    """Replace the symbols of the profile at `uri`."""
+    self.remove(uri)
+    symbols = list(symbols)
+    if not symbols:
+      return
+    self._symbols_by_uri[uri] = symbols
+    self._size += len(symbols)
+    for symbol in symbols:
+      name = symbol.name.lower()
+      same_name_symbols = self._symbols_by_name.get(name)
+      if same_name_symbols is None:
+        same_name_symbols = self._symbols_by_name[name] = []
+        for trigram in _trigrams(name):
+          self._trigrams.setdefault(trigram, set()).add(name)
+        for prefix in _wordPrefixes(name):
+          self._prefixes.setdefault(prefix, set()).add(name)
+      same_name_symbols.append(symbol)
+
+  def remove(self, uri: URI) -> None:
+    """Remove the symbols of the profile at `uri`."""
+    symbols = self._symbols_by_uri.pop(uri, ())
+    self._size -= len(symbols)
+    for name in {symbol.name.lower() for symbol in symbols}:
+      same_name_symbols = [
+        symbol for symbol in self._symbols_by_name[name] if symbol.uri != uri
+      ]
+      if same_name_symbols:
+        self._symbols_by_name[name] = same_name_symbols
+        continue
+      del self._symbols_by_name[name]
+      for keys, postings in (
+        (_trigrams(name), self._trigrams),
+        (_wordPrefixes(name), self._prefixes),
+      ):
+        for key in keys:
+          posting = postings[key]
+          posting.discard(name)
+          if not posting:
+            del postings[key]
+
+  def clear(self) -> None:
+    self._symbols_by_uri.clear()
+    self._symbols_by_name.clear()
+    self._trigrams.clear()
+    self._prefixes.clear()
+    self._size = 0
+
+  def _getCandidates(self, query: str) -> Iterable[str]:
+    if not query:
+      return self._symbols_by_name.keys()
+    if len(query) < 3:
+      return self._prefixes.get(query, ())
+    query_trigrams = _trigrams(query)
+    # candidates must share at least half of the trigrams of the query. Such
+    # candidates are in at least one of the `len - required + 1` smallest
+    # posting lists, so only these are merged.
+    required = (len(query_trigrams) + 1) // 2
+    postings = sorted(
+      (self._trigrams.get(trigram, set()) for trigram in query_trigrams), key=len
+    )
+    if required == len(postings):
+      return set.intersection(*postings)
+    candidates: Set[str] = set()
+    for posting in postings[: len(postings) - required + 1]:
+      candidates.update(posting)
+    if required > 1:
+      candidates = {
+        candidate
+        for candidate in candidates
+        if sum(candidate in posting for posting in postings) >= required
+      }
+    return candidates
+
+  def getScoredSymbols(
+    self,
+    query: str,
+    limit: int = SEARCH_LIMIT,
+    excluded_uris: Iterable[URI] = (),
+  ) -> List[ScoredSymbol]:
+    """Return at least the `limit` best symbols matching the lower case
+    `query`, with their score.
+
+    Symbols of `excluded_uris` are not returned.
+    """
+    scored_names = []
+    for name in self._getCandidates(query):
+      score = fuzzyScore(query, name)
+      if score is not None:
+        scored_names.append((-score, name))
+    excluded = set(excluded_uris)
+    scored: List[ScoredSymbol] = []
+    # names are ranked before looking up their symbols, this is enough to
+    # find the best symbols as all symbols with the same name have the
+    # same score.
+    for negative_score, name in heapq.nsmallest(limit, scored_names):
+      scored.extend(
+        ScoredSymbol(-negative_score, name, symbol)
+        for symbol in self._symbols_by_name[name]
+        if symbol.uri not in excluded
+      )
+    return scored
+
+  def search(
+    self,
+    query: str,
+    limit: int = SEARCH_LIMIT,
+    excluded_uris: Iterable[URI] = (),
+  ) -> List[WorkspaceSymbol]:
+    """Return the symbols matching `query`, best matches first.
+
+    Symbols of `excluded_uris` are not returned.
+    """
+    return rank(self.getScoredSymbols(query.lower(), limit, excluded_uris), limit)
+
+
+def rank(
+  scored: Iterable[ScoredSymbol], limit: int = SEARCH_LIMIT
+) -> List[WorkspaceSymbol]:
+  """Return the `limit` best symbols, then sorted by name and location."""
+  return [
+    scored_symbol.symbol
+    for scored_symbol in heapq.nsmallest(
+      limit,
+      scored,
+      key=lambda scored_symbol: (
+        -scored_symbol.score,
+        scored_symbol.name,
+        scored_symbol.symbol.uri,
+        scored_symbol.symbol.range.start.line,
+      ),
+    )
+  ]
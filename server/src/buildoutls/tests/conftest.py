@@ -1,6 +1,8 @@
 import collections
 import concurrent.futures
+import json
 import os
+import pathlib
 import urllib.parse
 from typing import Any
 from unittest import mock
@@ -16,23 +18,63 @@ from ..buildout import (
   _parse_cache,
   _resolved_buildout_cache,
   _resolved_extends_cache,
+  _template_index,
   parse,
 )
 from ..util.aiohttp_session import close_session
+from ..util.circuit_breaker import clear_circuit_breakers
+from ..util.cache_dir import set_cache_directory
 
 
 @pytest.fixture(autouse=True)
 async def close_aiohttp_session():
   yield
+  clear_circuit_breakers()
   await close_session()
 
 
+@pytest.fixture(autouse=True)
+def cache_directory(tmp_path_factory: pytest.TempPathFactory):
+  cache_directory = tmp_path_factory.mktemp("cache")
+  set_cache_directory(str(cache_directory))
+  yield cache_directory
+  set_cache_directory(None)
+
+
 @pytest.fixture
 def mocked_responses():
   with aioresponses.aioresponses() as m:
     yield m
 
 
+def loadTestData(name: str) -> Any:
+  """Load a JSON document of testdata."""
+  with open(pathlib.Path(__file__).parent / "testdata" / name) as f:
+    return json.load(f)
+
+
+def countRequests(mocked_responses: aioresponses.aioresponses) -> int:
+  """Number of requests sent to mocked_responses."""
+  return sum(len(requests) for requests in mocked_responses.requests.values())
+
+
+@pytest.fixture
+def sampleproject_responses(
+  mocked_responses: aioresponses.aioresponses,
+) -> aioresponses.aioresponses:
+  mocked_responses.get(
+    "https://pypi.org/pypi/sampleproject/json",
+    payload=loadTestData("sampleproject.json"),
+    repeat=True,
+  )
+  mocked_responses.get(
+    "https://pypi.org/pypi/sampleproject/1.2.0/json",
+    payload=loadTestData("sampleproject-1.2.0.json"),
+    repeat=True,
+  )
+  return mocked_responses
+
+
 @pytest.fixture
 def server() -> Any:
   root_path = os.path.abspath(
@@ -53,6 +95,7 @@ def server() -> Any:
   workspace_apply_edit = mock.Mock()
   work_done_progress = mock.create_autospec(pygls.progress.Progress)
   work_done_progress.tokens = collections.defaultdict(concurrent.futures.Future)
+  progress = mock.Mock()
 
   class FakeServer:
     """We don't need real server to unit test features."""
@@ -69,6 +112,7 @@ def server() -> Any:
       self.window_log_message = window_log_message
       self.workspace_apply_edit = workspace_apply_edit
       self.work_done_progress = work_done_progress
+      self.progress = progress
 
   server = FakeServer()
 
@@ -97,6 +141,7 @@ def server() -> Any:
     _resolved_extends_cache.clear()
     _parse_cache.clear()
     _extends_dependency_graph.clear()
+    _template_index.clear()
 
   clearCaches()
   with os_path_exists_patcher:
@@ -105,6 +150,9 @@ def server() -> Any:
   server.window_show_message.reset_mock()
   server.window_log_message.reset_mock()
   server.workspace.get_text_document.reset_mock()
+  server.work_done_progress.reset_mock()
+  server.work_done_progress.tokens.clear()
+  server.progress.reset_mock()
 
   clearCaches()
 
@@ -0,0 +1,125 @@
+import asyncio
+from typing import Any, Dict, List
+
+import aiohttp
+import aioresponses
+import pytest
+
+from ..server import command_http_report
+from ..util import aiohttp_session
+from ..util.aiohttp_session import Lane
+
+url = "https://pypi.example/pypi/project/json"
+
+
+async def test_session() -> None:
+  session = aiohttp_session.get_session()
+  assert (
+    session.timeout.total,
+    session.timeout.sock_connect,
+    session.timeout.sock_read,
+  ) == (
+    aiohttp_session.TOTAL_TIMEOUT,
+    aiohttp_session.CONNECT_TIMEOUT,
+    aiohttp_session.READ_TIMEOUT,
+  )
+  connector = session.connector
+  assert isinstance(connector, aiohttp.TCPConnector)
+  assert (connector.limit, connector.limit_per_host, connector.use_dns_cache) == (
+    aiohttp_session.CONNECTIONS,
+    aiohttp_session.CONNECTIONS_PER_HOST,
+    True,
+  )
+
+  aiohttp_session.set_timeouts(connect=1, read=2, total=3)
+  aiohttp_session.set_connections_per_host(4)
+  try:
+    await aiohttp_session.close_session()
+    session = aiohttp_session.get_session()
+    assert (
+      session.timeout.total,
+      session.timeout.sock_connect,
+      session.timeout.sock_read,
+    ) == (3, 1, 2)
+    assert session.connector is not None
+    assert session.connector.limit_per_host == 4
+  finally:
+    aiohttp_session.set_timeouts()
+    aiohttp_session.set_connections_per_host()
+
+
+async def test_lanes() -> None:
+  # one connection for background requests, three for interactive requests
+  lanes = aiohttp_session._HostLanes(3)
+  started: List[str] = []
+  done: Dict[str, asyncio.Event] = {}
+
+  async def request(name: str, lane: Lane) -> None:
+    done[name] = asyncio.Event()
+    await lanes.acquire(lane)
+    started.append(name)
+    try:
+      await done[name].wait()
+    finally:
+      lanes.release()
+
+  def start(name: str, lane: Lane) -> "asyncio.Task[None]":
+    return asyncio.ensure_future(request(name, lane))
+
+  async def finish(name: str) -> None:
+    done[name].set()
+    for _ in range(3):
+      await asyncio.sleep(0)
+
+  tasks = [
+    start("background-1", Lane.BACKGROUND),
+    start("background-2", Lane.BACKGROUND),
+    start("interactive-1", Lane.INTERACTIVE),
+    start("interactive-2", Lane.INTERACTIVE),
+    start("interactive-3", Lane.INTERACTIVE),
+    start("background-3", Lane.BACKGROUND),
+  ]
+  await asyncio.sleep(0)
+  assert started == ["background-1", "interactive-1", "interactive-2"]
+
+  # interactive requests start first
+  await finish("background-1")
+  assert started[3:] == ["interactive-3"]
+
+  # cancelled requests do not start
+  tasks[1].cancel()
+  await finish("interactive-1")
+  await finish("interactive-2")
+  assert started[4:] == []
+  await finish("interactive-3")
+  assert started[4:] == ["background-3"]
+  await finish("background-3")
+  await asyncio.gather(*tasks, return_exceptions=True)
+  assert lanes._active == 0
+
+
+async def test_metrics(mocked_responses: aioresponses.aioresponses) -> None:
+  aiohttp_session.reset_metrics()
+  mocked_responses.get(url, body=b"x" * 100)
+  mocked_responses.get(url, exception=aiohttp.ClientConnectionError())
+  async with aiohttp_session.request("GET", url, Lane.INTERACTIVE) as resp:
+    assert await resp.read() == b"x" * 100
+  with pytest.raises(aiohttp.ClientConnectionError):
+    async with aiohttp_session.request("GET", url):
+      pass
+
+  metrics = aiohttp_session.get_metrics()
+  assert metrics["interactive"]["requests"] == 1
+  assert metrics["interactive"]["errors"] == 0
+  assert metrics["interactive"]["bytes_received"] == 100
+  assert metrics["interactive"]["max_latency"] >= 0
+  assert metrics["background"]["requests"] == 1
+  assert metrics["background"]["errors"] == 1
+  assert metrics["background"]["bytes_received"] == 0
+
+
+async def test_http_report_command(server: Any) -> None:
+  aiohttp_session.reset_metrics()
+  assert command_http_report(server) == aiohttp_session.get_metrics()
+  (params,) = server.window_log_message.call_args[0]
+  assert params.message.splitlines()[0].startswith("interactive: 0 requests")
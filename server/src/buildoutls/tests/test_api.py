@@ -0,0 +1,99 @@
+import pathlib
+import textwrap
+from typing import Iterator
+
+import pytest
+
+from .. import api
+from ..buildout import BuildoutProfile, BuildoutTemplate
+from ..documents import (
+  DocumentSource,
+  FileSystemDocumentSource,
+  HTTPDocumentSource,
+  OverlayDocumentSource,
+)
+
+profiles_path = pathlib.Path(__file__).resolve().parents[4] / "profiles"
+
+
+@pytest.fixture(autouse=True)
+def clear_cache() -> Iterator[None]:
+  api.clear_cache()
+  yield
+  api.clear_cache()
+
+
+async def test_resolve_path() -> None:
+  resolved = await api.resolve(profiles_path / "extended" / "two_levels.cfg")
+  assert isinstance(resolved, BuildoutProfile)
+  assert resolved.resolve_value("test", "value") == (
+    "option from extended/extended.cfg\nthen extended in extended/buildout.cfg"
+  )
+
+
+async def test_resolve_uri() -> None:
+  resolved = await api.resolve((profiles_path / "extended" / "two_levels.cfg").as_uri())
+  assert [loc.uri for loc in resolved["extended_option"]["option"].locations] == [
+    (profiles_path / "extended" / "extended.cfg").as_uri(),
+    (profiles_path / "extended" / "buildout.cfg").as_uri(),
+  ]
+
+
+async def test_parse_does_not_resolve_extends() -> None:
+  parsed = await api.parse(profiles_path / "extended" / "two_levels.cfg")
+  assert "extended_option" not in parsed
+  assert parsed["buildout"]["extends"].value == "buildout.cfg"
+
+
+async def test_open_template() -> None:
+  template = await api.open(profiles_path / "template.in")
+  assert isinstance(template, BuildoutTemplate)
+  assert template.buildout.uri == (profiles_path / "buildout.cfg").as_uri()
+
+
+async def test_overlay_document_source() -> None:
+  extended_uri = (profiles_path / "extended" / "extended.cfg").as_uri()
+  documents = OverlayDocumentSource(FileSystemDocumentSource())
+  documents.set(
+    extended_uri,
+    textwrap.dedent("""\
+      [extended_option]
+      option = from overlay
+      """),
+  )
+  resolved = await api.resolve(
+    profiles_path / "extended" / "two_levels.cfg",
+    documents=HTTPDocumentSource(documents),
+  )
+  assert resolved.resolve_value("test", "value") == (
+    "from overlay\nthen extended in extended/buildout.cfg"
+  )
+
+  documents.remove(extended_uri)
+  api.clear_cache(profiles_path / "extended" / "extended.cfg")
+  resolved = await api.resolve(
+    profiles_path / "extended" / "two_levels.cfg",
+    documents=documents,
+  )
+  assert resolved.resolve_value("test", "value") == (
+    "option from extended/extended.cfg\nthen extended in extended/buildout.cfg"
+  )
+
+
+def test_incomplete_document_source() -> None:
+  class IncompleteDocumentSource(DocumentSource):
+    async def read(self, uri: str) -> str:
+      return ""
+
+  with pytest.raises(TypeError):
+    IncompleteDocumentSource()  # type: ignore[abstract]
+
+
+async def test_document_source_not_found() -> None:
+  documents = FileSystemDocumentSource()
+  uri = (profiles_path / "not_exists.cfg").as_uri()
+  assert not documents.exists(uri)
+  with pytest.raises(IOError):
+    await documents.read(uri)
+  with pytest.raises(IOError):
+    await api.parse(uri, documents=documents, allow_errors=False)
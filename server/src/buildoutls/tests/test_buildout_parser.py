@@ -1,6 +1,7 @@
 import io
+import pathlib
 import textwrap
-from typing import List
+from typing import List, Mapping
 from unittest import mock
 
 import pytest
@@ -10,15 +11,27 @@ from lsprotocol.types import Location, Position, Range
 from pygls.lsp.server import LanguageServer
 
 
+from ..documents import FileSystemDocumentSource, OverlayDocumentSource
+from ..util.uris import canonical_uri
 from ..buildout import (
   BuildoutProfile,
   BuildoutTemplate,
   RecursiveIncludeError,
   Symbol,
   SymbolKind,
+  TemplateIndex,
+  TemplateReference,
   clearCache,
+  diffProfiles,
+  updateCache,
+  _do_extend_raw,
   _parse,
+  _parse_cache,
+  _resolved_buildout_cache,
+  _template_index,
+  _update_section,
   open,
+  option_reference_strict_re,
 )
 
 
@@ -126,6 +139,64 @@ async def test_parse() -> None:
   assert not parsed.has_jinja
 
 
+async def test_parse_interned_strings() -> None:
+  def getKey(mapping: Mapping[str, object], key: str) -> str:
+    return next(k for k in mapping if k == key)
+
+  parsed = [
+    await _parse(
+      fp=io.StringIO("[section]\nrecipe = slapos.recipe.build\nurl = x\n"),
+      uri=f"file:///directory/{name}.cfg",
+      allow_errors=False,
+    )
+    for name in ("one", "two")
+  ]
+  one, two = parsed
+  # section names, option names and short values are shared between profiles
+  assert getKey(one, "section") is getKey(two, "section")
+  assert getKey(one["section"], "recipe") is getKey(two["section"], "recipe")
+  assert one["section"]["recipe"].value is two["section"]["recipe"].value
+  assert (
+    one["section"]["_profile_base_location_"].value
+    is two["section"]["_profile_base_location_"].value
+  )
+  # default values share their location
+  assert (
+    one["section"]["_profile_base_location_"].location
+    is one["buildout"]["directory"].location
+  )
+
+
+async def test_parse_multi_line_values() -> None:
+  parsed = await _parse(
+    fp=io.StringIO(
+      textwrap.dedent("""\
+        [section]
+        option =
+          first
+            indented
+
+          last
+        option = overridden
+          value
+        other = value
+        """)
+    ),
+    uri="file:///buildout.cfg",
+    allow_errors=False,
+  )
+  option = parsed["section"]["option"]
+  # values are joined when accessed
+  assert option._lines is not None
+  assert option.values == ("first\n  indented\n\nlast", "overridden\nvalue")
+  assert option._lines is None
+  assert option.location.range == Range(
+    start=Position(line=6, character=8), end=Position(line=7, character=7)
+  )
+  option.updateValue("updated")
+  assert option.values == ("first\n  indented\n\nlast", "updated")
+
+
 async def test_parse_jinja_option() -> None:
   parsed = await _parse(
     fp=io.StringIO(
@@ -938,6 +1009,277 @@ async def test_open_macro(server: LanguageServer):
   assert "<" not in parsed["macro_user"]
 
 
+async def test_open_macro_shared(server: LanguageServer):
+  parsed = await open(ls=server, uri="file:///extended/macros/shared.cfg")
+  assert isinstance(parsed, BuildoutProfile)
+  assert {
+    section_name: {
+      option_name: option.value
+      for option_name, option in section.items()
+      if not option_name.startswith("_")
+    }
+    for section_name, section in parsed.items()
+    if section_name != "buildout"
+  } == {
+    "base": {"base-option": "base", "list": "a"},
+    "middle": {"base-option": "base", "list": "a", "middle-option": "middle"},
+    "user1": {
+      "base-option": "base",
+      "list": "a",
+      "middle-option": "middle",
+      "user-option": "user1",
+    },
+    "user2": {"base-option": "base", "list": "a\nb", "middle-option": "user2"},
+  }
+  # sections extending the same macro share its options
+  assert parsed["user1"]["base-option"] is parsed["base"]["base-option"]
+  assert parsed["user2"]["base-option"] is parsed["base"]["base-option"]
+  assert parsed["user1"]["middle-option"] is parsed["middle"]["middle-option"]
+
+
+async def test_open_lazy_sections(tmp_path: pathlib.Path) -> None:
+  (tmp_path / "base.cfg").write_text(
+    "[macro]\noption = from macro\n"
+    + "".join(
+      f"[section{i}]\n<= macro\nvalue = {i}\n[section{i}]\nvalue += more\n"
+      for i in range(100)
+    )
+  )
+  (tmp_path / "small.cfg").write_text(
+    "[buildout]\nextends = base.cfg\n[section1]\nvalue += instance\n"
+  )
+  documents = FileSystemDocumentSource()
+  with (
+    mock.patch(
+      "buildoutls.buildout._update_section", wraps=_update_section
+    ) as update_section,
+    mock.patch("buildoutls.buildout._do_extend_raw", wraps=_do_extend_raw) as extend,
+  ):
+    resolved = await open(documents, (tmp_path / "small.cfg").as_uri())
+    assert isinstance(resolved, BuildoutProfile)
+    assert len(resolved) == 102
+    # sections are not merged or extended before they are accessed
+    assert update_section.call_count == 0
+    assert extend.call_count == 0
+    assert resolved["section1"]["value"].value == "1\nmore\ninstance"
+    assert resolved["section1"]["option"].value == "from macro"
+    # only section1 was computed
+    assert update_section.call_count == 2
+    assert extend.call_count == 2
+
+  section2 = resolved.get("section2")
+  assert section2 is not None
+  assert section2["value"].value == "2\nmore"
+  assert [section_name for section_name, _ in resolved.items()][-1] == "section99"
+  assert resolved == await open(documents, (tmp_path / "small.cfg").as_uri())
+  clearCache((tmp_path / "base.cfg").as_uri())
+
+
+async def test_diff_profiles() -> None:
+  old = await _parse(
+    io.StringIO("[a]\nx = 1\ny = 2\n[b]\nx = 1\n[c]\nx = 1\n"),
+    "file:///buildout.cfg",
+    allow_errors=False,
+  )
+  new = await _parse(
+    io.StringIO("[a]\nx = 2\nz = 3\n[b]\nx = 1\n[d]\n"),
+    "file:///buildout.cfg",
+    allow_errors=False,
+  )
+  diff = diffProfiles(old, new)
+  assert diff.added_sections == {"d"}
+  assert diff.removed_sections == {"c"}
+  assert list(diff.changed_sections) == ["a"]
+  assert diff.changed_sections["a"].added_options == {"z"}
+  assert diff.changed_sections["a"].removed_options == {"y"}
+  assert diff.changed_sections["a"].changed_options == {"x"}
+  assert diff.sections == {"a", "c", "d"}
+  assert not any(diffProfiles(old, old))
+
+  # moving an option changes it
+  moved = await _parse(
+    io.StringIO("[a]\nx = 1\ny = 2\n[b]\n\nx = 1\n[c]\nx = 1\n"),
+    "file:///buildout.cfg",
+    allow_errors=False,
+  )
+  assert diffProfiles(old, moved).sections == {"b", "c"}
+
+
+async def test_update_cache(tmp_path: pathlib.Path) -> None:
+  base_uri = (tmp_path / "base.cfg").as_uri()
+  small_uri = (tmp_path / "small.cfg").as_uri()
+  base_source = textwrap.dedent("""\
+      [versions]
+      a = 1
+      [macro]
+      option = macro
+      [user]
+      <= macro
+      [referencing]
+      value = ${versions:a}
+      [unrelated]
+      value = unrelated
+      """)
+  (tmp_path / "base.cfg").write_text(base_source)
+  (tmp_path / "small.cfg").write_text(
+    "[buildout]\nextends = base.cfg\n[unrelated]\nvalue += small\n"
+  )
+  documents = OverlayDocumentSource(FileSystemDocumentSource())
+  resolved = await open(documents, small_uri)
+  assert isinstance(resolved, BuildoutProfile)
+  assert resolved.resolve_value("referencing", "value") == "1"
+  assert resolved.resolve_value("unrelated", "value") == "unrelated\nsmall"
+  assert resolved["user"]["option"].value == "macro"
+  cached = _resolved_buildout_cache[small_uri]
+  cached.materialize()
+  unrelated = cached._getLazySection("unrelated").get()
+
+  # modifying an option only computes again the sections depending on it
+  documents.set(base_uri, base_source.replace("a = 1", "a = 2"))
+  await updateCache(documents, base_uri)
+  assert _resolved_buildout_cache[small_uri] is not cached
+  with mock.patch(
+    "buildoutls.buildout._update_section", wraps=_update_section
+  ) as update_section:
+    resolved = await open(documents, small_uri)
+    assert isinstance(resolved, BuildoutProfile)
+    assert resolved["unrelated"]["value"].value == "unrelated\nsmall"
+    assert resolved.resolve_value("unrelated", "value") == "unrelated\nsmall"
+    assert resolved["user"]["option"].value == "macro"
+    update_section.assert_not_called()
+  assert (
+    _resolved_buildout_cache[small_uri]._getLazySection("unrelated").get() is unrelated
+  )
+  assert resolved["versions"]["a"].value == "2"
+  assert resolved.resolve_value("referencing", "value") == "2"
+
+  # sections using a modified macro are computed again
+  documents.set(base_uri, base_source.replace("option = macro", "option = modified"))
+  await updateCache(documents, base_uri)
+  resolved = await open(documents, small_uri)
+  assert isinstance(resolved, BuildoutProfile)
+  assert resolved["user"]["option"].value == "modified"
+  assert resolved.resolve_value("referencing", "value") == "1"
+
+  # modified extends are resolved again
+  documents.set(small_uri, "[buildout]\nextends =\n[unrelated]\nvalue += small\n")
+  await updateCache(documents, small_uri)
+  resolved = await open(documents, small_uri)
+  assert isinstance(resolved, BuildoutProfile)
+  assert list(resolved) == ["buildout", "unrelated"]
+  clearCache(base_uri)
+  clearCache(small_uri)
+
+
+@pytest.mark.parametrize(
+  "uri,expected",
+  (
+    ("file:///srv/a/../b//c/./d.cfg", "file:///srv/b/c/d.cfg"),
+    ("file://localhost/srv/", "file:///srv/"),
+    ("FILE:///srv/a/..", "file:///srv"),
+    ("https://Example.com/a/../b.cfg?x=1", "https://example.com/b.cfg?x=1"),
+    ("./a/../../b.cfg", "../b.cfg"),
+  ),
+)
+def test_canonical_uri(uri: str, expected: str) -> None:
+  assert canonical_uri(uri) == expected
+  assert canonical_uri(uri) is canonical_uri(expected)
+
+
+async def test_open_canonical_uris(tmp_path: pathlib.Path) -> None:
+  (tmp_path / "a").mkdir()
+  (tmp_path / "b").mkdir()
+  (tmp_path / "b" / "base.cfg").write_text("[section]\noption = base\n")
+  (tmp_path / "one.cfg").write_text(
+    f"[buildout]\nextends = file://localhost{tmp_path}//b/base.cfg\n"
+  )
+  (tmp_path / "a" / "two.cfg").write_text("[buildout]\nextends = ../b/base.cfg\n")
+  documents = FileSystemDocumentSource()
+  base_uri = (tmp_path / "b" / "base.cfg").as_uri()
+  for profile_uri, canonical_profile_uri in (
+    ((tmp_path / "one.cfg").as_uri(), (tmp_path / "one.cfg").as_uri()),
+    (f"file://{tmp_path}/b/..//a/two.cfg", (tmp_path / "a" / "two.cfg").as_uri()),
+  ):
+    resolved = await open(documents, profile_uri)
+    assert isinstance(resolved, BuildoutProfile)
+    assert resolved["section"]["option"].value == "base"
+    assert resolved.uri == canonical_profile_uri
+    assert resolved.dependencies == {base_uri, canonical_profile_uri}
+  # both profiles share the same cache entry for the extended profile
+  assert [uri for uri in _parse_cache if uri.endswith("base.cfg")] == [base_uri]
+  clearCache(base_uri)
+
+
+async def test_open_template_index(server: LanguageServer):
+  template = await open(ls=server, uri="file:///template.in")
+  assert isinstance(template, BuildoutTemplate)
+  assert template.buildout.uri == "file:///buildout.cfg"
+  assert _template_index.getReferences("file:///template.in") == [
+    TemplateReference("file:///buildout.cfg", "section6", "url")
+  ]
+
+  # next time, candidate profiles are not resolved again and the templates
+  # of the profile are not resolved either
+  with (
+    mock.patch.object(
+      BuildoutProfile,
+      "getTemplateReferences",
+      side_effect=AssertionError("profile is indexed"),
+    ),
+    mock.patch.object(
+      BuildoutProfile,
+      "_getTemplateOptionValues",
+      side_effect=AssertionError("templates resolved"),
+    ),
+  ):
+    template = await open(ls=server, uri="file:///template.in")
+  assert isinstance(template, BuildoutTemplate)
+  assert template.buildout.uri == "file:///buildout.cfg"
+
+  # a template used by a profile already resolved is found without looking
+  # for candidate profiles
+  clearCache("file:///buildout.cfg")
+  assert isinstance(await open(ls=server, uri="file:///buildout.cfg"), BuildoutProfile)
+  with mock.patch.object(
+    pathlib.Path, "glob", side_effect=AssertionError("candidates searched")
+  ):
+    template = await open(ls=server, uri="file:///template.in")
+  assert isinstance(template, BuildoutTemplate)
+  assert template.buildout.uri == "file:///buildout.cfg"
+
+  # modified profiles are removed from the index
+  clearCache("file:///buildout.cfg")
+  assert _template_index.getReferences("file:///template.in") == []
+  assert _template_index.getProfileTemplates("file:///buildout.cfg") is None
+
+
+async def test_template_index_pending_profiles(server: LanguageServer):
+  index = TemplateIndex()
+  profiles = {}
+  for uri in ("file:///buildout.cfg", "file:///diagnostics/reference.cfg"):
+    profile = await open(ls=server, uri=uri)
+    assert isinstance(profile, BuildoutProfile)
+    index.add(profile)
+    profiles[uri] = profile
+
+  # only the queried profile is indexed
+  with mock.patch.object(
+    profiles["file:///diagnostics/reference.cfg"],
+    "getTemplateReferences",
+    side_effect=AssertionError("not queried"),
+  ):
+    templates = index.getProfileTemplates("file:///buildout.cfg")
+  assert templates is not None
+  assert templates["file:///template.in"] == TemplateReference(
+    "file:///buildout.cfg", "section6", "url"
+  )
+  assert list(index._pending) == ["file:///diagnostics/reference.cfg"]
+
+  # all the profiles are indexed to find the references to a template
+  index.getReferences("file:///template.in")
+  assert not index._pending
+
+
 async def test_open_extends_network(
   server: LanguageServer, mocked_responses: aioresponses.aioresponses
 ):
@@ -1007,3 +1349,89 @@ async def test_BuildoutProfile_resolve_value(buildout: BuildoutProfile) -> None:
     buildout.resolve_value("section1", "option-not-exists")
   with pytest.raises(KeyError):
     buildout.resolve_value("section-not-exists", "option")
+
+
+async def test_BuildoutProfile_resolve_value_memoized() -> None:
+  parsed = await _parse(
+    fp=io.StringIO(
+      textwrap.dedent("""\
+        [macro]
+        macro-option = from macro
+        [user]
+        <= macro
+        [a]
+        option = ${b:option} ${user:macro-option}
+        [b]
+        option = ${c:option}
+        [c]
+        option = c
+        [unrelated]
+        option = ${c:option} unrelated
+        missing = ${d:option}
+        """)
+    ),
+    uri="file:///buildout.cfg",
+    allow_errors=False,
+  )
+  assert parsed.resolve_value("a", "option") == "c from macro"
+  assert parsed.resolve_value("unrelated", "option") == "c unrelated"
+  assert parsed.resolve_value("unrelated", "missing") == "${d:option}"
+
+  # modifying an option invalidates the values depending on it
+  parsed["b"]["option"].updateValue("b")
+  parsed.invalidate_value("b", "option")
+  assert parsed.resolve_value("a", "option") == "b from macro"
+  assert parsed.resolve_value("unrelated", "option") == "c unrelated"
+  assert parsed._resolved_values is not None
+  assert ("unrelated", "option") in parsed._resolved_values.values
+
+  # so does modifying the macro
+  parsed["macro"]["macro-option"].updateValue("modified macro")
+  parsed.invalidate_value("macro", "macro-option")
+  assert parsed.resolve_value("a", "option") == "b modified macro"
+  assert parsed.resolve_value("user", "macro-option") == "modified macro"
+  assert ("unrelated", "option") in parsed._resolved_values.values
+
+  # copies share memoized values, until they are modified
+  copied = parsed.copy()
+  assert copied._resolved_values is parsed._resolved_values
+  copied["b"] = copied["c"]
+  assert copied.resolve_value("a", "option") == "c modified macro"
+  assert parsed.resolve_value("a", "option") == "b modified macro"
+  assert copied._resolved_values is not parsed._resolved_values
+
+  # defining a missing section
+  parsed["d"] = parsed["c"]
+  assert parsed.resolve_value("unrelated", "missing") == "c"
+
+
+async def test_BuildoutProfile_resolve_value_linear() -> None:
+  # each option references two options of the previous section
+  parsed = await _parse(
+    fp=io.StringIO(
+      "".join(
+        f"[section{i}]\n"
+        + "".join(
+          (
+            f"option{j} = ${{section{i - 1}:option{j}}}"
+            f"${{section{i - 1}:option{(j + 1) % 10}}}\n"
+          )
+          if i
+          else f"option{j} = {j}\n"
+          for j in range(10)
+        )
+        for i in range(10)
+      )
+    ),
+    uri="file:///buildout.cfg",
+    allow_errors=False,
+  )
+  with mock.patch(
+    "buildoutls.buildout.option_reference_strict_re",
+    wraps=option_reference_strict_re,
+  ) as option_reference_strict_re_mock:
+    for i in range(10):
+      for j in range(10):
+        assert len(parsed.resolve_value(f"section{i}", f"option{j}")) == 2**i
+  # each value is substituted once
+  assert option_reference_strict_re_mock.sub.call_count == 100
@@ -0,0 +1,129 @@
+import asyncio
+import time
+from typing import Any, List
+from unittest import mock
+
+import aiohttp
+import aioresponses
+import pytest
+from aioresponses import CallbackResult
+
+from .. import diagnostic
+from ..server import parseAndSendDiagnostics
+from ..util import circuit_breaker, pypi
+from ..util.http_cache import HTTPCache
+from .conftest import countRequests
+
+url = "https://pypi.example/pypi/project/json"
+
+
+async def waitUntilAvailable(breaker: circuit_breaker.CircuitBreaker) -> None:
+  async def wait() -> None:
+    while breaker.is_down:
+      await asyncio.sleep(0.01)
+
+  await asyncio.wait_for(wait(), 5)
+
+
+@pytest.fixture
+def backoff() -> Any:
+  with mock.patch.object(circuit_breaker, "INITIAL_BACKOFF", 0.01):
+    yield
+
+
+async def test_circuit_breaker(
+  mocked_responses: aioresponses.aioresponses,
+  backoff: None,
+) -> None:
+  cache = HTTPCache("test")
+  breaker = circuit_breaker.get_circuit_breaker(url)
+  assert circuit_breaker.get_circuit_breaker("https://pypi.example/other") is breaker
+  assert breaker.base_url == "https://pypi.example/"
+
+  # client errors are answers of the host
+  mocked_responses.get(url, status=404, payload={"message": "Not Found"})
+  assert await cache.get_json(url) == {"message": "Not Found"}
+  cache.clear()
+  cache._memory.clear()
+  mocked_responses.get(url, status=503)
+  with pytest.raises(aiohttp.ClientResponseError):
+    await cache.get_json(url)
+  assert breaker.failures == 1
+  mocked_responses.get(url, payload={"version": 1})
+  assert await cache.get_json(url) == {"version": 1}
+  assert breaker.failures == 0
+
+  # consecutive failures mark the host down
+  cache = HTTPCache("other")
+  probed = asyncio.Event()
+  mocked_responses.head("https://pypi.example/", exception=aiohttp.ClientOSError())
+  mocked_responses.head(
+    "https://pypi.example/",
+    callback=lambda *args, **kwargs: probed.set(),
+  )
+  mocked_responses.get(url, exception=aiohttp.ServerTimeoutError())
+  mocked_responses.get(
+    url, exception=aiohttp.ClientConnectorError(mock.Mock(), OSError())
+  )
+  mocked_responses.get(url, status=500)
+  for _ in range(circuit_breaker.FAILURE_THRESHOLD):
+    with pytest.raises(aiohttp.ClientError):
+      await cache.get_json(url)
+  assert breaker.is_down
+  requests_count = countRequests(mocked_responses)
+
+  # requests fail immediately while the host is down
+  with pytest.raises(circuit_breaker.HostUnavailableError):
+    await cache.get_json(url)
+  assert countRequests(mocked_responses) == requests_count
+
+  # until a probe succeeds
+  await waitUntilAvailable(breaker)
+  assert probed.is_set()
+  mocked_responses.get(url, payload={"version": 2})
+  assert await cache.get_json(url) == {"version": 2}
+
+
+async def test_backoff(
+  mocked_responses: aioresponses.aioresponses,
+  backoff: None,
+) -> None:
+  breaker = circuit_breaker.get_circuit_breaker(url)
+  backoffs: List[float] = []
+
+  def probe(*args: Any, **kwargs: Any) -> CallbackResult:
+    backoffs.append(breaker.backoff)
+    return CallbackResult(status=200 if len(backoffs) >= 3 else 502)
+
+  mocked_responses.head("https://pypi.example/", callback=probe, repeat=True)
+  for _ in range(circuit_breaker.FAILURE_THRESHOLD):
+    breaker.record_failure()
+  assert breaker.is_down
+  await waitUntilAvailable(breaker)
+  assert backoffs == [0.01, 0.02, 0.04]
+
+  # a stopped probe starts again with the next request
+  for _ in range(circuit_breaker.FAILURE_THRESHOLD):
+    breaker.record_failure()
+  breaker.close()
+  with pytest.raises(circuit_breaker.HostUnavailableError):
+    breaker.check()
+  await waitUntilAvailable(breaker)
+  assert len(backoffs) == 4
+
+
+async def test_diagnostics_do_not_wait_for_unavailable_index(
+  server: Any,
+  mocked_responses: aioresponses.aioresponses,
+) -> None:
+  breaker = circuit_breaker.get_circuit_breaker("https://pypi.org/")
+  for _ in range(circuit_breaker.FAILURE_THRESHOLD):
+    breaker.record_failure()
+  with mock.patch.object(diagnostic, "pypi_client", pypi.PyPIClient()):
+    start = time.monotonic()
+    await parseAndSendDiagnostics(
+      server, "file:///code_actions/known_vulnerabilities.cfg"
+    )
+  assert time.monotonic() - start < 1
+  assert countRequests(mocked_responses) == 0
+  server.text_document_publish_diagnostics.assert_called_once()
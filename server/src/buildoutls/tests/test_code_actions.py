@@ -190,7 +190,25 @@ async def test_diagnostic_and_versions_code_action_newer_version_available(
     ),
   )
 
+  # the latest version in the same major version
   assert code_actions[1] == CodeAction(
+    title="Use version 1.3.1",
+    kind=CodeActionKind.QuickFix,
+    edit=WorkspaceEdit(
+      changes={
+        "file:///code_actions/newer_version_available.cfg": [
+          TextEdit(
+            range=Range(
+              start=Position(line=1, character=15), end=Position(line=1, character=21)
+            ),
+            new_text=" 1.3.1",
+          ),
+        ]
+      }
+    ),
+  )
+
+  assert code_actions[2] == CodeAction(
     title="View on pypi https://pypi.org/project/sampleproject/1.3.0/",
     command=Command(
       title="View on pypi",
@@ -201,7 +219,7 @@ async def test_diagnostic_and_versions_code_action_newer_version_available(
     ),
   )
 
-  assert len(code_actions) == 2
+  assert len(code_actions) == 3
 
 
 async def test_diagnostic_and_versions_code_action_known_vulnerabilities(
@@ -266,7 +284,25 @@ async def test_diagnostic_and_versions_code_action_known_vulnerabilities(
     ),
   )
 
+  # the latest version in the same major version
   assert code_actions[1] == CodeAction(
+    title="Use version 1.3.1",
+    kind=CodeActionKind.QuickFix,
+    edit=WorkspaceEdit(
+      changes={
+        "file:///code_actions/newer_version_available.cfg": [
+          TextEdit(
+            range=Range(
+              start=Position(line=1, character=15), end=Position(line=1, character=21)
+            ),
+            new_text=" 1.3.1",
+          ),
+        ]
+      }
+    ),
+  )
+
+  assert code_actions[2] == CodeAction(
     title="View on pypi https://pypi.org/project/sampleproject/1.3.0/",
     command=Command(
       title="View on pypi",
@@ -277,7 +313,7 @@ async def test_diagnostic_and_versions_code_action_known_vulnerabilities(
     ),
   )
 
-  assert len(code_actions) == 2
+  assert len(code_actions) == 3
 
 
 async def test_diagnostic_and_versions_code_action_version_not_exists(
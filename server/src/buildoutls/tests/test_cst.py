@@ -0,0 +1,215 @@
+import io
+import pathlib
+from typing import Iterator, Set, Tuple
+
+import pytest
+
+from ..buildout import _parse
+from ..cst import LineKind, SyntaxTree, classifyLine, getSyntaxTree
+
+source = """\
+# comment
+[section]
+a = 1
+b += x y
+c-=z
+=> part
+multi =
+  line1
+
+  line2
+; comment
+{% if True %}
+in = jinja
+{% endif %}
+d = {{ jinja }}
+[other]
+"""
+
+
+def test_lines() -> None:
+  tree = SyntaxTree.parse(source)
+  assert "".join(line.text for line in tree.lines) == source
+  assert [line.kind for line in tree.lines] == [
+    LineKind.Comment,
+    LineKind.SectionHeader,
+    LineKind.Option,
+    LineKind.Option,
+    LineKind.Option,
+    LineKind.Option,
+    LineKind.Option,
+    LineKind.Continuation,
+    # blank lines are part of multi line values
+    LineKind.Continuation,
+    LineKind.Continuation,
+    LineKind.Comment,
+    LineKind.Jinja,
+    LineKind.Jinja,
+    LineKind.Jinja,
+    LineKind.Option,
+    LineKind.SectionHeader,
+  ]
+
+  def getSpans(line: int) -> Tuple[str, ...]:
+    syntax_line = tree.lines[line]
+    return tuple(
+      tree.getText(line, span) if span else ""
+      for span in (syntax_line.key, syntax_line.operator, syntax_line.value)
+    )
+
+  assert tree.lines[1].name == "section"
+  assert getSpans(1) == ("section", "", "")
+  assert getSpans(2) == ("a", "=", "1")
+  assert getSpans(3) == ("b", "+=", "x y")
+  assert tree.lines[3].name == "b +"
+  assert getSpans(4) == ("c", "-=", "z")
+  assert getSpans(5) == ("", "=>", "part")
+  assert tree.lines[5].name == "<part-dependencies>"
+  assert getSpans(6) == ("multi", "=", "")
+  assert getSpans(7) == ("", "", "line1")
+  assert getSpans(14) == ("d", "=", "{{ jinja }}")
+
+  assert tree.getLineText(2) == "a = 1"
+  assert tree.getLineText(100) == ""
+  assert tree.getOffset(2, 4) == source.index("1")
+
+
+def test_sections() -> None:
+  tree = SyntaxTree.parse(source)
+  assert [(section.name, section.start_line) for section in tree.sections] == [
+    ("section", 1),
+    ("other", 15),
+  ]
+  assert [
+    (option.name, option.start_line, option.end_line)
+    for option in tree.sections[0].options
+  ] == [
+    ("a", 2, 2),
+    ("b +", 3, 3),
+    ("c-", 4, 4),
+    ("<part-dependencies>", 5, 5),
+    ("multi", 6, 9),
+    ("d", 14, 14),
+  ]
+  assert tree.getContext(0) == (None, None)
+  assert tree.getContext(2) == ("section", "a")
+  assert tree.getContext(8) == ("section", "multi")
+  assert tree.getContext(10) == ("section", None)
+  assert tree.getContext(15) == ("other", None)
+
+  multi = tree.getOption(6)
+  assert multi is not None
+  assert [
+    (line, tree.getText(line, span)) for line, span in tree.getOptionValueSpans(multi)
+  ] == [(7, "line1"), (9, "line2")]
+  assert tree.getOption(7) is None
+
+
+def getProfileSources() -> Iterator[str]:
+  profiles_dir = pathlib.Path(__file__).resolve().parents[4] / "profiles"
+  for profile in sorted(profiles_dir.glob("**/*")):
+    if profile.is_file():
+      yield profile.read_text(encoding="utf-8", errors="replace")
+
+
+async def test_options_like_parser() -> None:
+  uri = "file:///buildout.cfg"
+  for profile_source in getProfileSources():
+    parsed = await _parse(io.StringIO(profile_source), uri, allow_errors=True)
+    expected: Set[Tuple[str, int, int]] = set()
+    for section in parsed.values():
+      for option_name, option in section.items():
+        for location in option.locations:
+          # default values are at the beginning of the profile
+          if location.uri == uri and location.range.start.character:
+            expected.add(
+              (option_name, location.range.start.line, location.range.end.line)
+            )
+    tree = SyntaxTree.parse(profile_source)
+    assert "".join(line.text for line in tree.lines) == profile_source
+    assert {
+      (option.name, option.start_line, option.end_line)
+      for section in tree.sections
+      for option in section.options
+    } == expected
+
+
+@pytest.mark.parametrize(
+  "line, in_section, in_option, blockmode, kind",
+  (
+    ("# comment\n", True, True, False, LineKind.Comment),
+    ("  value\n", True, True, False, LineKind.Continuation),
+    ("  \n", True, True, False, LineKind.Blank),
+    ("  \n", True, True, True, LineKind.Continuation),
+    ("  value\n", True, False, False, LineKind.Error),
+    ("[section]\n", False, False, False, LineKind.SectionHeader),
+    ("option = value\n", False, False, False, LineKind.Error),
+    ("\n", False, False, False, LineKind.Blank),
+    ("option = value\n", True, False, False, LineKind.Option),
+    ("=> part\n", True, False, False, LineKind.Option),
+    ("\n", True, False, False, LineKind.Blank),
+    ("not an option\n", True, True, False, LineKind.Error),
+  ),
+)
+def test_classify_line(
+  line: str, in_section: bool, in_option: bool, blockmode: bool, kind: LineKind
+) -> None:
+  assert classifyLine(line, in_section, in_option, blockmode)[0] == kind
+
+
+def test_classify_part_dependencies() -> None:
+  _, match = classifyLine("=> a b\n", True, False, False)
+  assert match is not None
+  assert match.group("name").rstrip() == "<part-dependencies>"
+  assert match.group("value").strip() == "a b"
+
+
+@pytest.mark.parametrize(
+  "inserted",
+  (
+    "",
+    "option = value",
+    "  continuation",
+    "[new-section]",
+    "# comment",
+    "{% if True %}",
+    "{% endif %}",
+    "{# start of comment",
+  ),
+)
+def test_reparse(inserted: str) -> None:
+  for profile_source in getProfileSources():
+    tree = SyntaxTree.parse(profile_source)
+    lines = profile_source.split("\n")
+    for line in range(0, len(lines), 5):
+      edited = "\n".join(lines[:line] + [inserted] + lines[line:])
+      reparsed = tree.reparse(edited)
+      assert reparsed.lines == SyntaxTree.parse(edited).lines
+      assert reparsed.reparse(profile_source).lines == tree.lines
+
+
+def test_reparse_reuses_lines() -> None:
+  tree = SyntaxTree.parse(source)
+  edited = source.replace("a = 1", "a = 2\nnew = option")
+  reparsed = tree.reparse(edited)
+  assert [line.text for line in reparsed.lines] == edited.splitlines(True)
+  # lines before and after the edit are the same
+  assert reparsed.lines[1] is tree.lines[1]
+  assert reparsed.lines[-1] is tree.lines[-1]
+  assert reparsed.getContext(3) == ("section", "new")
+
+  # a jinja block changes the following lines
+  edited = source.replace("a = 1", "{% if True %}")
+  reparsed = tree.reparse(edited)
+  assert reparsed.lines == SyntaxTree.parse(edited).lines
+  assert reparsed.lines[-1].kind == LineKind.Jinja
+
+
+def test_get_syntax_tree() -> None:
+  uri = "file:///test_get_syntax_tree.cfg"
+  tree = getSyntaxTree(uri, source)
+  assert getSyntaxTree(uri, source) is tree
+  edited = source + "new = option\n"
+  reparsed = getSyntaxTree(uri, edited)
+  assert reparsed.source == edited
+  assert reparsed.lines[0] is tree.lines[0]
@@ -0,0 +1,155 @@
+import asyncio
+import contextlib
+import json
+import pathlib
+from typing import Any, AsyncIterator, Dict, Optional
+
+from .. import buildout
+from ..commands import COMMAND_MEMORY_REPORT
+from ..daemon import Daemon
+
+profiles_path = pathlib.Path(__file__).resolve().parents[4] / "profiles"
+
+
+class Client:
+  """A minimal language server client."""
+
+  def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    self._reader = reader
+    self._writer = writer
+    self._next_id = 0
+
+  async def _send(self, message: Dict[str, Any]) -> None:
+    body = json.dumps({"jsonrpc": "2.0", **message}).encode()
+    self._writer.write(b"Content-Length: %d\r\n\r\n" % len(body) + body)
+    await self._writer.drain()
+
+  async def _receive(self) -> Dict[str, Any]:
+    content_length = 0
+    while True:
+      header = await self._reader.readline()
+      if header == b"\r\n":
+        break
+      if header.startswith(b"Content-Length:"):
+        content_length = int(header.split(b":")[1])
+    message: Dict[str, Any] = json.loads(await self._reader.readexactly(content_length))
+    return message
+
+  async def notify(self, method: str, params: Optional[Dict[str, Any]]) -> None:
+    await self._send({"method": method, "params": params})
+
+  async def request(self, method: str, params: Optional[Dict[str, Any]]) -> Any:
+    self._next_id += 1
+    request_id = self._next_id
+    await self._send({"id": request_id, "method": method, "params": params})
+    while True:
+      message = await asyncio.wait_for(self._receive(), 10)
+      if message.get("id") == request_id and "method" not in message:
+        assert "error" not in message, message
+        return message["result"]
+
+  async def initialize(self) -> None:
+    await self.request(
+      "initialize",
+      {
+        "processId": None,
+        "rootUri": profiles_path.as_uri(),
+        "capabilities": {},
+      },
+    )
+    await self.notify("initialized", {})
+
+  async def open(self, uri: str, text: str) -> None:
+    await self.notify(
+      "textDocument/didOpen",
+      {
+        "textDocument": {
+          "uri": uri,
+          "languageId": "zc-buildout",
+          "version": 1,
+          "text": text,
+        }
+      },
+    )
+
+  async def documentSymbols(self, uri: str) -> Any:
+    return await self.request(
+      "textDocument/documentSymbol", {"textDocument": {"uri": uri}}
+    )
+
+  async def exit(self) -> None:
+    await self.request("shutdown", None)
+    await self.notify("exit", None)
+    self._writer.close()
+
+
+@contextlib.asynccontextmanager
+async def runDaemon(socket_path: pathlib.Path) -> AsyncIterator[Daemon]:
+  daemon = Daemon()
+  server = await asyncio.start_unix_server(daemon.handleConnection, socket_path)
+  buildout.clearAllCaches()
+  try:
+    yield daemon
+  finally:
+    server.close()
+    buildout.clearAllCaches()
+
+
+async def connect(socket_path: pathlib.Path) -> Client:
+  client = Client(*await asyncio.open_unix_connection(socket_path))
+  await client.initialize()
+  return client
+
+
+async def test_daemon_isolates_open_documents(tmp_path: pathlib.Path) -> None:
+  socket_path = tmp_path / "buildoutls.sock"
+  async with runDaemon(socket_path) as daemon:
+    client1 = await connect(socket_path)
+    client2 = await connect(socket_path)
+    assert len(daemon.sessions) == 2
+
+    uri = (profiles_path / "daemon-not-saved.cfg").as_uri()
+    await client1.open(uri, "[section-from-client1]\noption = 1\n")
+    await client2.open(uri, "[section-from-client2]\noption = 2\n")
+
+    assert [s["name"] for s in await client1.documentSymbols(uri)] == [
+      "section-from-client1"
+    ]
+    assert [s["name"] for s in await client2.documentSymbols(uri)] == [
+      "section-from-client2"
+    ]
+    # documents opened in sessions are not in shared cache
+    assert uri not in buildout._parse_cache
+
+    await client1.exit()
+    await client2.exit()
+    for _ in range(100):
+      if not daemon.sessions:
+        break
+      await asyncio.sleep(0.01)
+    assert daemon.sessions == {}
+
+
+async def test_daemon_shares_caches(tmp_path: pathlib.Path) -> None:
+  socket_path = tmp_path / "buildoutls.sock"
+  async with runDaemon(socket_path) as daemon:
+    client1 = await connect(socket_path)
+    client2 = await connect(socket_path)
+
+    uri = (profiles_path / "buildout.cfg").as_uri()
+    symbols = await client1.documentSymbols(uri)
+    assert uri in buildout._parse_cache
+    cached = buildout._parse_cache[uri]
+    assert await client2.documentSymbols(uri) == symbols
+    assert buildout._parse_cache[uri] is cached
+
+    report = await client1.request(
+      "workspace/executeCommand",
+      {"command": COMMAND_MEMORY_REPORT, "arguments": []},
+    )
+    assert report["shared"]["cached_profiles"] >= 1
+    assert report["shared"]["bytes"] > 0
+    assert [s["session_id"] for s in report["sessions"]] == sorted(daemon.sessions)
+
+    await client1.exit()
+    await client2.exit()
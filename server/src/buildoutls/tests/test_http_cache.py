@@ -0,0 +1,301 @@
+import asyncio
+import pathlib
+import sqlite3
+import time
+from typing import Any, Dict, List
+
+import aiohttp
+import aioresponses
+from aioresponses import CallbackResult
+import pytest
+from yarl import URL
+
+from ..util.http_cache import HTTPCache
+from ..util.json_stream import Select
+
+url = "https://pypi.example/pypi/project/json"
+
+
+def getRequestHeaders(
+  mocked_responses: aioresponses.aioresponses,
+) -> Dict[str, str]:
+  headers: Dict[str, str] = mocked_responses.requests["GET", URL(url)][-1].kwargs[
+    "headers"
+  ]
+  return headers
+
+
+def expire(cache: HTTPCache, age: float) -> None:
+  """Make the cached response older by age seconds."""
+  for cached_url, cached in list(cache._memory.items()):
+    cache._memory[cached_url] = cached._replace(fetched_at=cached.fetched_at - age)
+
+
+async def test_fresh(mocked_responses: aioresponses.aioresponses) -> None:
+  mocked_responses.get(url, payload={"version": 1}, headers={"ETag": '"1"'})
+  cache = HTTPCache("test")
+  assert await cache.get_json(url) == {"version": 1}
+  # no more request
+  assert await cache.get_json(url) == {"version": 1}
+  assert getRequestHeaders(mocked_responses) == {}
+
+  # responses are persisted
+  cache.flush()
+  assert await HTTPCache("test").get_json(url) == {"version": 1}
+
+
+async def test_transform(mocked_responses: aioresponses.aioresponses) -> None:
+  mocked_responses.get(url, payload={"version": 1, "large": "data"})
+
+  def transform(data: Any) -> Any:
+    return {"version": data["version"]}
+
+  cache = HTTPCache("test")
+  assert await cache.get_json(url, transform) == {"version": 1}
+  cache.flush()
+  assert await HTTPCache("test").get_json(url, transform) == {"version": 1}
+
+
+async def test_spec(mocked_responses: aioresponses.aioresponses) -> None:
+  mocked_responses.get(
+    url,
+    payload={"info": {"version": "2", "description": "large"}, "releases": {"1": []}},
+  )
+  spec = {"info": {"version": Select.VALUE}, "releases": Select.KEYS}
+  assert await HTTPCache("test").get_json(url, spec=spec) == {
+    "info": {"version": "2"},
+    "releases": ["1"],
+  }
+
+  # responses which are not JSON are not parsed incrementally
+  mocked_responses.get(url, body="not JSON", content_type="text/html")
+  with pytest.raises(aiohttp.ContentTypeError):
+    await HTTPCache("test2").get_json(url, spec=spec)
+
+
+async def test_stale_while_revalidate(
+  mocked_responses: aioresponses.aioresponses,
+) -> None:
+  mocked_responses.get(
+    url,
+    payload={"version": 1},
+    headers={"ETag": '"1"', "Last-Modified": "Mon, 19 Oct 2026 00:00:00 GMT"},
+  )
+  cache = HTTPCache("test", max_age=60)
+  assert await cache.get_json(url) == {"version": 1}
+
+  # stale responses are returned and revalidated in the background
+  expire(cache, 120)
+  mocked_responses.get(url, status=304)
+  assert await cache.get_json(url) == {"version": 1}
+  await cache.wait_for_revalidations()
+  assert getRequestHeaders(mocked_responses) == {
+    "If-None-Match": '"1"',
+    "If-Modified-Since": "Mon, 19 Oct 2026 00:00:00 GMT",
+  }
+  # the response is fresh again, also after a restart
+  assert await cache.get_json(url) == {"version": 1}
+  cache.flush()
+  assert await HTTPCache("test", max_age=60).get_json(url) == {"version": 1}
+
+  # modified responses are replaced
+  expire(cache, 120)
+  mocked_responses.get(url, payload={"version": 2}, headers={"ETag": '"2"'})
+  assert await cache.get_json(url) == {"version": 1}
+  await cache.wait_for_revalidations()
+  assert await cache.get_json(url) == {"version": 2}
+  cache.flush()
+  assert await HTTPCache("test", max_age=60).get_json(url) == {"version": 2}
+
+
+async def test_expired(mocked_responses: aioresponses.aioresponses) -> None:
+  mocked_responses.get(url, payload={"version": 1}, headers={"ETag": '"1"'})
+  cache = HTTPCache("test", max_age=60, stale_while_revalidate=60)
+  assert await cache.get_json(url) == {"version": 1}
+
+  # responses too old are fetched again
+  expire(cache, 180)
+  mocked_responses.get(url, payload={"version": 2})
+  assert await cache.get_json(url) == {"version": 2}
+  assert getRequestHeaders(mocked_responses) == {"If-None-Match": '"1"'}
+
+  # and still used if the network is not available
+  expire(cache, 180)
+  mocked_responses.get(url, exception=aiohttp.ClientConnectionError())
+  assert await cache.get_json(url) == {"version": 2}
+
+  mocked_responses.get(url, status=500)
+  assert await cache.get_json(url) == {"version": 2}
+
+
+async def test_errors(mocked_responses: aioresponses.aioresponses) -> None:
+  mocked_responses.get(url, exception=asyncio.TimeoutError())
+  cache = HTTPCache("test")
+  with pytest.raises(asyncio.TimeoutError):
+    await cache.get_json(url)
+
+  # errors are not cached
+  mocked_responses.get(url, payload={"version": 1})
+  assert await cache.get_json(url) == {"version": 1}
+
+  # errors during revalidation are ignored
+  expire(cache, cache.max_age)
+  mocked_responses.get(url, exception=aiohttp.ClientConnectionError())
+  assert await cache.get_json(url) == {"version": 1}
+  await cache.wait_for_revalidations()
+  assert await cache.get_json(url) == {"version": 1}
+
+
+async def test_coalesce_requests(mocked_responses: aioresponses.aioresponses) -> None:
+  mocked_responses.get(url, payload={"version": 1}, headers={"ETag": '"1"'})
+  cache = HTTPCache("test", max_age=60)
+  # concurrent requests share one fetch
+  assert (
+    await asyncio.gather(*[cache.get_json(url) for _ in range(10)])
+    == [{"version": 1}] * 10
+  )
+  assert len(mocked_responses.requests["GET", URL(url)]) == 1
+
+  # also with a revalidation in progress
+  expire(cache, 180)
+  mocked_responses.get(url, status=304)
+  assert (
+    await asyncio.gather(*[cache.get_json(url) for _ in range(10)])
+    == [{"version": 1}] * 10
+  )
+  await cache.wait_for_revalidations()
+  assert len(mocked_responses.requests["GET", URL(url)]) == 2
+
+  # errors are reported to all requests
+  expire(cache, cache.max_age + cache.stale_while_revalidate)
+  cache._memory.clear()
+  cache.clear()
+  mocked_responses.get(url, exception=aiohttp.ClientConnectionError())
+  results = await asyncio.gather(
+    *[cache.get_json(url) for _ in range(10)], return_exceptions=True
+  )
+  assert all(isinstance(r, aiohttp.ClientConnectionError) for r in results)
+  assert len(mocked_responses.requests["GET", URL(url)]) == 3
+
+
+async def test_cancel_coalesced_requests(
+  mocked_responses: aioresponses.aioresponses,
+) -> None:
+  received = asyncio.Event()
+  release = asyncio.Event()
+
+  async def slowResponse(url: Any, **kwargs: Any) -> CallbackResult:
+    received.set()
+    await release.wait()
+    return CallbackResult(payload={"version": 1})
+
+  mocked_responses.get(url, callback=slowResponse, repeat=True)
+  cache = HTTPCache("test", max_age=60)
+  requests = [asyncio.ensure_future(cache.get_json(url)) for _ in range(2)]
+  await received.wait()
+
+  # the fetch continues while a request waits for it
+  requests[0].cancel()
+  await asyncio.sleep(0)
+  assert url in cache._fetches
+  release.set()
+  assert await requests[1] == {"version": 1}
+
+  # and is cancelled with the last request
+  cache._memory.clear()
+  cache.clear()
+  release.clear()
+  received.clear()
+  request = asyncio.ensure_future(cache.get_json(url))
+  await received.wait()
+  fetch = cache._fetches[url]
+  request.cancel()
+  with pytest.raises(asyncio.CancelledError):
+    await fetch.response
+  await asyncio.sleep(0)
+  assert url not in cache._fetches
+  assert all(task.done() for task in fetch.tasks.values())
+
+
+async def test_coalesced_requests_semaphores(
+  mocked_responses: aioresponses.aioresponses,
+) -> None:
+  other_url = "https://pypi.example/pypi/other/json"
+  received = asyncio.Event()
+  release = asyncio.Event()
+
+  async def slowResponse(url: Any, **kwargs: Any) -> CallbackResult:
+    received.set()
+    await release.wait()
+    return CallbackResult(payload={"version": 0})
+
+  mocked_responses.get(other_url, callback=slowResponse)
+  mocked_responses.get(url, payload={"version": 1})
+  cache = HTTPCache("test", max_age=60)
+  busy_semaphore = asyncio.Semaphore(1)
+  slow_request = asyncio.ensure_future(
+    cache.get_json(other_url, semaphore=busy_semaphore)
+  )
+  await received.wait()
+
+  # a request waiting for a busy semaphore
+  queued_request = asyncio.ensure_future(cache.get_json(url, semaphore=busy_semaphore))
+  await asyncio.sleep(0)
+  assert not mocked_responses.requests.get(("GET", URL(url)))
+
+  # does not delay a request for the same url with another semaphore
+  assert await asyncio.wait_for(
+    cache.get_json(url, semaphore=asyncio.Semaphore(1)), 1
+  ) == {"version": 1}
+  assert await queued_request == {"version": 1}
+  assert len(mocked_responses.requests["GET", URL(url)]) == 1
+
+  release.set()
+  assert await slow_request == {"version": 0}
+  # and the busy semaphore was not used for it
+  assert not busy_semaphore.locked()
+
+
+async def test_batched_writes(
+  mocked_responses: aioresponses.aioresponses, cache_directory: pathlib.Path
+) -> None:
+  urls = [f"https://pypi.example/pypi/project{i}/json" for i in range(10)]
+  for project_url in urls:
+    mocked_responses.get(project_url, payload={"url": project_url})
+  cache = HTTPCache("test")
+  statements: List[str] = []
+  cache._connect().set_trace_callback(statements.append)
+  await asyncio.gather(*[cache.get_json(project_url) for project_url in urls])
+  assert not [
+    statement for statement in statements if not statement.startswith("SELECT")
+  ]
+
+  # responses are written together
+  cache.flush()
+  assert statements.count("COMMIT") == 1
+  cache.close()
+  assert [await HTTPCache("test").get_json(project_url) for project_url in urls] == [
+    {"url": project_url} for project_url in urls
+  ]
+
+
+async def test_locked_database(
+  mocked_responses: aioresponses.aioresponses, cache_directory: pathlib.Path
+) -> None:
+  mocked_responses.get(url, payload={"version": 1})
+  cache = HTTPCache("test")
+  cache._connect()
+  writer = sqlite3.connect(str(cache_directory / "test.sqlite"))
+  writer.execute("BEGIN IMMEDIATE")
+
+  # the event loop does not wait for the database written by another server
+  start = time.monotonic()
+  assert await cache.get_json(url) == {"version": 1}
+  cache.flush()
+  assert time.monotonic() - start < 1
+  writer.rollback()
+  writer.close()
+
+  # the response is written with the next flush
+  cache.flush()
+  assert await HTTPCache("test").get_json(url) == {"version": 1}
@@ -1,3 +1,7 @@
+import json
+import pathlib
+from typing import Any, Iterable, Tuple
+
 from ..jinja import JinjaParser
 
 
@@ -107,3 +111,84 @@ def test_jinja_error() -> None:
   ):
     parser.feed(line)
     assert parser.is_error == is_error
+
+
+def getParserState(parser: JinjaParser) -> Tuple[Any, ...]:
+  return (
+    parser.line,
+    parser.is_in_jinja,
+    parser.has_expression,
+    parser.is_error,
+    parser._stack,
+    parser._in_raw,
+    parser._in_comment,
+    parser._in_multiline_expression,
+    parser._in_multiline_statement,
+  )
+
+
+def assertSameStates(lines: Iterable[str]) -> None:
+  """Check that the fast path of feed gives the same state as the full parsing."""
+  parser = JinjaParser()
+  reference_parser = JinjaParser()
+  for line in lines:
+    parser.feed(line)
+    reference_parser._feed(line)
+    assert getParserState(parser) == getParserState(reference_parser), line
+
+
+def test_feed_fast_path() -> None:
+  assertSameStates(
+    (
+      "[section]\n",
+      "option = value\n",
+      "{# multi line\n",
+      "  comment\n",
+      "#}\n",
+      "{% raw %}\n",
+      "option = ${value}\n",
+      "{% endraw %}\n",
+      "{{ multi\n",
+      "  line expression\n",
+      "}}\n",
+      "{% if\n",
+      "   multi line statement\n",
+      "%}\n",
+      "option = value\n",
+      "{% endif %}\n",
+      "option = value\n",
+    )
+  )
+
+
+def test_feed_fast_path_profiles() -> None:
+  profiles_dir = pathlib.Path(__file__).resolve().parents[4] / "profiles"
+  profiles = [path for path in profiles_dir.glob("**/*") if path.is_file()]
+  assert profiles
+  for profile in profiles:
+    with profile.open(encoding="utf-8", errors="replace") as f:
+      assertSameStates(f)
+
+
+def test_feed_baseline() -> None:
+  """Check the states of the parser on the profiles corpus against the
+  states recorded with the parser before the fast path of feed.
+  """
+  with open(pathlib.Path(__file__).parent / "testdata" / "jinja_baseline.json") as f:
+    baseline = json.load(f)
+  assert baseline
+  for profile, states in baseline.items():
+    parser = JinjaParser()
+    for lineno, (text, *state) in enumerate(states):
+      parser.feed(text)
+      assert [
+        parser.line,
+        parser.is_in_jinja,
+        parser.has_expression,
+        parser.is_error,
+        list(parser._stack),
+        parser._in_raw,
+        parser._in_comment,
+        parser._in_multiline_expression,
+        parser._in_multiline_statement,
+      ] == state, (profile, lineno)
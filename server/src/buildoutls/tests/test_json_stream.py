@@ -0,0 +1,99 @@
+import json
+from typing import Any, AsyncIterator
+
+import pytest
+
+from ..util.json_stream import EachValue, Select, Spec, extract
+
+document = {
+  "info": {
+    "name": "project",
+    "description": "é" * 100 + ' "quoted" \\ {not: [an, object]}',
+    "version": "2.0.0",
+    "requires_dist": None,
+    "yanked": False,
+  },
+  "last_serial": 1234567890,
+  "releases": {
+    "1.0": [{"filename": "project-1.0.tar.gz", "size": 1.5e3, "digests": {}}],
+    "2.0.0": [],
+    "日本": [{}],
+  },
+  "urls": [],
+  "vulnerabilities": [{"id": "VULN-1", "fixed_in": ["2.0.0"]}],
+}
+
+
+async def iterChunks(data: bytes, size: int) -> AsyncIterator[bytes]:
+  for i in range(0, len(data), size):
+    yield data[i : i + size]
+
+
+async def extractFromChunks(data: bytes, spec: Spec, size: int = 1) -> Any:
+  return await extract(iterChunks(data, size), spec)
+
+
+@pytest.mark.parametrize("indent", (None, 2))
+async def test_extract(indent: Any) -> None:
+  data = json.dumps(document, indent=indent, ensure_ascii=False).encode()
+  spec = {
+    "info": {"version": Select.VALUE, "missing": Select.VALUE},
+    "last_serial": Select.VALUE,
+    "releases": Select.KEYS,
+    "vulnerabilities": Select.VALUE,
+  }
+  expected = {
+    "info": {"version": "2.0.0"},
+    "last_serial": 1234567890,
+    "releases": ["1.0", "2.0.0", "日本"],
+    "vulnerabilities": [{"id": "VULN-1", "fixed_in": ["2.0.0"]}],
+  }
+  # chunks of all sizes, so that values, numbers and multi-bytes characters
+  # are split between chunks.
+  for size in range(1, len(data) + 1):
+    assert await extractFromChunks(data, spec, size) == expected, size
+
+  assert await extractFromChunks(data, Select.VALUE) == document
+  for size in (1, 7, len(data)):
+    assert await extractFromChunks(
+      data,
+      {
+        "info": {"name": str.upper},
+        "releases": EachValue(len),
+      },
+      size,
+    ) == {
+      "info": {"name": "PROJECT"},
+      "releases": {"1.0": 1, "2.0.0": 0, "日本": 1},
+    }
+  assert await extractFromChunks(data, {}) == {}
+  assert await extractFromChunks(b"{}", Select.KEYS) == []
+  assert await extractFromChunks(b" { } \n", {"info": Select.VALUE}) == {}
+  assert await extractFromChunks(b"1e5", Select.VALUE) == 1e5
+  assert await extractFromChunks(b"[1.5, -2]", Select.VALUE) == [1.5, -2]
+
+
+@pytest.mark.parametrize(
+  "data",
+  (
+    b"",
+    b" ",
+    b'{"info": ',
+    b'{"info": {"version": "2.0',
+    b'{"info": {}',
+    b'{"info": {}}}',
+    b'{"info": {}} []',
+    b'{"info" {}}',
+    b'{"info": {} "urls": []}',
+    b'{"info": {},}',
+    b"{info: {}}",
+    b'{"info": [}',
+    b'{"info": "\xff"}',
+    b'["info"]',
+    b"null",
+    b"<html></html>",
+  ),
+)
+async def test_invalid_documents(data: bytes) -> None:
+  with pytest.raises(ValueError):
+    await extractFromChunks(data, {"info": Select.VALUE}, 3)
@@ -0,0 +1,212 @@
+import asyncio
+import collections
+import contextlib
+import json
+import pathlib
+from typing import Any, AsyncIterator, Dict, List
+from unittest import mock
+
+import aioresponses
+from aiohttp import test_utils, web
+from lsprotocol.types import DiagnosticSeverity, PublishDiagnosticsParams
+
+from ..server import parseAndSendDiagnostics
+from ..util import osv
+
+# vulnerabilities by (project, version), in a database returning one
+# vulnerability per page.
+affected_versions = {
+  ("project-a", "1.0"): ["VULN-1", "VULN-2"],
+  ("project-b", "1.0"): ["VULN-2"],
+}
+vulnerabilities = {
+  "VULN-1": {
+    "id": "VULN-1",
+    "aliases": ["CVE-1"],
+    "details": "First vulnerability",
+    "affected": [
+      {
+        "package": {"name": "project_a", "ecosystem": "PyPI"},
+        "ranges": [
+          {"type": "ECOSYSTEM", "events": [{"introduced": "0"}, {"fixed": "2.0"}]}
+        ],
+      }
+    ],
+    "references": [
+      {"type": "WEB", "url": "https://example.com/web"},
+      {"type": "ADVISORY", "url": "https://example.com/advisory"},
+    ],
+  },
+  "VULN-2": {
+    "id": "VULN-2",
+    "summary": "Second vulnerability",
+    "affected": [
+      {
+        "package": {"name": "project-a", "ecosystem": "PyPI"},
+        "ranges": [{"type": "ECOSYSTEM", "events": [{"fixed": "1.1"}]}],
+      },
+      {
+        "package": {"name": "project-b", "ecosystem": "PyPI"},
+        "ranges": [{"type": "ECOSYSTEM", "events": [{"introduced": "0"}]}],
+      },
+    ],
+  },
+}
+
+
+class OSVServer:
+  """A stand-in for the OSV API."""
+
+  def __init__(self) -> None:
+    self.requests: "collections.Counter[str]" = collections.Counter()
+    self.batch_sizes: List[int] = []
+    self.fail = False
+    self.url = ""
+
+  async def querybatch(self, request: web.Request) -> web.Response:
+    self.requests[request.path] += 1
+    if self.fail:
+      return web.Response(status=500)
+    queries = (await request.json())["queries"]
+    self.batch_sizes.append(len(queries))
+    results: List[Dict[str, Any]] = []
+    for query in queries:
+      assert query["package"]["ecosystem"] == "PyPI"
+      ids = affected_versions.get((query["package"]["name"], query["version"]), [])
+      page = int(query.get("page_token", 0))
+      result: Dict[str, Any] = {}
+      if ids:
+        result["vulns"] = [{"id": ids[page], "modified": "2026-01-01T00:00:00Z"}]
+        if page + 1 < len(ids):
+          result["next_page_token"] = str(page + 1)
+      results.append(result)
+    return web.json_response({"results": results})
+
+  async def vulns(self, request: web.Request) -> web.Response:
+    self.requests[request.path] += 1
+    return web.json_response(vulnerabilities[request.match_info["id"]])
+
+
+@contextlib.asynccontextmanager
+async def runOSVServer() -> AsyncIterator[OSVServer]:
+  osv_server = OSVServer()
+  application = web.Application()
+  application.router.add_post("/v1/querybatch", osv_server.querybatch)
+  application.router.add_get("/v1/vulns/{id}", osv_server.vulns)
+  async with test_utils.TestServer(application) as server:
+    osv_server.url = str(server.make_url("")).rstrip("/")
+    yield osv_server
+
+
+async def test_known_vulnerabilities() -> None:
+  async with runOSVServer() as osv_server:
+    await checkKnownVulnerabilities(osv_server)
+
+
+async def checkKnownVulnerabilities(osv_server: OSVServer) -> None:
+  client = osv.OSVClient(osv_server.url, batch_size=2)
+  semaphore = asyncio.Semaphore(4)
+  pins = [
+    ("project-a", "1.0"),
+    ("project-b", "1.0"),
+    ("project-c", "1.0"),
+    ("project-d", "1.0"),
+    ("project-e", "1.0"),
+  ]
+  known_vulnerabilities = await client.get_known_vulnerabilities(pins, semaphore)
+  assert set(known_vulnerabilities) == set(pins)
+  assert [
+    (v.id, v.aliases, v.details, v.fixed_in, v.link, v.source)
+    for v in known_vulnerabilities["project-a", "1.0"]
+  ] == [
+    (
+      "VULN-1",
+      ["CVE-1"],
+      "First vulnerability",
+      ["2.0"],
+      "https://example.com/advisory",
+      "osv",
+    ),
+    (
+      "VULN-2",
+      [],
+      "Second vulnerability",
+      ["1.1"],
+      "https://osv.dev/vulnerability/VULN-2",
+      "osv",
+    ),
+  ]
+  assert [(v.id, v.fixed_in) for v in known_vulnerabilities["project-b", "1.0"]] == [
+    ("VULN-2", [])
+  ]
+  assert known_vulnerabilities["project-c", "1.0"] == ()
+  # pins are queried in batches, then the next page of project-a
+  assert osv_server.batch_sizes == [2, 2, 1, 1]
+  # each vulnerability is fetched once
+  assert osv_server.requests == {
+    "/v1/querybatch": 4,
+    "/v1/vulns/VULN-1": 1,
+    "/v1/vulns/VULN-2": 1,
+  }
+
+  # results are cached
+  assert (
+    await client.get_known_vulnerabilities(pins, semaphore) == known_vulnerabilities
+  )
+  assert sum(osv_server.requests.values()) == 6
+
+
+async def test_known_vulnerabilities_errors() -> None:
+  async with runOSVServer() as osv_server:
+    await checkKnownVulnerabilitiesErrors(osv_server)
+
+
+async def checkKnownVulnerabilitiesErrors(osv_server: OSVServer) -> None:
+  client = osv.OSVClient(osv_server.url)
+  osv_server.fail = True
+  assert (
+    await client.get_known_vulnerabilities([("project-a", "1.0")], asyncio.Semaphore(4))
+    == {}
+  )
+  # errors are not cached
+  osv_server.fail = False
+  known_vulnerabilities = await client.get_known_vulnerabilities(
+    [("project-a", "1.0")], asyncio.Semaphore(4)
+  )
+  assert len(known_vulnerabilities["project-a", "1.0"]) == 2
+
+
+async def test_diagnostics(
+  server: Any,
+  mocked_responses: aioresponses.aioresponses,
+) -> None:
+  with open(pathlib.Path(__file__).parent / "testdata" / "sampleproject.json") as f:
+    mocked_responses.get(
+      "https://pypi.org/pypi/sampleproject/json", payload=json.load(f), repeat=True
+    )
+  mocked_responses.post(
+    "https://osv.example/v1/querybatch",
+    payload={"results": [{"vulns": [{"id": "VULN-1"}]}]},
+  )
+  mocked_responses.get(
+    "https://osv.example/v1/vulns/VULN-1", payload=vulnerabilities["VULN-1"]
+  )
+  osv.set_osv_url("https://osv.example")
+  try:
+    await parseAndSendDiagnostics(
+      server, "file:///code_actions/known_vulnerabilities.cfg"
+    )
+  finally:
+    osv.set_osv_url(None)
+  server.text_document_publish_diagnostics.assert_called_once_with(
+    PublishDiagnosticsParams(
+      uri="file:///code_actions/known_vulnerabilities.cfg",
+      diagnostics=[mock.ANY],
+    ),
+  )
+  (diagnostic,) = server.text_document_publish_diagnostics.call_args[0][0].diagnostics
+  assert diagnostic.severity == DiagnosticSeverity.Warning
+  assert diagnostic.message == (
+    "sampleproject 1.2.0 has some known vulnerabilities:\n"
+    "VULN-1\nFirst vulnerability\nhttps://example.com/advisory"
+  )
@@ -0,0 +1,319 @@
+import asyncio
+import json
+import os
+import pathlib
+import struct
+import zipfile
+from typing import Any, Dict, List
+from unittest import mock
+
+import aiohttp
+import aioresponses
+import pytest
+from lsprotocol.types import DiagnosticSeverity, PublishDiagnosticsParams
+
+from .. import diagnostic
+from ..server import parseAndSendDiagnostics
+from ..util import cache_dir, osv, osv_database, pypi
+
+vulnerabilities: List[Dict[str, Any]] = [
+  {
+    "id": "VULN-1",
+    "aliases": ["CVE-1"],
+    "details": "Ranges",
+    "affected": [
+      {
+        "package": {"name": "Project_A", "ecosystem": "PyPI"},
+        "ranges": [
+          {
+            "type": "ECOSYSTEM",
+            "events": [
+              # not sorted
+              {"introduced": "2.0"},
+              {"fixed": "2.1"},
+              {"introduced": "0"},
+              {"fixed": "1.0.1"},
+            ],
+          },
+          {
+            "type": "ECOSYSTEM",
+            "events": [{"introduced": "3"}, {"last_affected": "3.1"}],
+          },
+          {"type": "GIT", "events": [{"introduced": "0"}, {"fixed": "abcdef"}]},
+        ],
+      },
+      {
+        "package": {"name": "project-a", "ecosystem": "npm"},
+        "ranges": [{"type": "ECOSYSTEM", "events": [{"introduced": "0"}]}],
+      },
+    ],
+  },
+  {
+    "id": "VULN-2",
+    "summary": "Explicit versions",
+    "affected": [
+      {
+        "package": {"name": "project-a", "ecosystem": "PyPI"},
+        "versions": ["5.0", "6.0.0", "not-a-version"],
+      },
+      {
+        "package": {"name": "project-b", "ecosystem": "PyPI"},
+        "ranges": [{"type": "ECOSYSTEM", "events": [{"introduced": "1.0"}]}],
+      },
+    ],
+    "references": [{"type": "ADVISORY", "url": "https://example.com/advisory"}],
+  },
+  {
+    "id": "VULN-3",
+    "withdrawn": "2026-01-01T00:00:00Z",
+    "affected": [
+      {
+        "package": {"name": "project-a", "ecosystem": "PyPI"},
+        "ranges": [{"type": "ECOSYSTEM", "events": [{"introduced": "0"}]}],
+      },
+    ],
+  },
+]
+
+
+@pytest.fixture
+def database_directory(tmp_path: pathlib.Path) -> pathlib.Path:
+  database_directory = tmp_path / "osv"
+  (database_directory / "PyPI").mkdir(parents=True)
+  for vulnerability in vulnerabilities:
+    (database_directory / "PyPI" / f"{vulnerability['id']}.json").write_text(
+      json.dumps(vulnerability)
+    )
+  (database_directory / "README.md").write_text("not a vulnerability")
+  return database_directory
+
+
+@pytest.fixture
+def database_zip(tmp_path: pathlib.Path) -> pathlib.Path:
+  database_zip = tmp_path / "all.zip"
+  with zipfile.ZipFile(database_zip, "w") as zf:
+    for vulnerability in vulnerabilities:
+      zf.writestr(f"{vulnerability['id']}.json", json.dumps(vulnerability))
+  return database_zip
+
+
+async def getVulnerabilityIds(
+  database: osv_database.OSVDatabase, project: str, version: str
+) -> List[str]:
+  known_vulnerabilities = await database.get_known_vulnerabilities(
+    [(project, version)], asyncio.Semaphore(4)
+  )
+  return [v.id for v in known_vulnerabilities[project, version]]
+
+
+@pytest.mark.parametrize("source", ("database_directory", "database_zip"))
+async def test_known_vulnerabilities(
+  request: pytest.FixtureRequest, source: str
+) -> None:
+  database = osv_database.OSVDatabase(str(request.getfixturevalue(source)))
+  for version, expected in (
+    ("0.1", ["VULN-1"]),
+    ("1.0.0", ["VULN-1"]),
+    ("1.0.1", []),
+    ("2.0.0", ["VULN-1"]),
+    ("2.1", []),
+    ("3.1", ["VULN-1"]),
+    ("3.1.1", []),
+    ("5", ["VULN-2"]),
+    ("6.0", ["VULN-2"]),
+    ("not-a-version", ["VULN-2"]),
+    ("other-version", []),
+  ):
+    assert await getVulnerabilityIds(database, "project-a", version) == expected, (
+      version
+    )
+  assert await getVulnerabilityIds(database, "project-b", "0.9") == []
+  assert await getVulnerabilityIds(database, "project-c", "1.0") == []
+
+  known_vulnerabilities = await database.get_known_vulnerabilities(
+    [("PROJECT.A", "1.0"), ("project-b", "1.0")], asyncio.Semaphore(4)
+  )
+  ((vulnerability_1,), (vulnerability_2,)) = known_vulnerabilities.values()
+  assert (
+    vulnerability_1.id,
+    vulnerability_1.aliases,
+    vulnerability_1.details,
+    vulnerability_1.fixed_in,
+    vulnerability_1.link,
+    vulnerability_1.source,
+  ) == (
+    "VULN-1",
+    ["CVE-1"],
+    "Ranges",
+    ["2.1", "1.0.1"],
+    "https://osv.dev/vulnerability/VULN-1",
+    "osv",
+  )
+  assert (vulnerability_2.id, vulnerability_2.fixed_in, vulnerability_2.link) == (
+    "VULN-2",
+    [],
+    "https://example.com/advisory",
+  )
+  database.close()
+
+
+async def test_index(
+  database_directory: pathlib.Path, cache_directory: pathlib.Path
+) -> None:
+  database = osv_database.OSVDatabase(str(database_directory))
+  assert await getVulnerabilityIds(database, "project-a", "1.0") == ["VULN-1"]
+  (index_path,) = cache_directory.glob("osv-index-*.idx")
+  database.close()
+
+  # the index is reused
+  with mock.patch.object(
+    osv_database, "build_index", side_effect=AssertionError("index rebuilt")
+  ):
+    database = osv_database.OSVDatabase(str(database_directory))
+    assert await getVulnerabilityIds(database, "project-a", "1.0") == ["VULN-1"]
+    database.close()
+
+  # and built again when the database changes
+  vulnerability_path = database_directory / "PyPI" / "VULN-1.json"
+  vulnerability_path.write_text(json.dumps(dict(vulnerabilities[0], id="VULN-1b")))
+  os.utime(vulnerability_path, ns=(0, 0))
+  database = osv_database.OSVDatabase(str(database_directory))
+  assert await getVulnerabilityIds(database, "project-a", "1.0") == ["VULN-1b"]
+  database.close()
+
+  # or when the index is not valid
+  for damaged_index in (
+    b"invalid",
+    osv_database.MAGIC + b"abc",
+    osv_database.MAGIC + struct.pack(">Q", 2) + b"{}",
+    osv_database.MAGIC + struct.pack(">Q", 2) + b"[]",
+  ):
+    index_path.write_bytes(damaged_index)
+    database = osv_database.OSVDatabase(str(database_directory))
+    assert await getVulnerabilityIds(database, "project-a", "1.0") == ["VULN-1b"]
+    database.close()
+    assert index_path.read_bytes().startswith(osv_database.MAGIC + b"\0")
+
+  # without a cache directory, the index is kept in memory
+  cache_dir.set_cache_directory("")
+  database = osv_database.OSVDatabase(str(database_directory))
+  assert await getVulnerabilityIds(database, "project-a", "1.0") == ["VULN-1b"]
+
+
+async def test_reload(database_directory: pathlib.Path) -> None:
+  database = osv_database.OSVDatabase(str(database_directory))
+  load = database.load
+
+  # loading is tried again after an error
+  with mock.patch.object(database, "load", side_effect=RuntimeError("load")):
+    with pytest.raises(RuntimeError):
+      await getVulnerabilityIds(database, "project-a", "1.0")
+  assert database._loading is None
+  assert await getVulnerabilityIds(database, "project-a", "1.0") == ["VULN-1"]
+
+  # and after the database is closed
+  database.close()
+  with mock.patch.object(database, "load", side_effect=load) as reload:
+    assert await getVulnerabilityIds(database, "project-a", "1.0") == ["VULN-1"]
+  reload.assert_called_once_with()
+  database.close()
+
+
+async def test_errors(tmp_path: pathlib.Path) -> None:
+  database = osv_database.OSVDatabase(str(tmp_path / "missing.zip"))
+  assert await getVulnerabilityIds(database, "project-a", "1.0") == []
+
+  (tmp_path / "invalid.zip").write_text("not a zip")
+  database = osv_database.OSVDatabase(str(tmp_path / "invalid.zip"))
+  assert await getVulnerabilityIds(database, "project-a", "1.0") == []
+
+
+async def test_diagnostics(
+  server: Any,
+  mocked_responses: aioresponses.aioresponses,
+  tmp_path: pathlib.Path,
+) -> None:
+  with open(pathlib.Path(__file__).parent / "testdata" / "sampleproject.json") as f:
+    mocked_responses.get(
+      "https://pypi.org/pypi/sampleproject/json", payload=json.load(f), repeat=True
+    )
+  (tmp_path / "VULN-1.json").write_text(
+    json.dumps(
+      {
+        "id": "VULN-1",
+        "details": "Offline vulnerability",
+        "affected": [
+          {
+            "package": {"name": "sampleproject", "ecosystem": "PyPI"},
+            "versions": ["1.2.0"],
+          }
+        ],
+      }
+    )
+  )
+  osv.set_osv_database(str(tmp_path))
+  try:
+    await parseAndSendDiagnostics(
+      server, "file:///code_actions/known_vulnerabilities.cfg"
+    )
+  finally:
+    osv.set_osv_database(None)
+  server.text_document_publish_diagnostics.assert_called_once_with(
+    PublishDiagnosticsParams(
+      uri="file:///code_actions/known_vulnerabilities.cfg",
+      diagnostics=[mock.ANY],
+    ),
+  )
+  (diagnostic,) = server.text_document_publish_diagnostics.call_args[0][0].diagnostics
+  assert diagnostic.message == (
+    "sampleproject 1.2.0 has some known vulnerabilities:\n"
+    "VULN-1\nOffline vulnerability\nhttps://osv.dev/vulnerability/VULN-1"
+  )
+
+
+async def test_diagnostics_unreachable_package_index(
+  server: Any,
+  mocked_responses: aioresponses.aioresponses,
+  tmp_path: pathlib.Path,
+) -> None:
+  mocked_responses.get(
+    "https://pypi.org/pypi/sampleproject/json",
+    exception=aiohttp.ClientConnectionError(),
+    repeat=True,
+  )
+  (tmp_path / "VULN-1.json").write_text(
+    json.dumps(
+      {
+        "id": "VULN-1",
+        "details": "Offline vulnerability",
+        "affected": [
+          {
+            "package": {"name": "sampleproject", "ecosystem": "PyPI"},
+            "versions": ["1.2.0"],
+          }
+        ],
+      }
+    )
+  )
+  pypi_client = pypi.PyPIClient()
+  osv.set_osv_database(str(tmp_path))
+  try:
+    with (
+      mock.patch.object(diagnostic, "pypi_client", pypi_client),
+      mock.patch.object(
+        pypi_client, "find_release", side_effect=AssertionError("offline")
+      ),
+    ):
+      await parseAndSendDiagnostics(
+        server, "file:///code_actions/known_vulnerabilities.cfg"
+      )
+  finally:
+    osv.set_osv_database(None)
+  (diagnostic_,) = server.text_document_publish_diagnostics.call_args[0][0].diagnostics
+  assert diagnostic_.message == (
+    "sampleproject 1.2.0 has some known vulnerabilities:\n"
+    "VULN-1\nOffline vulnerability\nhttps://osv.dev/vulnerability/VULN-1"
+  )
+  assert diagnostic_.severity == DiagnosticSeverity.Warning
+  assert diagnostic_.data.latest_version == ""
+  assert [v.id for v in diagnostic_.data.known_vulnerabilities] == ["VULN-1"]
@@ -0,0 +1,119 @@
+import asyncio
+from typing import Any
+from unittest import mock
+
+import aioresponses
+import pytest
+from aioresponses import CallbackResult
+
+from .. import diagnostic, prefetch
+from ..server import parseAndSendDiagnostics
+from ..util import pypi
+from .conftest import countRequests
+
+buildout_uri = "file:///prefetch/buildout.cfg"
+versions_uri = "file:///prefetch/versions.cfg"
+
+
+@pytest.fixture
+def pypi_client() -> Any:
+  with mock.patch.object(diagnostic, "pypi_client", pypi.PyPIClient()) as client:
+    yield client
+
+
+async def test_prefetch_extended_profiles(
+  server: Any,
+  mocked_responses: aioresponses.aioresponses,
+  sampleproject_responses: aioresponses.aioresponses,
+  pypi_client: pypi.PyPIClient,
+) -> None:
+  mocked_responses.get(
+    "https://pypi.org/pypi/project-a/json",
+    status=404,
+    payload={"message": "Not Found"},
+    repeat=True,
+  )
+
+  prefetcher = prefetch.getPrefetcher(server)
+  assert prefetch.getPrefetcher(server) is prefetcher
+  prefetcher.prefetchProfile(server, buildout_uri)
+  await prefetcher.wait()
+  # the pins of versions.cfg, except the ones with slapos markers
+  assert sorted(str(url) for _, url in mocked_responses.requests) == [
+    "https://pypi.org/pypi/project-a/json",
+    "https://pypi.org/pypi/sampleproject/1.2.0/json",
+    "https://pypi.org/pypi/sampleproject/json",
+  ]
+
+  # pins are prefetched once
+  prefetcher.prefetchProfile(server, buildout_uri)
+  await prefetcher.wait()
+  requests_count = countRequests(mocked_responses)
+  assert requests_count == 3
+
+  # diagnostics of versions.cfg use the prefetched metadata
+  await parseAndSendDiagnostics(server, versions_uri)
+  assert countRequests(mocked_responses) == requests_count
+  diagnostics = server.text_document_publish_diagnostics.call_args[0][0].diagnostics
+  assert sorted(d.message.splitlines()[0] for d in diagnostics) == [
+    "Project project-a does not exist",
+    "sampleproject 1.2.0 has some known vulnerabilities:",
+  ]
+
+  # profiles without extends have nothing to prefetch
+  prefetcher.prefetchProfile(server, versions_uri)
+  prefetcher.prefetchProfile(server, "file:///prefetch/template.in")
+  await prefetcher.wait()
+  assert countRequests(mocked_responses) == requests_count
+
+
+async def test_prefetch_budget_and_cancel(
+  server: Any,
+  mocked_responses: aioresponses.aioresponses,
+  pypi_client: pypi.PyPIClient,
+) -> None:
+  running = 0
+  max_running = 0
+  started = asyncio.Event()
+  release = asyncio.Event()
+
+  async def slowResponse(url: Any, **kwargs: Any) -> CallbackResult:
+    nonlocal running, max_running
+    running += 1
+    max_running = max(max_running, running)
+    started.set()
+    try:
+      await release.wait()
+    finally:
+      running -= 1
+    return CallbackResult(status=404, payload={"message": "Not Found"})
+
+  mocked_responses.get(
+    "https://pypi.org/pypi/sampleproject/json", callback=slowResponse, repeat=True
+  )
+  mocked_responses.get(
+    "https://pypi.org/pypi/project-a/json", callback=slowResponse, repeat=True
+  )
+  mocked_responses.get(
+    "https://pypi.org/pypi/sampleproject/1.2.0/json",
+    callback=slowResponse,
+    repeat=True,
+  )
+
+  with mock.patch.object(prefetch, "PREFETCH_CONCURRENCY", 1):
+    prefetch.getPrefetcher(server).prefetchProfile(server, buildout_uri)
+    await started.wait()
+    await asyncio.sleep(0.01)
+    assert max_running == 1
+
+    # closing the workspace cancels the prefetch
+    prefetch.cancelPrefetch(server.workspace)
+    await asyncio.sleep(0.01)
+    assert running == 0
+    release.set()
+
+  # a new prefetch starts again
+  prefetcher = prefetch.getPrefetcher(server)
+  prefetcher.prefetchProfile(server, buildout_uri)
+  await prefetcher.wait()
+  assert max_running == 1
@@ -0,0 +1,150 @@
+import asyncio
+
+import aioresponses
+import pytest
+
+from ..types import VersionNotFound
+from ..util.pypi import PyPIClient, ReleaseIndex, parse_version
+from .conftest import countRequests
+
+
+async def test_use_project_metadata(
+  sampleproject_responses: aioresponses.aioresponses,
+) -> None:
+  client = PyPIClient()
+  semaphore = asyncio.Semaphore(4)
+
+  # the latest release only needs the project metadata
+  assert await client.get_latest_version("sampleproject", "2.0.0", semaphore) is None
+  assert (
+    await client.get_known_vulnerabilities("sampleproject", "2.0.0", semaphore) == ()
+  )
+  assert countRequests(sampleproject_responses) == 1
+
+  # so do releases that do not exist
+  with pytest.raises(VersionNotFound):
+    await client.get_known_vulnerabilities("sampleproject", "9.9.9", semaphore)
+  assert countRequests(sampleproject_responses) == 1
+
+  # other releases need the release metadata
+  (vulnerability,) = await client.get_known_vulnerabilities(
+    "sampleproject", "1.2.0", semaphore
+  )
+  assert vulnerability.id == "EXAMPLE-VUL"
+  assert countRequests(sampleproject_responses) == 2
+
+
+async def test_concurrent_requests(
+  sampleproject_responses: aioresponses.aioresponses,
+) -> None:
+  client = PyPIClient()
+  semaphore = asyncio.Semaphore(4)
+  # like diagnostics of two profiles using the same versions
+  await asyncio.gather(
+    *[
+      coro
+      for _ in range(2)
+      for coro in (
+        client.get_latest_version("sampleproject", "1.2.0", semaphore),
+        client.get_known_vulnerabilities("sampleproject", "1.2.0", semaphore),
+      )
+    ]
+  )
+  assert countRequests(sampleproject_responses) == 2
+
+
+async def test_without_project_metadata(
+  sampleproject_responses: aioresponses.aioresponses,
+) -> None:
+  client = PyPIClient(use_project_metadata=False)
+  semaphore = asyncio.Semaphore(4)
+  assert await client.get_latest_version("sampleproject", "1.2.0", semaphore)
+  (vulnerability,) = await client.get_known_vulnerabilities(
+    "sampleproject", "1.2.0", semaphore
+  )
+  assert vulnerability.id == "EXAMPLE-VUL"
+  assert countRequests(sampleproject_responses) == 2
+
+
+def test_release_index() -> None:
+  release_index = ReleaseIndex(
+    "2.1",
+    [
+      "0.9",
+      "1.0",
+      "1.1rc1",
+      "1.2",
+      "1.3",
+      "1.4.dev0",
+      "2.0",
+      "2.1",
+      "3.0a1",
+      "invalid",
+    ],
+    yanked=["1.3"],
+  )
+  assert release_index.is_prerelease("1.1rc1")
+  assert release_index.sorted_releases == [
+    "0.9",
+    "1.0",
+    "1.1rc1",
+    "1.2",
+    "1.3",
+    "1.4.dev0",
+    "2.0",
+    "2.1",
+    "3.0a1",
+  ]
+
+  # releases are found by their name or by an equivalent version
+  assert release_index.find_release("1.0") == "1.0"
+  assert release_index.find_release("1.0.0") == "1.0"
+  assert release_index.find_release("invalid") == "invalid"
+  assert release_index.find_release("1.5") is None
+
+  assert release_index.get_latest_version("1.0") == parse_version("2.1")
+  assert release_index.get_latest_version("2.1") is None
+  # the latest version is not a pre-release
+  assert release_index.get_latest_version("3.0a1") is None
+  # versions which are not releases are older than all releases
+  assert release_index.get_latest_version("9.9") == parse_version("2.1")
+
+  # yanked releases and pre-releases are skipped
+  assert release_index.get_latest_version_in_series("1.0") == parse_version("1.2")
+  assert release_index.get_latest_version_in_series("1.1rc1") == parse_version(
+    "1.4.dev0"
+  )
+  assert release_index.get_latest_version_in_series("1.2") is None
+  assert release_index.get_latest_version_in_series("2.0") == parse_version("2.1")
+  assert release_index.get_latest_version_in_series("0.1") == parse_version("0.9")
+  assert release_index.get_latest_version_in_series("invalid") is None
+
+  release_index = ReleaseIndex("1!1.0", ["1!0.1", "1!0.2", "1.0"])
+  assert release_index.get_latest_version_in_series("1!0.1") == parse_version("1!0.2")
+
+
+async def test_release_index_yanked(
+  mocked_responses: aioresponses.aioresponses,
+) -> None:
+  mocked_responses.get(
+    "https://pypi.org/pypi/project/json",
+    payload={
+      "info": {"version": "1.1"},
+      "releases": {
+        "1.0": [{"yanked": False}],
+        "1.1": [{"yanked": False}],
+        "1.2": [{"yanked": True}, {"yanked": True}],
+        "1.3": [],
+      },
+    },
+  )
+  client = PyPIClient()
+  semaphore = asyncio.Semaphore(4)
+  release_index, _ = await client.get_release_index("project", semaphore)
+  assert release_index is not None
+  assert release_index.yanked == {"1.2"}
+  assert await client.get_latest_version_in_series(
+    "project", "1.0", semaphore
+  ) == parse_version("1.3")
+  # the index is built once
+  assert (await client.get_release_index("project", semaphore))[0] is release_index
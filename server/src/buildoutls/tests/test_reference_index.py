@@ -0,0 +1,211 @@
+import asyncio
+import io
+import os
+import pathlib
+import sqlite3
+import time
+from typing import Any, List
+from unittest import mock
+
+from lsprotocol.types import FileChangeType, FileEvent, TextDocumentItem
+from pygls.workspace import Workspace
+
+from .. import buildout
+from ..reference_index import IndexedSymbolKind, ReferenceIndex, getProfileSymbols
+from ..workspace_index import WorkspaceIndex
+
+
+class Server:
+  def __init__(self, root: pathlib.Path):
+    self.workspace = Workspace(root.as_uri())
+
+
+def createIndex(root: pathlib.Path, database: pathlib.Path) -> ReferenceIndex:
+  return ReferenceIndex(WorkspaceIndex(str(root)), str(database))
+
+
+async def getReferences(index: ReferenceIndex, ls: Any) -> List[str]:
+  return [
+    "{} {}:{}".format(
+      os.path.basename(location.uri),
+      location.range.start.line,
+      location.range.start.character,
+    )
+    for location in await index.getSymbols(
+      ls, (IndexedSymbolKind.OptionReference,), "section", "option"
+    )
+  ]
+
+
+async def test_reference_index_persistence(tmp_path: pathlib.Path) -> None:
+  root = tmp_path / "workspace"
+  root.mkdir()
+  database = tmp_path / "references.sqlite"
+  (root / "a.cfg").write_text("[section]\noption = a\n")
+  (root / "b.cfg").write_text("[b]\nx = ${section:option}\n")
+  ls = Server(root)
+
+  index = createIndex(root, database)
+  assert await getReferences(index, ls) == ["b.cfg 1:14"]
+  index.close()
+
+  # a new session reuses the index without parsing profiles again
+  index = createIndex(root, database)
+  with mock.patch.object(
+    buildout, "_parse", side_effect=AssertionError("profile parsed again")
+  ):
+    assert await getReferences(index, ls) == ["b.cfg 1:14"]
+  index.close()
+
+  # profiles modified between sessions are indexed again
+  (root / "b.cfg").write_text("[b]\nx = ${section:option} ${section:option}\n")
+  index = createIndex(root, database)
+  assert await getReferences(index, ls) == ["b.cfg 1:14", "b.cfg 1:32"]
+  index.close()
+
+
+async def test_reference_index_shared_database(tmp_path: pathlib.Path) -> None:
+  root = tmp_path / "workspace"
+  root.mkdir()
+  database = tmp_path / "references.sqlite"
+  (root / "a.cfg").write_text("[section]\noption = a\n")
+  (root / "b.cfg").write_text("[b]\nx = ${section:option}\n")
+  ls = Server(root)
+
+  # two servers index the same workspace at the same time
+  index = createIndex(root, database)
+  other_index = createIndex(root, database)
+  assert await asyncio.gather(
+    getReferences(index, ls), getReferences(other_index, ls)
+  ) == [["b.cfg 1:14"], ["b.cfg 1:14"]]
+
+  # profiles can not be indexed while another server writes the database
+  (root / "b.cfg").write_text("[b]\nx = ${section:option} ${section:option}\n")
+  index.update([FileEvent(uri=(root / "b.cfg").as_uri(), type=FileChangeType.Changed)])
+  writer = sqlite3.connect(str(database))
+  writer.execute("BEGIN IMMEDIATE")
+  start = time.monotonic()
+  assert await getReferences(index, ls) == ["b.cfg 1:14"]
+  assert time.monotonic() - start < 1
+  writer.rollback()
+  writer.close()
+
+  # and are indexed on next refresh
+  assert await getReferences(index, ls) == ["b.cfg 1:14", "b.cfg 1:32"]
+  index.close()
+  other_index.close()
+
+
+async def test_reference_index_update(tmp_path: pathlib.Path) -> None:
+  root = tmp_path / "workspace"
+  root.mkdir()
+  (root / "a.cfg").write_text("[section]\noption = a\n")
+  (root / "b.cfg").write_text("[b]\nx = ${section:option}\n")
+  ls = Server(root)
+  index = createIndex(root, tmp_path / "references.sqlite")
+  assert await getReferences(index, ls) == ["b.cfg 1:14"]
+
+  (root / "b.cfg").unlink()
+  (root / "c.cfg").write_text("[c]\n\nx = ${section:option}\n")
+  changes = [
+    FileEvent(uri=(root / "b.cfg").as_uri(), type=FileChangeType.Deleted),
+    FileEvent(uri=(root / "c.cfg").as_uri(), type=FileChangeType.Created),
+  ]
+  index.profiles.update(changes)
+  index.update(changes)
+  assert await getReferences(index, ls) == ["c.cfg 2:14"]
+
+  # documents opened in the editor are used instead of the saved documents
+  ls.workspace.put_text_document(
+    TextDocumentItem(
+      uri=(root / "c.cfg").as_uri(),
+      language_id="zc-buildout",
+      version=1,
+      text="[c]\nx = ${section:other}\n\n\ny = ${section:option}\n",
+    )
+  )
+  assert await getReferences(index, ls) == ["c.cfg 4:14"]
+  ls.workspace.remove_text_document((root / "c.cfg").as_uri())
+  assert await getReferences(index, ls) == ["c.cfg 2:14"]
+  index.close()
+
+
+async def test_reference_index_workspace_symbols(tmp_path: pathlib.Path) -> None:
+  root = tmp_path / "workspace"
+  root.mkdir()
+  database = tmp_path / "references.sqlite"
+  (root / "a.cfg").write_text("[mariadb]\nport = 3306\n")
+  (root / "b.cfg").write_text("[mariadb-server]\n<= mariadb\n")
+  ls: Any = Server(root)
+
+  async def search(index: ReferenceIndex, query: str) -> List[str]:
+    return [
+      "{} {} {}:{}".format(
+        symbol.name,
+        os.path.basename(symbol.uri),
+        symbol.range.start.line,
+        symbol.range.start.character,
+      )
+      for symbol in await index.searchWorkspaceSymbols(ls, query)
+    ]
+
+  index = createIndex(root, database)
+  assert await search(index, "maria") == [
+    "mariadb a.cfg 0:1",
+    "mariadb-server b.cfg 0:1",
+  ]
+  assert await search(index, "port") == ["port a.cfg 1:0"]
+  index.close()
+
+  # symbols are loaded from the database in a new session
+  index = createIndex(root, database)
+  with mock.patch.object(
+    buildout, "_parse", side_effect=AssertionError("profile parsed again")
+  ):
+    assert await search(index, "maria") == [
+      "mariadb a.cfg 0:1",
+      "mariadb-server b.cfg 0:1",
+    ]
+
+  # documents opened in the editor are used instead of the saved documents
+  ls.workspace.put_text_document(
+    TextDocumentItem(
+      uri=(root / "b.cfg").as_uri(),
+      language_id="zc-buildout",
+      version=1,
+      text="\n[mariadb-client]\n",
+    )
+  )
+  assert await search(index, "maria") == [
+    "mariadb a.cfg 0:1",
+    "mariadb-client b.cfg 1:1",
+  ]
+  ls.workspace.remove_text_document((root / "b.cfg").as_uri())
+  assert await search(index, "maria") == [
+    "mariadb a.cfg 0:1",
+    "mariadb-server b.cfg 0:1",
+  ]
+
+  # deleted profiles are removed
+  (root / "a.cfg").unlink()
+  changes = [FileEvent(uri=(root / "a.cfg").as_uri(), type=FileChangeType.Deleted)]
+  index.profiles.update(changes)
+  index.update(changes)
+  assert await search(index, "maria") == ["mariadb-server b.cfg 0:1"]
+  index.close()
+
+
+async def test_profile_symbols_line_separators() -> None:
+  # the parser only splits lines on \n
+  profile = await buildout._parse(
+    io.StringIO("# form \x0c feed\n[a]\nv = 1 \x1c\u2028\n"),
+    "file:///a.cfg",
+    allow_errors=True,
+  )
+  assert [
+    (symbol.kind, symbol.section_name, symbol.option_name, symbol.range.start.line)
+    for symbol in await getProfileSymbols(profile)
+  ] == [
+    (IndexedSymbolKind.SectionDefinition, "a", None, 1),
+    (IndexedSymbolKind.OptionDefinition, "a", "v", 2),
+  ]
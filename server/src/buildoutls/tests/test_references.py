@@ -1,10 +1,14 @@
+import asyncio
+
 import pytest
 from lsprotocol.types import (
   Position,
+  ProgressParams,
   Range,
   TextDocumentIdentifier,
   ReferenceParams,
   ReferenceContext,
+  WorkDoneProgressEnd,
 )
 from pygls.lsp.server import LanguageServer
 
@@ -113,3 +117,92 @@ async def test_references_from_parts(server: LanguageServer):
   assert reference.range == Range(
     start=Position(line=2, character=4), end=Position(line=2, character=22)
   )
+
+
+async def test_references_partial_results(server) -> None:
+  references = await lsp_references(
+    server,
+    ReferenceParams(
+      context=ReferenceContext(include_declaration=False),
+      text_document=TextDocumentIdentifier(uri="file:///references/referenced.cfg"),
+      position=Position(line=4, character=10),
+      partial_result_token="partial",
+    ),
+  )
+  # references are sent as partial results, one batch per profile
+  assert references == []
+  server.progress.assert_called_once()
+  (params,) = server.progress.call_args.args
+  assert isinstance(params, ProgressParams)
+  assert params.token == "partial"
+  assert params.value is not None
+  assert [
+    (location.uri.split("/profiles/")[-1], location.range.start)
+    for location in params.value
+  ] == [
+    ("references/buildout.cfg", Position(line=8, character=10)),
+    ("references/buildout.cfg", Position(line=11, character=2)),
+  ]
+
+
+async def test_references_progress(server) -> None:
+  await lsp_references(
+    server,
+    ReferenceParams(
+      context=ReferenceContext(include_declaration=False),
+      text_document=TextDocumentIdentifier(uri="file:///references/referenced.cfg"),
+      position=Position(line=4, character=10),
+      work_done_token="progress",
+    ),
+  )
+  server.work_done_progress.begin.assert_called_once()
+  percentages = [
+    report.percentage
+    for (_, report), _ in server.work_done_progress.report.call_args_list
+  ]
+  assert percentages == sorted(percentages)
+  assert percentages[0] == 0
+  assert percentages[-1] >= 50
+  server.work_done_progress.end.assert_called_once_with(
+    "progress", WorkDoneProgressEnd()
+  )
+
+
+async def test_references_cancelled_progress(server) -> None:
+  # the client cancels the progress as soon as indexing starts
+  server.work_done_progress.report.side_effect = (
+    lambda token, _: server.work_done_progress.tokens[token].cancel()
+  )
+  references = await lsp_references(
+    server,
+    ReferenceParams(
+      context=ReferenceContext(include_declaration=False),
+      text_document=TextDocumentIdentifier(uri="file:///references/referenced.cfg"),
+      position=Position(line=4, character=10),
+      work_done_token="progress",
+    ),
+  )
+  server.work_done_progress.report.side_effect = None
+  assert references == []
+  server.work_done_progress.report.assert_called_once()
+  server.work_done_progress.end.assert_called_once()
+
+
+async def test_references_cancelled_request(server) -> None:
+  # $/cancelRequest cancels the task
+  task = asyncio.ensure_future(
+    lsp_references(
+      server,
+      ReferenceParams(
+        context=ReferenceContext(include_declaration=False),
+        text_document=TextDocumentIdentifier(uri="file:///references/referenced.cfg"),
+        position=Position(line=4, character=10),
+        work_done_token="progress",
+      ),
+    )
+  )
+  await asyncio.sleep(0)
+  task.cancel()
+  with pytest.raises(asyncio.CancelledError):
+    await task
+  server.work_done_progress.end.assert_called_once()
@@ -0,0 +1,139 @@
+from typing import List, Tuple
+
+import pytest
+from lsprotocol.types import (
+  Position,
+  PrepareRenameParams,
+  Range,
+  RenameParams,
+  TextDocumentIdentifier,
+  WorkspaceEdit,
+)
+from pygls.exceptions import JsonRpcInvalidParams
+from pygls.lsp.server import LanguageServer
+
+from ..server import lsp_prepare_rename, lsp_rename
+
+
+def getEdits(edit: WorkspaceEdit) -> List[Tuple[str, Range, str]]:
+  """Flatten edits as (file name, range, new text)."""
+  assert edit.changes is not None
+  return sorted(
+    (
+      (uri.split("/profiles/")[-1], text_edit.range, text_edit.new_text)
+      for uri, text_edits in edit.changes.items()
+      for text_edit in text_edits
+    ),
+    key=lambda e: (e[0], e[1].start.line, e[1].start.character),
+  )
+
+
+async def test_prepare_rename(server: LanguageServer):
+  assert await lsp_prepare_rename(
+    server,
+    PrepareRenameParams(
+      text_document=TextDocumentIdentifier(uri="file:///references/referenced.cfg"),
+      position=Position(line=0, character=5),
+    ),
+  ) == Range(start=Position(line=0, character=1), end=Position(line=0, character=20))
+
+  # option value
+  assert (
+    await lsp_prepare_rename(
+      server,
+      PrepareRenameParams(
+        text_document=TextDocumentIdentifier(uri="file:///references/referenced.cfg"),
+        position=Position(line=1, character=15),
+      ),
+    )
+    is None
+  )
+
+
+async def test_rename_section(server: LanguageServer):
+  edit = await lsp_rename(
+    server,
+    RenameParams(
+      text_document=TextDocumentIdentifier(uri="file:///references/referenced.cfg"),
+      position=Position(line=4, character=5),
+      new_name="renamed",
+    ),
+  )
+  assert edit is not None
+  assert getEdits(edit) == [
+    (
+      "references/buildout.cfg",
+      Range(start=Position(line=8, character=10), end=Position(line=8, character=29)),
+      "renamed",
+    ),
+    (
+      "references/buildout.cfg",
+      Range(start=Position(line=11, character=3), end=Position(line=11, character=22)),
+      "renamed",
+    ),
+    (
+      "references/referenced.cfg",
+      Range(start=Position(line=4, character=1), end=Position(line=4, character=20)),
+      "renamed",
+    ),
+  ]
+
+
+async def test_rename_section_from_parts(server: LanguageServer):
+  edit = await lsp_rename(
+    server,
+    RenameParams(
+      text_document=TextDocumentIdentifier(uri="file:///references/parts.cfg"),
+      position=Position(line=2, character=6),
+      new_name="renamed",
+    ),
+  )
+  assert edit is not None
+  assert getEdits(edit) == [
+    (
+      "references/parts.cfg",
+      Range(start=Position(line=2, character=4), end=Position(line=2, character=22)),
+      "renamed",
+    ),
+    (
+      "references/parts.cfg",
+      Range(start=Position(line=5, character=1), end=Position(line=5, character=19)),
+      "renamed",
+    ),
+  ]
+
+
+async def test_rename_option(server: LanguageServer):
+  edit = await lsp_rename(
+    server,
+    RenameParams(
+      text_document=TextDocumentIdentifier(uri="file:///references/buildout.cfg"),
+      position=Position(line=5, character=32),
+      new_name="renamed",
+    ),
+  )
+  assert edit is not None
+  assert getEdits(edit) == [
+    (
+      "references/buildout.cfg",
+      Range(start=Position(line=5, character=30), end=Position(line=5, character=36)),
+      "renamed",
+    ),
+    (
+      "references/referenced.cfg",
+      Range(start=Position(line=1, character=0), end=Position(line=1, character=6)),
+      "renamed",
+    ),
+  ]
+
+
+async def test_rename_invalid_name(server: LanguageServer):
+  with pytest.raises(JsonRpcInvalidParams):
+    await lsp_rename(
+      server,
+      RenameParams(
+        text_document=TextDocumentIdentifier(uri="file:///references/referenced.cfg"),
+        position=Position(line=4, character=5),
+        new_name="not valid",
+      ),
+    )
@@ -0,0 +1,113 @@
+from lsprotocol.types import (
+  Position,
+  Range,
+  SymbolKind,
+  WorkspaceSymbolParams,
+)
+from pygls.lsp.server import LanguageServer
+
+from ..server import lsp_workspace_symbols
+from ..symbol_index import SymbolIndex, WorkspaceSymbol, fuzzyScore
+
+
+def symbol(name: str, uri: str = "file:///a.cfg", line: int = 0) -> WorkspaceSymbol:
+  return WorkspaceSymbol(
+    name,
+    None,
+    uri,
+    Range(start=Position(line=line, character=1), end=Position(line=line, character=1)),
+  )
+
+
+def test_fuzzy_score() -> None:
+  assert fuzzyScore("mariadb", "mariadb") == 1000
+  scores = [
+    fuzzyScore(query, name)
+    for query, name in (
+      ("maria", "mariadb"),
+      ("maria", "mariadb-server"),
+      ("server", "mariadb-server"),
+      ("erver", "mariadb-server"),
+      ("mdbs", "mariadb-server"),
+      ("mdbsr", "mariadb-server"),
+    )
+  ]
+  assert scores == sorted(scores, key=lambda score: score or 0, reverse=True)
+  assert None not in scores
+  assert fuzzyScore("sm", "mariadb-server") is None
+
+
+def test_symbol_index_search() -> None:
+  index = SymbolIndex()
+  index.set(
+    "file:///a.cfg",
+    [
+      symbol("mariadb", line=0),
+      symbol("mariadb-server", line=1),
+      symbol("apache-server", line=2),
+    ],
+  )
+  index.set("file:///b.cfg", [symbol("MariaDB-Client", "file:///b.cfg")])
+
+  assert [s.name for s in index.search("mariadb")] == [
+    "mariadb",
+    "MariaDB-Client",
+    "mariadb-server",
+  ]
+  # fuzzy matches
+  assert [s.name for s in index.search("mariadb-srv")] == ["mariadb-server"]
+  # short queries match the start of words
+  assert [s.name for s in index.search("s")] == ["apache-server", "mariadb-server"]
+  assert [s.name for s in index.search("cl")] == ["MariaDB-Client"]
+  # empty query matches everything
+  assert len(index.search("")) == 4
+  assert [s.name for s in index.search("", limit=1)] == ["apache-server"]
+  assert [s.name for s in index.search("maria", excluded_uris=["file:///a.cfg"])] == [
+    "MariaDB-Client"
+  ]
+
+  # symbols are replaced when a profile is indexed again
+  index.set("file:///a.cfg", [symbol("apache")])
+  assert [s.name for s in index.search("maria")] == ["MariaDB-Client"]
+  assert [s.name for s in index.search("apa")] == ["apache"]
+  index.remove("file:///b.cfg")
+  assert [s.name for s in index.search("maria")] == []
+  assert len(index) == 1
+  index.remove("file:///a.cfg")
+  assert len(index) == 0
+  assert not index._trigrams
+  assert not index._prefixes
+
+
+async def test_workspace_symbols(server: LanguageServer) -> None:
+  symbols = await lsp_workspace_symbols(
+    server, WorkspaceSymbolParams(query="referenced_section1")
+  )
+  assert [
+    (s.name, s.kind, s.container_name, s.location.uri.split("/profiles/")[-1])
+    for s in symbols[:3]
+  ] == [
+    ("referenced_section1", SymbolKind.Class, None, "references/referenced.cfg"),
+    (
+      "section_extending_referenced_section1",
+      SymbolKind.Class,
+      None,
+      "references/buildout.cfg",
+    ),
+    (
+      "section_referencing_referenced_section1",
+      SymbolKind.Class,
+      None,
+      "references/buildout.cfg",
+    ),
+  ]
+  assert symbols[0].location.range == Range(
+    start=Position(line=0, character=1), end=Position(line=0, character=20)
+  )
+
+  # options are also returned
+  symbols = await lsp_workspace_symbols(server, WorkspaceSymbolParams(query="value2"))
+  assert {(s.name, s.kind, s.container_name) for s in symbols} >= {
+    ("value2", SymbolKind.Field, "referenced_section1"),
+    ("value2", SymbolKind.Field, "referenced_section2"),
+  }
@@ -0,0 +1,99 @@
+import pathlib
+from typing import List
+
+from lsprotocol.types import FileChangeType, FileEvent
+
+from ..workspace_index import GitIgnorePattern, WorkspaceIndex
+
+
+def makeTree(root: pathlib.Path, *paths: str) -> None:
+  for path in paths:
+    (root / path).parent.mkdir(parents=True, exist_ok=True)
+    (root / path).touch()
+
+
+def relativeProfiles(index: WorkspaceIndex, root: pathlib.Path) -> List[str]:
+  return [str(p.relative_to(root)) for p in index.getProfiles()]
+
+
+def test_workspace_index_skips_buildout_directories(tmp_path: pathlib.Path) -> None:
+  makeTree(
+    tmp_path,
+    "buildout.cfg",
+    "not_a_profile.txt",
+    "software/buildout.cfg",
+    "eggs/egg/buildout.cfg",
+    "develop-eggs/egg/buildout.cfg",
+    "parts/part/buildout.cfg",
+    ".git/config.cfg",
+    "node_modules/module/buildout.cfg",
+    "software/parts/buildout.cfg",
+  )
+  index = WorkspaceIndex(str(tmp_path))
+  assert relativeProfiles(index, tmp_path) == [
+    "buildout.cfg",
+    "software/buildout.cfg",
+  ]
+
+
+def test_workspace_index_gitignore(tmp_path: pathlib.Path) -> None:
+  makeTree(
+    tmp_path,
+    "buildout.cfg",
+    "local.cfg",
+    "build/buildout.cfg",
+    "software/buildout.cfg",
+    "software/generated.cfg",
+    "software/keep.cfg",
+    "software/sub/generated.cfg",
+  )
+  (tmp_path / ".gitignore").write_text("# comment\n/local.cfg\nbuild/\n")
+  (tmp_path / "software" / ".gitignore").write_text("*.cfg\n!buildout.cfg\n!keep.cfg\n")
+  index = WorkspaceIndex(str(tmp_path))
+  assert relativeProfiles(index, tmp_path) == [
+    "buildout.cfg",
+    "software/buildout.cfg",
+    "software/keep.cfg",
+  ]
+
+
+def test_gitignore_pattern() -> None:
+  assert GitIgnorePattern("*.cfg").match("a/b.cfg", False)
+  assert not GitIgnorePattern("/*.cfg").match("a/b.cfg", False)
+  assert GitIgnorePattern("/*.cfg").match("b.cfg", False)
+  assert GitIgnorePattern("a/**/b.cfg").match("a/b.cfg", False)
+  assert GitIgnorePattern("a/**/b.cfg").match("a/x/y/b.cfg", False)
+  assert GitIgnorePattern("a/**").match("a/x/y/b.cfg", False)
+  assert GitIgnorePattern("build/").match("build", True)
+  assert not GitIgnorePattern("build/").match("build", False)
+  assert GitIgnorePattern("instance-[ab].cfg").match("instance-a.cfg", False)
+  assert not GitIgnorePattern("instance-[!ab].cfg").match("instance-a.cfg", False)
+
+
+def test_workspace_index_update(tmp_path: pathlib.Path) -> None:
+  makeTree(tmp_path, "buildout.cfg", "old.cfg")
+  index = WorkspaceIndex(str(tmp_path))
+  assert relativeProfiles(index, tmp_path) == ["buildout.cfg", "old.cfg"]
+
+  makeTree(tmp_path, "new.cfg", "parts/part/new.cfg", "template.in")
+  (tmp_path / "old.cfg").unlink()
+  index.update(
+    [
+      FileEvent(uri=(tmp_path / "new.cfg").as_uri(), type=FileChangeType.Created),
+      FileEvent(
+        uri=(tmp_path / "parts" / "part" / "new.cfg").as_uri(),
+        type=FileChangeType.Created,
+      ),
+      FileEvent(uri=(tmp_path / "template.in").as_uri(), type=FileChangeType.Created),
+      FileEvent(uri=(tmp_path / "old.cfg").as_uri(), type=FileChangeType.Deleted),
+      FileEvent(uri=(tmp_path / "buildout.cfg").as_uri(), type=FileChangeType.Changed),
+    ]
+  )
+  assert relativeProfiles(index, tmp_path) == ["buildout.cfg", "new.cfg"]
+
+  # modifying a .gitignore rebuilds the index
+  (tmp_path / ".gitignore").write_text("new.cfg\n")
+  index.update(
+    [FileEvent(uri=(tmp_path / ".gitignore").as_uri(), type=FileChangeType.Created)]
+  )
+  assert relativeProfiles(index, tmp_path) == ["buildout.cfg"]
@@ -27,6 +27,8 @@ class PyPIPackageInfo:
   latest_version: str
   url: str
   known_vulnerabilities: Sequence[KnownVulnerability]
+  # the latest version with the same major version, if it is not latest_version
+  latest_version_in_series: str = ""
 
 
 # XXX command params are passed as dict in pygls 1.0
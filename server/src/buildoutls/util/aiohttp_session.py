@@ -1,23 +1,234 @@
+"""The HTTP client shared by remote profiles, PyPI, OSV and md5sum downloads.
+
+Connections are kept alive and pooled, with a limit of connections for each
+host, and DNS resolutions are cached.
+
+Requests made with `request` have a priority lane. When all the connections
+to a host are used, interactive requests, like reading a remote profile,
+are started before the background requests, like fetching PyPI metadata,
+and `RESERVED_INTERACTIVE_CONNECTIONS` connections to each host are only
+used by interactive requests.
+
+The number of requests, errors, bytes received and the latency of requests
+are measured for each lane, see `get_metrics`.
+"""
+
+import asyncio
+import collections
+import contextlib
+import enum
 import logging
+import time
 import typing
+import urllib.parse
 
 import aiohttp
 
 logger = logging.getLogger(__name__)
 _session: typing.Optional[aiohttp.ClientSession] = None
 
+# default timeouts to connect, between two reads of a response and for the
+# whole request, in seconds
+CONNECT_TIMEOUT = 10.0
+READ_TIMEOUT = 30.0
+TOTAL_TIMEOUT = 300.0
+_timeout = aiohttp.ClientTimeout(
+  total=TOTAL_TIMEOUT,
+  sock_connect=CONNECT_TIMEOUT,
+  sock_read=READ_TIMEOUT,
+)
+
+# connections of the pool, in total and to each host
+CONNECTIONS = 64
+CONNECTIONS_PER_HOST = 8
+_connections_per_host = CONNECTIONS_PER_HOST
+# connections to each host kept for interactive requests
+RESERVED_INTERACTIVE_CONNECTIONS = 2
+# time to keep idle connections open and to cache DNS resolutions, in seconds
+KEEPALIVE_TIMEOUT = 60.0
+DNS_CACHE_TTL = 600
+
+
+class Lane(enum.IntEnum):
+  """Priority of requests, lower first."""
+
+  INTERACTIVE = 0
+  BACKGROUND = 1
+
+
+class _HostLanes:
+  """Start the requests to a host by priority, when a connection is
+  available.
+  """
+
+  def __init__(self, connections: int):
+    self._limits = {
+      Lane.INTERACTIVE: connections,
+      Lane.BACKGROUND: max(1, connections - RESERVED_INTERACTIVE_CONNECTIONS),
+    }
+    self._active = 0
+    self._waiters: typing.Dict[Lane, typing.Deque["asyncio.Future[None]"]] = {
+      lane: collections.deque() for lane in Lane
+    }
+
+  def _can_start(self, lane: Lane) -> bool:
+    return self._active < self._limits[lane] and not any(
+      self._waiters[waiting_lane] for waiting_lane in Lane if waiting_lane <= lane
+    )
+
+  async def acquire(self, lane: Lane) -> None:
+    if self._can_start(lane):
+      self._active += 1
+      return
+    waiter = asyncio.get_running_loop().create_future()
+    self._waiters[lane].append(waiter)
+    try:
+      await waiter
+    except asyncio.CancelledError:
+      if waiter.done() and not waiter.cancelled():
+        # the request was started just before being cancelled
+        self.release()
+      elif waiter in self._waiters[lane]:
+        self._waiters[lane].remove(waiter)
+      raise
+
+  def release(self) -> None:
+    self._active -= 1
+    for lane in Lane:
+      waiters = self._waiters[lane]
+      while waiters and self._active < self._limits[lane]:
+        waiter = waiters.popleft()
+        if not waiter.done():
+          self._active += 1
+          waiter.set_result(None)
+      if waiters:
+        # lower priority requests wait for this lane
+        return
+
+
+_host_lanes: typing.Dict[str, _HostLanes] = {}
+
+
+class LaneMetrics:
+  """Measures of the requests of a lane."""
+
+  def __init__(self) -> None:
+    self.requests = 0
+    # requests failing or whose response could not be read
+    self.errors = 0
+    self.bytes_received = 0
+    # seconds waiting for a connection, and until the response headers
+    self.total_wait = 0.0
+    self.total_latency = 0.0
+    self.max_latency = 0.0
+
+  def as_dict(self) -> typing.Dict[str, typing.Any]:
+    return {
+      "requests": self.requests,
+      "errors": self.errors,
+      "bytes_received": self.bytes_received,
+      "average_wait": self.total_wait / self.requests if self.requests else 0.0,
+      "average_latency": self.total_latency / self.requests if self.requests else 0.0,
+      "max_latency": self.max_latency,
+    }
+
+
+_metrics = {lane: LaneMetrics() for lane in Lane}
+
+
+def get_metrics() -> typing.Dict[str, typing.Dict[str, typing.Any]]:
+  """Return the metrics of the requests of each lane since the start."""
+  return {lane.name.lower(): _metrics[lane].as_dict() for lane in Lane}
+
+
+def reset_metrics() -> None:
+  for lane in Lane:
+    _metrics[lane] = LaneMetrics()
+
+
+def set_timeouts(
+  connect: typing.Optional[float] = None,
+  read: typing.Optional[float] = None,
+  total: typing.Optional[float] = None,
+) -> None:
+  """Set the timeouts of the requests of the sessions created after this
+  call, or reset them to their defaults.
+  """
+  global _timeout
+  _timeout = aiohttp.ClientTimeout(
+    total=TOTAL_TIMEOUT if total is None else total,
+    sock_connect=CONNECT_TIMEOUT if connect is None else connect,
+    sock_read=READ_TIMEOUT if read is None else read,
+  )
+
+
+def set_connections_per_host(connections: typing.Optional[int] = None) -> None:
+  """Set the connections to each host of the sessions created after this
+  call, or reset it to its default.
+  """
+  global _connections_per_host
+  _connections_per_host = connections or CONNECTIONS_PER_HOST
+
 
 def get_session() -> aiohttp.ClientSession:
   global _session
   if _session is None:
     logging.info("init")
-    _session = aiohttp.ClientSession()
+    _session = aiohttp.ClientSession(
+      timeout=_timeout,
+      connector=aiohttp.TCPConnector(
+        limit=CONNECTIONS,
+        limit_per_host=_connections_per_host,
+        keepalive_timeout=KEEPALIVE_TIMEOUT,
+        ttl_dns_cache=DNS_CACHE_TTL,
+      ),
+    )
   return _session
 
 
+@contextlib.asynccontextmanager
+async def request(
+  method: str,
+  url: str,
+  lane: Lane = Lane.BACKGROUND,
+  **kwargs: typing.Any,
+) -> typing.AsyncIterator[aiohttp.ClientResponse]:
+  """Send a request with the shared session, when a connection to the host
+  is available for the lane.
+  """
+  session = get_session()
+  host = urllib.parse.urlsplit(url).netloc
+  host_lanes = _host_lanes.get(host)
+  if host_lanes is None:
+    host_lanes = _host_lanes[host] = _HostLanes(_connections_per_host)
+  metrics = _metrics[lane]
+  start = time.monotonic()
+  await host_lanes.acquire(lane)
+  try:
+    started = time.monotonic()
+    metrics.requests += 1
+    metrics.total_wait += started - start
+    try:
+      async with session.request(method, url, **kwargs) as resp:
+        latency = time.monotonic() - started
+        metrics.total_latency += latency
+        metrics.max_latency = max(metrics.max_latency, latency)
+        try:
+          yield resp
+        finally:
+          metrics.bytes_received += resp.content.total_bytes
+    except Exception:
+      metrics.errors += 1
+      raise
+  finally:
+    host_lanes.release()
+
+
 async def close_session() -> None:
   global _session
   logging.info("closing")
   if _session is not None:
     await _session.close()
     _session = None
+  # waiting requests belong to the event loop of the session
+  _host_lanes.clear()
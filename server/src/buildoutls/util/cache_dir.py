@@ -0,0 +1,42 @@
+import logging
+import os
+import pathlib
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+_cache_directory: Optional[pathlib.Path] = None
+_enabled = True
+
+
+def set_cache_directory(path: Optional[str]) -> None:
+  """Set the directory for persistent caches, or disable persistent caches
+  if path is empty.
+  """
+  global _cache_directory, _enabled
+  _enabled = path != ""
+  _cache_directory = pathlib.Path(path) if path else None
+
+
+def get_cache_directory() -> Optional[pathlib.Path]:
+  """Return the directory for persistent caches, creating it if needed.
+
+  By default, this is ``buildoutls`` in ``$XDG_CACHE_HOME`` or ``~/.cache``.
+  Returns None when persistent caches are disabled or when the directory can
+  not be created.
+  """
+  if not _enabled:
+    return None
+  cache_directory = _cache_directory
+  if cache_directory is None:
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+      os.path.expanduser("~"), ".cache"
+    )
+    cache_directory = pathlib.Path(cache_home) / "buildoutls"
+  try:
+    cache_directory.mkdir(parents=True, exist_ok=True)
+  except OSError:
+    logger.warning(
+      "Could not create cache directory %s", cache_directory, exc_info=True
+    )
+    return None
+  return cache_directory
@@ -0,0 +1,148 @@
+"""Circuit breakers for hosts which can not be reached.
+
+When requests to a host fail `FAILURE_THRESHOLD` times in a row, because
+the connection or the response timed out, the connection failed or the host
+answered with a server error, the host is marked down. Requests to a host
+marked down fail immediately with `HostUnavailableError` instead of waiting
+for their timeouts, so that diagnostics do not wait minutes for an
+unreachable package index.
+
+A host marked down is probed in the background, after `INITIAL_BACKOFF`
+seconds and then with an exponential backoff up to `MAX_BACKOFF` seconds,
+until it answers again.
+"""
+
+import asyncio
+import contextlib
+import logging
+import time
+import urllib.parse
+from typing import Dict, Iterator, Optional
+
+import aiohttp
+
+from . import aiohttp_session
+
+logger = logging.getLogger(__name__)
+
+# consecutive failures marking a host down
+FAILURE_THRESHOLD = 3
+# delays between the probes of a host marked down, in seconds
+INITIAL_BACKOFF = 2.0
+MAX_BACKOFF = 300.0
+
+# errors of requests counted as failures of the host
+HOST_ERRORS = (aiohttp.ClientConnectionError, asyncio.TimeoutError)
+
+
+class HostUnavailableError(aiohttp.ClientConnectionError):
+  """Raised instead of sending a request to a host marked down."""
+
+
+class CircuitBreaker:
+  """The availability of a host, from the results of the requests to it."""
+
+  def __init__(self, base_url: str):
+    self.base_url = base_url
+    self.failures = 0
+    self.down_since: Optional[float] = None
+    # delay before the next probe of the host marked down
+    self.backoff = INITIAL_BACKOFF
+    self._probe: Optional["asyncio.Task[None]"] = None
+
+  @property
+  def is_down(self) -> bool:
+    return self.down_since is not None
+
+  def check(self) -> None:
+    """Raise HostUnavailableError if the host is marked down."""
+    if self.down_since is None:
+      return
+    # the probe can have been started in an event loop which is now closed
+    if (
+      self._probe is None
+      or self._probe.done()
+      or self._probe.get_loop() is not asyncio.get_running_loop()
+    ):
+      self._probe = asyncio.ensure_future(self._probe_until_available())
+    raise HostUnavailableError(
+      f"{self.base_url} is unavailable since "
+      f"{time.monotonic() - self.down_since:.0f} seconds"
+    )
+
+  def record_success(self) -> None:
+    self.failures = 0
+    if self.down_since is not None:
+      logger.info("%s is available again", self.base_url)
+      self.down_since = None
+
+  def record_failure(self) -> None:
+    self.failures += 1
+    if self.failures >= FAILURE_THRESHOLD and self.down_since is None:
+      logger.warning(
+        "%s is unavailable after %d failures", self.base_url, self.failures
+      )
+      self.down_since = time.monotonic()
+      self.backoff = INITIAL_BACKOFF
+      self._probe = asyncio.ensure_future(self._probe_until_available())
+
+  @contextlib.contextmanager
+  def guard(self) -> Iterator[None]:
+    """Fail immediately if the host is marked down, otherwise record the
+    result of the request made in the block.
+    """
+    self.check()
+    try:
+      yield
+    except HOST_ERRORS:
+      self.record_failure()
+      raise
+    except aiohttp.ClientResponseError as e:
+      if e.status >= 500:
+        self.record_failure()
+      else:
+        self.record_success()
+      raise
+    self.record_success()
+
+  async def _probe_until_available(self) -> None:
+    while self.down_since is not None:
+      await asyncio.sleep(self.backoff)
+      if await self._is_available():
+        self.record_success()
+      else:
+        self.backoff = min(self.backoff * 2, MAX_BACKOFF)
+
+  async def _is_available(self) -> bool:
+    try:
+      async with aiohttp_session.request("HEAD", self.base_url) as resp:
+        return resp.status < 500
+    except HOST_ERRORS:
+      logger.debug("%s is still unavailable", self.base_url, exc_info=True)
+      return False
+
+  def close(self) -> None:
+    """Stop probing the host, until the next request to it."""
+    if self._probe is not None:
+      self._probe.cancel()
+      self._probe = None
+
+
+_circuit_breakers: Dict[str, CircuitBreaker] = {}
+
+
+def get_circuit_breaker(url: str) -> CircuitBreaker:
+  """Return the circuit breaker of the host of url."""
+  parsed = urllib.parse.urlsplit(url)
+  base_url = f"{parsed.scheme}://{parsed.netloc}/"
+  circuit_breaker = _circuit_breakers.get(base_url)
+  if circuit_breaker is None:
+    circuit_breaker = _circuit_breakers[base_url] = CircuitBreaker(base_url)
+  return circuit_breaker
+
+
+def clear_circuit_breakers() -> None:
+  """Forget the availability of all hosts."""
+  for circuit_breaker in _circuit_breakers.values():
+    circuit_breaker.close()
+  _circuit_breakers.clear()
@@ -0,0 +1,445 @@
+"""Persistent cache of JSON HTTP responses.
+
+Responses are kept in memory and in a sqlite database in the cache directory,
+with their ``ETag`` and ``Last-Modified`` headers. Fresh responses are
+returned without network access. Stale responses are returned immediately and
+revalidated in the background with a conditional request, so that only the
+first request for an URL waits for the network. Concurrent requests for the
+same URL share one fetch.
+
+The database is shared by all the servers. Responses are written to it in
+batches, in one transaction every `FLUSH_DELAY` seconds, and the servers do
+not wait more than `BUSY_TIMEOUT` seconds for the database when another one
+writes it.
+"""
+
+import asyncio
+import atexit
+import datetime
+import json
+import logging
+import sqlite3
+import time
+import weakref
+from typing import Any, Callable, Dict, MutableMapping, NamedTuple, Optional, Tuple
+
+import aiohttp
+import cachetools
+
+from . import aiohttp_session, cache_dir, circuit_breaker, json_stream
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_VERSION = 1
+# seconds to wait for the database when it is written by another server
+BUSY_TIMEOUT = 0.1
+# seconds between the writes of the responses to the database
+FLUSH_DELAY = 1.0
+
+# errors when fetching or decoding a response
+FETCH_ERRORS = (aiohttp.ClientError, ValueError, asyncio.TimeoutError)
+# size of the chunks of responses parsed incrementally
+CHUNK_SIZE = 64 << 10
+
+
+class CachedResponse(NamedTuple):
+  data: Any
+  etag: Optional[str]
+  last_modified: Optional[str]
+  # time.time() when the response was fetched or last revalidated
+  fetched_at: float
+
+
+def _identity(data: Any) -> Any:
+  return data
+
+
+class _Fetch:
+  """A fetch shared by the concurrent requests for an url.
+
+  The fetch waits for the semaphores of all its requests and is started by
+  the first one acquired, so that a request with a semaphore available does
+  not wait behind a request whose semaphore is busy.
+  """
+
+  def __init__(self) -> None:
+    self.response: "asyncio.Future[CachedResponse]" = (
+      asyncio.get_running_loop().create_future()
+    )
+    # tasks waiting for the semaphores of the requests, by semaphore
+    self.tasks: Dict[Optional[asyncio.Semaphore], "asyncio.Task[None]"] = {}
+    self.started = False
+    # number of requests waiting for the response
+    self.waiters = 0
+
+  def cancel(self) -> None:
+    for task in self.tasks.values():
+      task.cancel()
+    self.response.cancel()
+
+
+class HTTPCache:
+  """A cache of JSON responses, persisted in ``{name}.sqlite``.
+
+  Responses younger than `max_age` seconds are fresh. Older responses are
+  still used for `stale_while_revalidate` seconds while they are revalidated
+  in the background, and when the network is not available.
+  """
+
+  def __init__(
+    self,
+    name: str,
+    max_age: float = datetime.timedelta(hours=2).total_seconds(),
+    stale_while_revalidate: float = datetime.timedelta(days=30).total_seconds(),
+    memory_size: int = 4 << 10,
+  ):
+    self._name = name
+    self.max_age = max_age
+    self.stale_while_revalidate = stale_while_revalidate
+    self._memory: MutableMapping[str, CachedResponse] = cachetools.LRUCache(memory_size)
+    self._database: Optional[str] = None
+    self._connection: Optional[sqlite3.Connection] = None
+    # responses not written to the database yet, by url, with whether their
+    # data changed, and the database they are written to
+    self._pending: Dict[str, Tuple[CachedResponse, bool]] = {}
+    self._pending_database: Optional[str] = None
+    # the event loop where the next flush is scheduled
+    self._flush_loop: Optional[asyncio.AbstractEventLoop] = None
+    _caches.add(self)
+    # fetches in progress, by url
+    self._fetches: Dict[str, _Fetch] = {}
+    # background revalidations, by url
+    self._revalidations: Dict[str, "asyncio.Future[None]"] = {}
+
+  def _get_database_path(self) -> str:
+    directory = cache_dir.get_cache_directory()
+    if directory is None:
+      return ":memory:"
+    return str(directory / f"{self._name}.sqlite")
+
+  def _connect(self, database: Optional[str] = None) -> sqlite3.Connection:
+    if database is None:
+      database = self._get_database_path()
+    if self._connection is not None and database != self._database:
+      self._connection.close()
+      self._connection = None
+    if self._connection is None:
+      try:
+        connection = sqlite3.connect(database, timeout=BUSY_TIMEOUT)
+        # readers do not block the writer of another server
+        connection.execute("PRAGMA journal_mode = WAL")
+        (user_version,) = connection.execute("PRAGMA user_version").fetchone()
+      except sqlite3.Error:
+        logger.warning("Could not open %s", database, exc_info=True)
+        connection = sqlite3.connect(":memory:")
+        user_version = 0
+      if user_version != SCHEMA_VERSION:
+        connection.executescript(
+          f"""
+          DROP TABLE IF EXISTS responses;
+          CREATE TABLE responses (
+            url TEXT PRIMARY KEY,
+            etag TEXT,
+            last_modified TEXT,
+            fetched_at REAL NOT NULL,
+            data TEXT NOT NULL
+          );
+          PRAGMA user_version = {SCHEMA_VERSION};
+          """
+        )
+      self._database = database
+      self._connection = connection
+    return self._connection
+
+  def close(self) -> None:
+    self.flush()
+    if self._connection is not None:
+      self._connection.close()
+      self._connection = None
+
+  def clear(self) -> None:
+    """Clear the cache, in memory and on disk."""
+    self._memory.clear()
+    self._pending.clear()
+    try:
+      connection = self._connect()
+      connection.execute("DELETE FROM responses")
+      connection.commit()
+    except sqlite3.Error:
+      logger.warning("Could not clear %s", self._name, exc_info=True)
+
+  def _load(self, url: str) -> Optional[CachedResponse]:
+    cached = self._memory.get(url)
+    if cached is not None:
+      return cached
+    pending = self._pending.get(url)
+    if pending is not None:
+      return pending[0]
+    try:
+      row = (
+        self._connect()
+        .execute(
+          "SELECT data, etag, last_modified, fetched_at FROM responses WHERE url = ?",
+          (url,),
+        )
+        .fetchone()
+      )
+    except sqlite3.Error:
+      logger.warning("Could not read %s from %s", url, self._name, exc_info=True)
+      return None
+    if row is None:
+      return None
+    data, etag, last_modified, fetched_at = row
+    cached = self._memory[url] = CachedResponse(
+      json.loads(data), etag, last_modified, fetched_at
+    )
+    return cached
+
+  def _store(self, url: str, cached: CachedResponse, data_changed: bool) -> None:
+    """Store a response in memory, it is written to the database with the
+    next flush.
+    """
+    self._memory[url] = cached
+    database = self._get_database_path()
+    if self._pending and database != self._pending_database:
+      # the cache directory changed
+      self.flush()
+    self._pending_database = database
+    if url in self._pending:
+      data_changed = data_changed or self._pending[url][1]
+    self._pending[url] = (cached, data_changed)
+    loop = asyncio.get_running_loop()
+    # a flush scheduled in another event loop, which can be closed, does not
+    # count
+    if self._flush_loop is not loop:
+      self._flush_loop = loop
+      loop.call_later(FLUSH_DELAY, self.flush)
+
+  def flush(self) -> None:
+    """Write the responses stored since the last flush to the database, in
+    one transaction.
+
+    If the database is locked by another server, the responses are written
+    with the next flush.
+    """
+    self._flush_loop = None
+    if not self._pending:
+      return
+    pending, self._pending = self._pending, {}
+    try:
+      connection = self._connect(self._pending_database)
+      with connection:
+        connection.executemany(
+          "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+          [
+            (
+              url,
+              cached.etag,
+              cached.last_modified,
+              cached.fetched_at,
+              json.dumps(cached.data, separators=(",", ":")),
+            )
+            for url, (cached, data_changed) in pending.items()
+            if data_changed
+          ],
+        )
+        connection.executemany(
+          "UPDATE responses SET fetched_at = ? WHERE url = ?",
+          [
+            (cached.fetched_at, url)
+            for url, (cached, data_changed) in pending.items()
+            if not data_changed
+          ],
+        )
+    except sqlite3.OperationalError:
+      logger.warning(
+        "Could not write %d responses to %s, will retry",
+        len(pending),
+        self._name,
+        exc_info=True,
+      )
+      # responses stored since are more recent
+      self._pending = {**pending, **self._pending}
+    except sqlite3.Error:
+      logger.warning(
+        "Could not write %d responses to %s", len(pending), self._name, exc_info=True
+      )
+
+  async def _fetch(
+    self,
+    url: str,
+    cached: Optional[CachedResponse],
+    transform: Callable[[Any], Any],
+    spec: Optional[json_stream.Spec],
+  ) -> CachedResponse:
+    """Fetch url, with a conditional request if there is a cached response."""
+    headers = {}
+    if cached is not None:
+      if cached.etag:
+        headers["If-None-Match"] = cached.etag
+      if cached.last_modified:
+        headers["If-Modified-Since"] = cached.last_modified
+    with circuit_breaker.get_circuit_breaker(url).guard():
+      async with aiohttp_session.request("GET", url, headers=headers) as resp:
+        if resp.status == 304 and cached is not None:
+          logger.debug("%s not modified", url)
+          cached = cached._replace(fetched_at=time.time())
+          self._store(url, cached, data_changed=False)
+          return cached
+        if resp.status >= 500:
+          resp.raise_for_status()
+        if spec is not None and resp.content_type == "application/json":
+          data = await json_stream.extract(resp.content.iter_chunked(CHUNK_SIZE), spec)
+        else:
+          data = await resp.json()
+      data = transform(data)
+      cached = CachedResponse(
+        data,
+        resp.headers.get("ETag"),
+        resp.headers.get("Last-Modified"),
+        time.time(),
+      )
+    self._store(url, cached, data_changed=True)
+    return cached
+
+  async def _fetch_with_semaphore(
+    self,
+    url: str,
+    fetch: _Fetch,
+    cached: Optional[CachedResponse],
+    transform: Callable[[Any], Any],
+    spec: Optional[json_stream.Spec],
+    semaphore: Optional[asyncio.Semaphore],
+  ) -> None:
+    """Start the shared fetch when semaphore is acquired, unless it was
+    started with the semaphore of another request.
+    """
+    if semaphore is not None:
+      await semaphore.acquire()
+    try:
+      if fetch.started:
+        return
+      fetch.started = True
+      # the tasks waiting for the other semaphores are not needed anymore
+      for task in fetch.tasks.values():
+        if task is not asyncio.current_task():
+          task.cancel()
+      try:
+        response = await self._fetch(url, cached, transform, spec)
+      except asyncio.CancelledError:
+        fetch.response.cancel()
+        raise
+      except Exception as e:
+        if not fetch.response.done():
+          fetch.response.set_exception(e)
+      else:
+        if not fetch.response.done():
+          fetch.response.set_result(response)
+    finally:
+      if semaphore is not None:
+        semaphore.release()
+
+  def _new_fetch(self, url: str) -> _Fetch:
+    fetch = _Fetch()
+
+    def forget(_: Any) -> None:
+      if self._fetches.get(url) is fetch:
+        del self._fetches[url]
+
+    fetch.response.add_done_callback(forget)
+    return fetch
+
+  async def _coalesced_fetch(
+    self,
+    url: str,
+    cached: Optional[CachedResponse],
+    transform: Callable[[Any], Any],
+    spec: Optional[json_stream.Spec],
+    semaphore: Optional[asyncio.Semaphore],
+  ) -> CachedResponse:
+    """Fetch url, or wait for the fetch of url already in progress."""
+    fetch = self._fetches.get(url)
+    if fetch is None or fetch.response.cancelled():
+      fetch = self._fetches[url] = self._new_fetch(url)
+    if not fetch.started and semaphore not in fetch.tasks:
+      fetch.tasks[semaphore] = asyncio.ensure_future(
+        self._fetch_with_semaphore(url, fetch, cached, transform, spec, semaphore)
+      )
+    fetch.waiters += 1
+    try:
+      # the fetch continues for the other requests if this one is cancelled
+      return await asyncio.shield(fetch.response)
+    except asyncio.CancelledError:
+      # and is cancelled with the last request waiting for it
+      if fetch.waiters == 1:
+        fetch.cancel()
+      raise
+    finally:
+      fetch.waiters -= 1
+
+  async def _revalidate(
+    self,
+    url: str,
+    cached: CachedResponse,
+    transform: Callable[[Any], Any],
+    spec: Optional[json_stream.Spec],
+    semaphore: Optional[asyncio.Semaphore],
+  ) -> None:
+    try:
+      await self._coalesced_fetch(url, cached, transform, spec, semaphore)
+    except FETCH_ERRORS:
+      logger.warning("Error revalidating %s", url, exc_info=True)
+    finally:
+      self._revalidations.pop(url, None)
+
+  async def get_json(
+    self,
+    url: str,
+    transform: Callable[[Any], Any] = _identity,
+    semaphore: Optional[asyncio.Semaphore] = None,
+    spec: Optional[json_stream.Spec] = None,
+  ) -> Any:
+    """Return the JSON response of url, transformed by `transform`.
+
+    The transformed response is cached, so `transform` can be used to keep
+    only the interesting parts of large responses. With `spec`, only the
+    parts selected by `spec` are extracted while the response is received,
+    see `json_stream`, before `transform`. Requests for the same url
+    must use the same `transform` and `spec`. `semaphore` limits the
+    concurrent requests. Raises one of `FETCH_ERRORS` when the response is not
+    cached and can not be fetched.
+    """
+    cached = self._load(url)
+    now = time.time()
+    if cached is not None:
+      age = now - cached.fetched_at
+      if age < self.max_age:
+        return cached.data
+      if age < self.max_age + self.stale_while_revalidate:
+        if url not in self._revalidations:
+          self._revalidations[url] = asyncio.ensure_future(
+            self._revalidate(url, cached, transform, spec, semaphore)
+          )
+        return cached.data
+    try:
+      return (await self._coalesced_fetch(url, cached, transform, spec, semaphore)).data
+    except FETCH_ERRORS:
+      if cached is None:
+        raise
+      logger.warning("Error fetching %s, using cached response", url, exc_info=True)
+      return cached.data
+
+  async def wait_for_revalidations(self) -> None:
+    """Wait for the background revalidations to finish."""
+    while self._revalidations:
+      await asyncio.gather(*self._revalidations.values(), return_exceptions=True)
+
+
+_caches: "weakref.WeakSet[HTTPCache]" = weakref.WeakSet()
+
+
+@atexit.register
+def flush_caches() -> None:
+  """Write the responses of all caches to their database."""
+  for cache in list(_caches):
+    cache.flush()
@@ -0,0 +1,185 @@
+"""Incremental extraction of parts of large JSON documents.
+
+`extract` reads a JSON document from chunks of bytes, as they are received,
+and keeps only the values selected by a spec:
+
+- `Select.VALUE` keeps the value.
+- `Select.KEYS` keeps the list of the keys of an object, without their values.
+- A mapping keeps, from an object, the keys of the mapping, with their
+  values extracted by the spec of the key. The other keys are skipped.
+- `EachValue` keeps all the keys of an object, with their values extracted
+  by the spec of `EachValue`.
+- A function keeps its result, called with the value.
+
+For example, ``{"info": {"version": Select.VALUE}, "releases": Select.KEYS}``
+extracts from the JSON of a project on PyPI the latest version and the list
+of releases, without building the files of all releases.
+
+Values are decoded with `json.JSONDecoder.raw_decode` once the buffer
+contains them, so skipped values only exist in memory one at a time.
+"""
+
+import codecs
+import enum
+import json
+import re
+from typing import (
+  Any,
+  AsyncIterable,
+  AsyncIterator,
+  Callable,
+  List,
+  Mapping,
+  NamedTuple,
+  Union,
+)
+
+
+class Select(enum.Enum):
+  # keep the value
+  VALUE = "value"
+  # keep the list of the keys of an object
+  KEYS = "keys"
+
+
+class EachValue(NamedTuple):
+  spec: "Spec"
+
+
+Spec = Union[Select, EachValue, Mapping[str, Any], Callable[[Any], Any]]
+
+_whitespace_re = re.compile(r"[ \t\n\r]*")
+# characters continuing a number
+_number_characters = frozenset("0123456789.eE+-")
+_decoder = json.JSONDecoder()
+
+
+class _Reader:
+  def __init__(self, chunks: AsyncIterable[bytes]):
+    self._chunks = chunks.__aiter__()
+    self._decoder = codecs.getincrementaldecoder("utf-8")()
+    self._text = ""
+    self._pos = 0
+    self._eof = False
+
+  async def _fill(self, size: int = 0) -> None:
+    """Read chunks until at least size characters are after the position.
+
+    Raises ValueError at the end of the document.
+    """
+    if self._eof:
+      raise ValueError("Unexpected end of JSON document")
+    texts = [self._text[self._pos :]]
+    length = len(texts[0])
+    while not self._eof and (length < size or len(texts) == 1):
+      try:
+        chunk = await self._chunks.__anext__()
+      except StopAsyncIteration:
+        self._eof = True
+        texts.append(self._decoder.decode(b"", final=True))
+      else:
+        texts.append(self._decoder.decode(chunk))
+      length += len(texts[-1])
+    self._text = "".join(texts)
+    self._pos = 0
+
+  async def peek(self) -> str:
+    """Skip whitespace and return the next character."""
+    while True:
+      match = _whitespace_re.match(self._text, self._pos)
+      assert match
+      self._pos = match.end()
+      if self._pos < len(self._text):
+        return self._text[self._pos]
+      await self._fill()
+
+  async def expect(self, character: str) -> None:
+    if await self.peek() != character:
+      raise ValueError(f"Expected {character!r} in JSON document")
+    self._pos += 1
+
+  async def at_end(self) -> bool:
+    """Return True if there are only whitespace left in the document."""
+    try:
+      await self.peek()
+    except ValueError:
+      return True
+    return False
+
+  async def read_value(self) -> Any:
+    await self.peek()
+    while True:
+      try:
+        value, end = _decoder.raw_decode(self._text, self._pos)
+      except json.JSONDecodeError:
+        if self._eof:
+          raise
+      else:
+        # a number could continue in the next chunk
+        if self._eof or (
+          end < len(self._text) and self._text[end] not in _number_characters
+        ):
+          self._pos = end
+          return value
+      # the value is not complete, read at least as much again
+      await self._fill(2 * (len(self._text) - self._pos))
+
+  async def iter_object(self) -> AsyncIterator[str]:
+    """Iterate on the keys of an object. The value of each key must be read
+    before the next iteration.
+    """
+    await self.expect("{")
+    if await self.peek() == "}":
+      self._pos += 1
+      return
+    while True:
+      if await self.peek() != '"':
+        raise ValueError("Expected a key in JSON document")
+      key = await self.read_value()
+      await self.expect(":")
+      yield key
+      character = await self.peek()
+      self._pos += 1
+      if character == "}":
+        return
+      if character != ",":
+        raise ValueError("Expected ',' or '}' in JSON document")
+
+
+async def _extract(reader: _Reader, spec: Spec) -> Any:
+  if spec is Select.VALUE:
+    return await reader.read_value()
+  if spec is Select.KEYS:
+    keys: List[str] = []
+    async for key in reader.iter_object():
+      keys.append(key)
+      await reader.read_value()
+    return keys
+  if isinstance(spec, EachValue):
+    values = {}
+    async for key in reader.iter_object():
+      values[key] = await _extract(reader, spec.spec)
+    return values
+  if callable(spec):
+    return spec(await reader.read_value())
+  extracted = {}
+  async for key in reader.iter_object():
+    if key in spec:
+      extracted[key] = await _extract(reader, spec[key])
+    else:
+      await reader.read_value()
+  return extracted
+
+
+async def extract(chunks: AsyncIterable[bytes], spec: Spec) -> Any:
+  """Extract the values selected by spec from the UTF-8 JSON document in
+  chunks.
+
+  Raises ValueError if the document is not valid JSON or does not have the
+  structure of spec.
+  """
+  reader = _Reader(chunks)
+  extracted = await _extract(reader, spec)
+  if not await reader.at_end():
+    raise ValueError("Extra data after JSON document")
+  return extracted
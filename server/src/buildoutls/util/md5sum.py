@@ -44,7 +44,9 @@ async def update_md5sum(
   start = time.time()
   m = hashlib.md5()
 
-  async with aiohttp_session.get_session().get(url) as resp:
+  async with aiohttp_session.request(
+    "GET", url, aiohttp_session.Lane.INTERACTIVE
+  ) as resp:
     if not resp.ok:
       ls.window_show_message(
         ShowMessageParams(
@@ -0,0 +1,260 @@
+"""Known vulnerabilities from an OSV compatible vulnerability database.
+
+All the pinned versions of a profile are looked up together with the
+``querybatch`` endpoint, in batches of up to `BATCH_SIZE` queries, instead
+of one request for each pin. ``querybatch`` only returns the identifiers of
+the vulnerabilities, their details are fetched once for each vulnerability
+and kept in the persistent HTTP cache.
+
+https://google.github.io/osv.dev/post-v1-querybatch/
+
+A local copy of an OSV database can be used instead, see `osv_database`.
+"""
+
+import asyncio
+import datetime
+import logging
+from typing import (
+  TYPE_CHECKING,
+  Any,
+  Dict,
+  List,
+  MutableMapping,
+  Optional,
+  Sequence,
+  Set,
+  Tuple,
+  Union,
+)
+
+import cachetools
+import packaging.utils
+
+from . import aiohttp_session, circuit_breaker, http_cache
+from ..types import KnownVulnerability
+
+if TYPE_CHECKING:
+  from .osv_database import OSVDatabase
+
+logger = logging.getLogger(__name__)
+
+# maximum number of queries in a querybatch request
+BATCH_SIZE = 1000
+
+# type aliases
+Project = str
+VersionStr = str
+ProjectAndVersionStr = Tuple[Project, VersionStr]
+
+_url: Optional[str] = None
+_database_path: Optional[str] = None
+_client: Optional[Union["OSVClient", "OSVDatabase"]] = None
+
+
+def set_osv_url(url: Optional[str]) -> None:
+  """Use the OSV database at url for known vulnerabilities, or the package
+  index if url is empty.
+  """
+  global _url, _client
+  _url = url or None
+  _client = None
+
+
+def set_osv_database(path: Optional[str]) -> None:
+  """Use the local copy of an OSV database at path for known vulnerabilities,
+  instead of the OSV database at the url set by `set_osv_url`.
+  """
+  global _database_path, _client
+  if _client is not None:
+    _client.close()
+  _database_path = path or None
+  _client = None
+
+
+def get_osv_client() -> Optional[Union["OSVClient", "OSVDatabase"]]:
+  """Return the client of the configured OSV database, None if no OSV
+  database is configured.
+  """
+  global _client
+  if _client is None:
+    if _database_path is not None:
+      from .osv_database import OSVDatabase
+
+      _client = OSVDatabase(_database_path)
+    elif _url is not None:
+      _client = OSVClient(_url)
+  return _client
+
+
+def _get_vulnerability_metadata(vulnerability: Any) -> Any:
+  """Keep only the details of a vulnerability and the versions fixing it,
+  by canonical project name.
+  """
+  fixed_in: Dict[str, List[str]] = {}
+  for affected in vulnerability.get("affected", ()):
+    package = affected.get("package", {})
+    if package.get("ecosystem") != "PyPI":
+      continue
+    fixed_in.setdefault(
+      packaging.utils.canonicalize_name(package.get("name", "")), []
+    ).extend(
+      event["fixed"]
+      for affected_range in affected.get("ranges", ())
+      if affected_range.get("type") == "ECOSYSTEM"
+      for event in affected_range.get("events", ())
+      if "fixed" in event
+    )
+  link = f"https://osv.dev/vulnerability/{vulnerability['id']}"
+  for reference in vulnerability.get("references", ()):
+    if reference.get("type") == "ADVISORY":
+      link = reference["url"]
+      break
+  return {
+    "id": vulnerability["id"],
+    "aliases": vulnerability.get("aliases", []),
+    "details": vulnerability.get("details") or vulnerability.get("summary", ""),
+    "link": link,
+    "fixed_in": fixed_in,
+  }
+
+
+class OSVClient:
+  def __init__(self, url: str = "https://api.osv.dev", batch_size: int = BATCH_SIZE):
+    self._url = url.rstrip("/")
+    self._batch_size = batch_size
+    # vulnerabilities identifiers of pins
+    self._pins_cache: MutableMapping[ProjectAndVersionStr, Tuple[str, ...]] = (
+      cachetools.TTLCache(
+        maxsize=8 << 10,
+        ttl=datetime.timedelta(hours=2).total_seconds(),
+      )
+    )
+    self.cache = http_cache.HTTPCache("osv")
+
+  def close(self) -> None:
+    self.cache.close()
+
+  async def _query_batch(
+    self,
+    pins: Sequence[ProjectAndVersionStr],
+    page_tokens: Dict[ProjectAndVersionStr, str],
+    semaphore: asyncio.Semaphore,
+  ) -> List[Any]:
+    queries = []
+    for project, version in pins:
+      query: Dict[str, Any] = {
+        "package": {"name": project, "ecosystem": "PyPI"},
+        "version": version,
+      }
+      if (project, version) in page_tokens:
+        query["page_token"] = page_tokens[project, version]
+      queries.append(query)
+    url = f"{self._url}/v1/querybatch"
+    async with semaphore:
+      with circuit_breaker.get_circuit_breaker(url).guard():
+        async with aiohttp_session.request(
+          "POST",
+          url,
+          json={"queries": queries},
+        ) as resp:
+          resp.raise_for_status()
+          results = (await resp.json()).get("results")
+    if not isinstance(results, list) or len(results) != len(pins):
+      raise ValueError(f"Expected {len(pins)} results, got {results!r:.100}")
+    return results
+
+  async def _get_vulnerability_ids(
+    self,
+    pins: Sequence[ProjectAndVersionStr],
+    semaphore: asyncio.Semaphore,
+  ) -> Dict[ProjectAndVersionStr, Tuple[str, ...]]:
+    """Query the identifiers of the vulnerabilities of pins, following the
+    next pages of results.
+    """
+    vulnerability_ids: Dict[ProjectAndVersionStr, List[str]] = {pin: [] for pin in pins}
+    page_tokens: Dict[ProjectAndVersionStr, str] = {}
+    while pins:
+      batches = [
+        pins[i : i + self._batch_size] for i in range(0, len(pins), self._batch_size)
+      ]
+      next_page_tokens: Dict[ProjectAndVersionStr, str] = {}
+      for batch, results in zip(
+        batches,
+        await asyncio.gather(
+          *[self._query_batch(batch, page_tokens, semaphore) for batch in batches]
+        ),
+      ):
+        for pin, result in zip(batch, results):
+          vulnerability_ids[pin].extend(v["id"] for v in result.get("vulns", ()))
+          if result.get("next_page_token"):
+            next_page_tokens[pin] = result["next_page_token"]
+      pins = list(next_page_tokens)
+      page_tokens = next_page_tokens
+    return {pin: tuple(ids) for pin, ids in vulnerability_ids.items()}
+
+  async def get_known_vulnerabilities(
+    self,
+    pins: Sequence[ProjectAndVersionStr],
+    semaphore: asyncio.Semaphore,
+  ) -> Dict[ProjectAndVersionStr, Tuple[KnownVulnerability, ...]]:
+    """Return the known vulnerabilities of the pinned versions of projects.
+
+    Pins that could not be looked up are not in the result.
+    """
+    vulnerability_ids: Dict[ProjectAndVersionStr, Tuple[str, ...]] = {}
+    missing_pins = []
+    for pin in dict.fromkeys(pins):
+      try:
+        vulnerability_ids[pin] = self._pins_cache[pin]
+      except KeyError:
+        missing_pins.append(pin)
+    if missing_pins:
+      try:
+        queried_ids = await self._get_vulnerability_ids(missing_pins, semaphore)
+      except http_cache.FETCH_ERRORS:
+        logger.warning(
+          "Error querying %s for %d pins",
+          self._url,
+          len(missing_pins),
+          exc_info=True,
+        )
+      else:
+        vulnerability_ids.update(queried_ids)
+        self._pins_cache.update(queried_ids)
+
+    unique_ids: Set[str] = set()
+    for ids in vulnerability_ids.values():
+      unique_ids.update(ids)
+    vulnerabilities: Dict[str, Any] = {}
+
+    async def get_vulnerability(vulnerability_id: str) -> None:
+      try:
+        # https://google.github.io/osv.dev/get-v1-vulns/
+        vulnerabilities[vulnerability_id] = await self.cache.get_json(
+          f"{self._url}/v1/vulns/{vulnerability_id}",
+          _get_vulnerability_metadata,
+          semaphore,
+        )
+      except http_cache.FETCH_ERRORS:
+        logger.warning(
+          "Error fetching vulnerability %s", vulnerability_id, exc_info=True
+        )
+
+    await asyncio.gather(*[get_vulnerability(i) for i in sorted(unique_ids)])
+
+    known_vulnerabilities = {}
+    for (project, version), ids in vulnerability_ids.items():
+      canonical_name = packaging.utils.canonicalize_name(project)
+      known_vulnerabilities[project, version] = tuple(
+        KnownVulnerability(
+          aliases=vulnerability["aliases"],
+          details=vulnerability["details"],
+          fixed_in=vulnerability["fixed_in"].get(canonical_name, []),
+          id=vulnerability["id"],
+          link=vulnerability["link"],
+          source="osv",
+        )
+        for vulnerability in (vulnerabilities.get(i) for i in ids)
+        if vulnerability is not None
+      )
+    return known_vulnerabilities
@@ -0,0 +1,386 @@
+"""Known vulnerabilities from a local copy of an OSV database.
+
+The database is a directory or a zip file of vulnerabilities in the OSV
+JSON format, like https://osv-vulnerabilities.storage.googleapis.com/PyPI/all.zip
+so that known vulnerabilities are found without network access.
+
+Reading thousands of JSON files is too slow for each start of the language
+server, so the vulnerabilities are indexed once, in a file of the cache
+directory which is memory mapped. The index starts with a table of the
+offsets of the vulnerabilities of each project, followed by the
+vulnerabilities of each project, with their ranges of affected versions
+already converted to intervals of normalized versions. The vulnerabilities
+of a project are only decoded when the project is looked up. The index is
+built again when the files of the database change.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import mmap
+import os
+import pathlib
+import struct
+import tempfile
+import zipfile
+from typing import (
+  Any,
+  Dict,
+  FrozenSet,
+  Iterable,
+  Iterator,
+  List,
+  MutableMapping,
+  NamedTuple,
+  Optional,
+  Sequence,
+  Tuple,
+  Union,
+)
+
+import cachetools
+import packaging.utils
+import packaging.version
+
+from . import cache_dir, osv
+from ..types import KnownVulnerability
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"buildoutls osv index 1\n"
+# errors reading the database or the index, a damaged index can have a
+# truncated header or a header without some keys
+LOAD_ERRORS = (
+  OSError,
+  ValueError,
+  zipfile.BadZipFile,
+  struct.error,
+  KeyError,
+  TypeError,
+)
+
+# type aliases
+Project = str
+VersionStr = str
+ProjectAndVersionStr = Tuple[Project, VersionStr]
+# introduced, fixed and last affected versions, None when unbounded
+Interval = Tuple[
+  Optional[packaging.version.Version],
+  Optional[packaging.version.Version],
+  Optional[packaging.version.Version],
+]
+
+
+class AffectedVersions(NamedTuple):
+  vulnerability: KnownVulnerability
+  intervals: Tuple[Interval, ...]
+  # canonical affected versions
+  versions: FrozenSet[str]
+
+  def affects(
+    self,
+    canonical_version: str,
+    parsed_version: Optional[packaging.version.Version],
+  ) -> bool:
+    if canonical_version in self.versions:
+      return True
+    if parsed_version is None:
+      return False
+    return any(
+      (introduced is None or introduced <= parsed_version)
+      and (fixed is None or parsed_version < fixed)
+      and (last_affected is None or parsed_version <= last_affected)
+      for introduced, fixed, last_affected in self.intervals
+    )
+
+
+def _normalize_version(version: str) -> Optional[str]:
+  try:
+    return str(packaging.version.Version(version))
+  except packaging.version.InvalidVersion:
+    return None
+
+
+def _get_intervals(events: Sequence[Any]) -> List[List[Optional[str]]]:
+  """Convert the events of an OSV range to intervals of affected versions.
+
+  https://ossf.github.io/osv-schema/#evaluation
+  """
+  parsed_events: List[Tuple[Tuple[Any, ...], str, Optional[str]]] = []
+  for event in events:
+    for kind in ("introduced", "fixed", "last_affected"):
+      if kind in event:
+        if kind == "introduced" and event[kind] == "0":
+          parsed_events.append(((0,), kind, None))
+          continue
+        normalized = _normalize_version(event[kind])
+        if normalized is None:
+          # the range can not be evaluated, only the explicit versions are used
+          return []
+        parsed_events.append(
+          ((1, packaging.version.Version(normalized)), kind, normalized)
+        )
+  intervals: List[List[Optional[str]]] = []
+  current: Optional[List[Optional[str]]] = None
+  for _, kind, version in sorted(parsed_events, key=lambda event: event[0]):
+    if kind == "introduced":
+      if current is None:
+        current = [version, None, None]
+    elif current is not None:
+      current[1 if kind == "fixed" else 2] = version
+      intervals.append(current)
+      current = None
+  if current is not None:
+    intervals.append(current)
+  return intervals
+
+
+def _parse_interval(
+  introduced: Optional[str],
+  fixed: Optional[str],
+  last_affected: Optional[str],
+) -> Interval:
+  return (
+    None if introduced is None else packaging.version.Version(introduced),
+    None if fixed is None else packaging.version.Version(fixed),
+    None if last_affected is None else packaging.version.Version(last_affected),
+  )
+
+
+def _iter_documents(source: pathlib.Path) -> Iterator[Any]:
+  if source.is_dir():
+    for path in sorted(source.rglob("*.json")):
+      with open(path, "rb") as f:
+        yield json.load(f)
+  else:
+    with zipfile.ZipFile(source) as zf:
+      for name in sorted(zf.namelist()):
+        if name.endswith(".json"):
+          yield json.loads(zf.read(name))
+
+
+def _get_fingerprint(source: pathlib.Path) -> str:
+  """A digest of the paths, sizes and modification times of the files of
+  the database.
+  """
+  digest = hashlib.sha256(str(source.resolve()).encode())
+  paths = sorted(source.rglob("*.json")) if source.is_dir() else [source]
+  for path in paths:
+    stat = path.stat()
+    digest.update(f"\0{path}\0{stat.st_size}\0{stat.st_mtime_ns}".encode())
+  return digest.hexdigest()
+
+
+def build_index(documents: Iterable[Any], fingerprint: str = "") -> bytes:
+  """Build the index of the OSV vulnerabilities documents."""
+  affected_by_project: Dict[str, List[Any]] = {}
+  for document in documents:
+    if not isinstance(document, dict) or "id" not in document:
+      continue
+    if document.get("withdrawn"):
+      continue
+    metadata = osv._get_vulnerability_metadata(document)
+    affected_in_document: Dict[str, Any] = {}
+    for affected in document.get("affected", ()):
+      package = affected.get("package", {})
+      if package.get("ecosystem") != "PyPI":
+        continue
+      project: str = packaging.utils.canonicalize_name(package.get("name", ""))
+      entry = affected_in_document.setdefault(
+        project,
+        [
+          metadata["id"],
+          metadata["aliases"],
+          metadata["details"],
+          metadata["link"],
+          metadata["fixed_in"].get(project, []),
+          [],
+          [],
+        ],
+      )
+      for affected_range in affected.get("ranges", ()):
+        if affected_range.get("type") == "ECOSYSTEM":
+          entry[5].extend(_get_intervals(affected_range.get("events", ())))
+      entry[6].extend(
+        packaging.utils.canonicalize_version(version)
+        for version in affected.get("versions", ())
+      )
+    for project, entry in affected_in_document.items():
+      affected_by_project.setdefault(project, []).append(entry)
+
+  projects: Dict[str, Tuple[int, int]] = {}
+  records = []
+  offset = 0
+  for project, entries in sorted(affected_by_project.items()):
+    record = json.dumps(entries, separators=(",", ":")).encode()
+    projects[project] = (offset, len(record))
+    records.append(record)
+    offset += len(record)
+  header = json.dumps(
+    {"fingerprint": fingerprint, "projects": projects}, separators=(",", ":")
+  ).encode()
+  return b"".join([MAGIC, struct.pack(">Q", len(header)), header, *records])
+
+
+class OSVIndex:
+  """Read access to an index built by `build_index`."""
+
+  def __init__(self, buffer: Union[bytes, mmap.mmap]):
+    if buffer[: len(MAGIC)] != MAGIC:
+      raise ValueError("Not an OSV index")
+    (header_length,) = struct.unpack_from(">Q", buffer, len(MAGIC))
+    header_start = len(MAGIC) + struct.calcsize(">Q")
+    self._records_start = header_start + header_length
+    header = json.loads(buffer[header_start : self._records_start])
+    self.fingerprint: str = header["fingerprint"]
+    self._projects: Dict[str, List[int]] = header["projects"]
+    self._buffer = buffer
+    self._affected_versions: MutableMapping[str, Tuple[AffectedVersions, ...]] = (
+      cachetools.LRUCache(maxsize=4 << 10)
+    )
+
+  def close(self) -> None:
+    if isinstance(self._buffer, mmap.mmap):
+      self._buffer.close()
+
+  def _get_affected_versions(self, project: str) -> Tuple[AffectedVersions, ...]:
+    try:
+      return self._affected_versions[project]
+    except KeyError:
+      pass
+    affected_versions: Tuple[AffectedVersions, ...] = ()
+    if project in self._projects:
+      offset, length = self._projects[project]
+      start = self._records_start + offset
+      affected_versions = tuple(
+        AffectedVersions(
+          vulnerability=KnownVulnerability(
+            id=id_,
+            aliases=aliases,
+            details=details,
+            link=link,
+            fixed_in=fixed_in,
+            source="osv",
+          ),
+          intervals=tuple(_parse_interval(*interval) for interval in intervals),
+          versions=frozenset(versions),
+        )
+        for id_, aliases, details, link, fixed_in, intervals, versions in json.loads(
+          self._buffer[start : start + length]
+        )
+      )
+    self._affected_versions[project] = affected_versions
+    return affected_versions
+
+  def get_known_vulnerabilities(
+    self,
+    project: Project,
+    version: VersionStr,
+  ) -> Tuple[KnownVulnerability, ...]:
+    affected_versions = self._get_affected_versions(
+      packaging.utils.canonicalize_name(project)
+    )
+    if not affected_versions:
+      return ()
+    parsed_version: Optional[packaging.version.Version] = None
+    try:
+      parsed_version = packaging.version.Version(version)
+    except packaging.version.InvalidVersion:
+      pass
+    canonical_version = packaging.utils.canonicalize_version(version)
+    return tuple(
+      affected.vulnerability
+      for affected in affected_versions
+      if affected.affects(canonical_version, parsed_version)
+    )
+
+
+class OSVDatabase:
+  """Known vulnerabilities from the OSV database at path."""
+
+  def __init__(self, path: str):
+    self._source = pathlib.Path(path)
+    self._index: Optional[OSVIndex] = None
+    self._loading: Optional["asyncio.Future[None]"] = None
+
+  def _get_index_path(self) -> Optional[pathlib.Path]:
+    cache_directory = cache_dir.get_cache_directory()
+    if cache_directory is None:
+      return None
+    key = hashlib.sha256(str(self._source.resolve()).encode()).hexdigest()[:16]
+    return cache_directory / f"osv-index-{key}.idx"
+
+  def _open_index(self, index_path: pathlib.Path, fingerprint: str) -> OSVIndex:
+    """Memory map the index at index_path, building it first if it does not
+    exist or if it was built from other files.
+    """
+    try:
+      with open(index_path, "rb") as f:
+        index = OSVIndex(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+      if index.fingerprint == fingerprint:
+        return index
+      index.close()
+    except FileNotFoundError:
+      pass
+    except LOAD_ERRORS:
+      logger.warning("Invalid OSV index %s", index_path, exc_info=True)
+    logger.info("Building OSV index of %s", self._source)
+    fd, tmp_path = tempfile.mkstemp(dir=index_path.parent, suffix=".tmp")
+    try:
+      with os.fdopen(fd, "wb") as f:
+        f.write(build_index(_iter_documents(self._source), fingerprint))
+      os.replace(tmp_path, index_path)
+    except BaseException:
+      os.unlink(tmp_path)
+      raise
+    with open(index_path, "rb") as f:
+      return OSVIndex(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+  def load(self) -> None:
+    """Load the index of the database."""
+    index_path = self._get_index_path()
+    try:
+      fingerprint = _get_fingerprint(self._source)
+      if index_path is None:
+        index = OSVIndex(build_index(_iter_documents(self._source), fingerprint))
+      else:
+        index = self._open_index(index_path, fingerprint)
+    except LOAD_ERRORS:
+      logger.warning("Error loading OSV database %s", self._source, exc_info=True)
+      index = OSVIndex(build_index(()))
+    if self._index is not None:
+      self._index.close()
+    self._index = index
+
+  def close(self) -> None:
+    """Close the index, it is loaded again on next use."""
+    if self._index is not None:
+      self._index.close()
+      self._index = None
+    self._loading = None
+
+  async def get_known_vulnerabilities(
+    self,
+    pins: Sequence[ProjectAndVersionStr],
+    semaphore: asyncio.Semaphore,
+  ) -> Dict[ProjectAndVersionStr, Tuple[KnownVulnerability, ...]]:
+    """Return the known vulnerabilities of the pinned versions of projects.
+
+    The database is loaded in a thread on the first call, and loaded again
+    on the next call if loading failed.
+    """
+    while self._index is None:
+      if self._loading is None:
+        self._loading = asyncio.get_running_loop().run_in_executor(None, self.load)
+      loading = self._loading
+      try:
+        await asyncio.shield(loading)
+      finally:
+        if loading.done() and self._loading is loading:
+          self._loading = None
+    index = self._index
+    return {
+      (project, version): index.get_known_vulnerabilities(project, version)
+      for project, version in pins
+    }
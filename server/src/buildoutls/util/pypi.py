@@ -1,14 +1,13 @@
 import asyncio
-import datetime
+import functools
 import logging
-from typing import AsyncIterable, Dict, Optional, Tuple, cast
+from typing import Any, Iterable, List, MutableMapping, Optional, Sequence, Tuple
 
-import aiohttp
 import cachetools
 import packaging.version
-import pkg_resources
 
-from . import aiohttp_session
+from . import http_cache
+from .json_stream import EachValue, Select
 from ..types import KnownVulnerability, VersionNotFound, ProjectNotFound
 import cattrs
 
@@ -23,123 +22,328 @@ ProjectAndVersionStr = Tuple[Project, VersionStr]
 OptionalVersion = Optional[packaging.version.Version]
 
 
+def _is_yanked(files: Any) -> bool:
+  """Is a release yanked, from the list of its files."""
+  return bool(files) and all(f.get("yanked") for f in files)
+
+
+# parts of the project and release metadata extracted from the responses,
+# which can be several megabytes for projects with many releases.
+PROJECT_SPEC = {
+  "info": {"version": Select.VALUE},
+  "releases": EachValue(_is_yanked),
+  "vulnerabilities": Select.VALUE,
+}
+RELEASE_SPEC = {"info": {}, "vulnerabilities": Select.VALUE}
+
+
+@functools.lru_cache(maxsize=16 << 10)
+def parse_version(version: str) -> packaging.version.Version:
+  """Parse version, memoized because diagnostics parse the same pins and
+  versions of releases again and again.
+  """
+  return packaging.version.Version(version)
+
+
+def _sort_releases(releases: Iterable[str]) -> List[str]:
+  """The releases which are valid versions, sorted by version."""
+  parsed_releases = []
+  for release in releases:
+    try:
+      parsed_releases.append((packaging.version.Version(release), release))
+    except packaging.version.InvalidVersion:
+      pass
+  parsed_releases.sort(key=lambda parsed_release: parsed_release[0])
+  return [release for _, release in parsed_releases]
+
+
+def _get_project_metadata(project_data: Any) -> Any:
+  """Keep only the latest version, the list of releases, also sorted by
+  version, the yanked releases and the vulnerabilities of the latest version
+  of a project.
+  """
+  if "info" not in project_data:
+    return {}
+  return {
+    "info": {"version": project_data["info"]["version"]},
+    "releases": list(project_data["releases"]),
+    "sorted_releases": _sort_releases(project_data["releases"]),
+    "yanked": [
+      release for release, yanked in project_data["releases"].items() if yanked
+    ],
+    "vulnerabilities": project_data.get("vulnerabilities", []),
+  }
+
+
+def _get_release_metadata(release_data: Any) -> Any:
+  """Keep only the vulnerabilities of a release."""
+  if "info" not in release_data:
+    return {}
+  return {"info": {}, "vulnerabilities": release_data.get("vulnerabilities", [])}
+
+
+class ReleaseIndex:
+  """The releases of a project, sorted by version.
+
+  The releases are sorted once, when the metadata of the project is fetched,
+  and found by binary search, so that only a few versions of releases are
+  parsed for each lookup. Releases which are not valid versions can only be
+  found by their name.
+  """
+
+  def __init__(
+    self,
+    latest_version: str,
+    releases: Iterable[str],
+    sorted_releases: Optional[Sequence[str]] = None,
+    yanked: Iterable[str] = (),
+  ):
+    self.latest_version = parse_version(latest_version)
+    self.releases = frozenset(releases)
+    if sorted_releases is None:
+      sorted_releases = _sort_releases(self.releases)
+    self.sorted_releases = sorted_releases
+    self.yanked = frozenset(yanked)
+
+  def _bisect(self, version: packaging.version.Version, right: bool = False) -> int:
+    """Index where version would be inserted in the sorted releases, after
+    the equivalent releases if `right`.
+    """
+    low, high = 0, len(self.sorted_releases)
+    while low < high:
+      middle = (low + high) // 2
+      middle_version = parse_version(self.sorted_releases[middle])
+      if middle_version < version or (right and middle_version == version):
+        low = middle + 1
+      else:
+        high = middle
+    return low
+
+  def find_release(self, version: str) -> Optional[str]:
+    """Return the release equivalent to `version`, None if there is no such
+    release.
+    """
+    if version in self.releases:
+      return version
+    try:
+      parsed_version = parse_version(version)
+    except packaging.version.InvalidVersion:
+      return version
+    index = self._bisect(parsed_version)
+    if (
+      index < len(self.sorted_releases)
+      and parse_version(self.sorted_releases[index]) == parsed_version
+    ):
+      return self.sorted_releases[index]
+    return None
+
+  def is_yanked(self, release: str) -> bool:
+    return release in self.yanked
+
+  def is_prerelease(self, release: str) -> bool:
+    return parse_version(release).is_prerelease
+
+  def get_latest_version(self, version: str) -> OptionalVersion:
+    """The latest version of the project if it is newer than `version`."""
+    current = parse_version(version if version in self.releases else "0")
+    if self.latest_version > current:
+      return self.latest_version
+    return None
+
+  def get_latest_version_in_series(self, version: str) -> OptionalVersion:
+    """The latest release with the same major version as `version`, if it is
+    newer than `version`.
+
+    Yanked releases are skipped, so are pre-releases unless `version` is a
+    pre-release.
+    """
+    try:
+      current = parse_version(version)
+    except packaging.version.InvalidVersion:
+      return None
+    next_major = packaging.version.Version(f"{current.epoch}!{current.major + 1}.dev0")
+    for release in reversed(
+      self.sorted_releases[self._bisect(current, right=True) : self._bisect(next_major)]
+    ):
+      if self.is_prerelease(release) and not current.is_prerelease:
+        continue
+      if self.is_yanked(release):
+        continue
+      return parse_version(release)
+    return None
+
+
 class PyPIClient:
-  def __init__(self, package_index_url: str = "https://pypi.org"):
+  """Client for the JSON API of a package index.
+
+  With `use_project_metadata`, the known vulnerabilities of a release are
+  derived from the metadata of the project, also used for the latest version,
+  when the release is the latest release or does not exist. Only the other
+  releases need another request.
+  """
+
+  def __init__(
+    self,
+    package_index_url: str = "https://pypi.org",
+    use_project_metadata: bool = True,
+  ):
     self._package_index_url = package_index_url
-    self.__get_latest_version_cache = cast(
-      Dict[ProjectAndVersionStr, OptionalVersion],
-      cachetools.TTLCache(
-        maxsize=2 << 10,
-        ttl=datetime.timedelta(hours=2).total_seconds(),
-      ),
+    self._use_project_metadata = use_project_metadata
+    # project and release metadata, persisted in the cache directory and
+    # refreshed in the background when stale.
+    self.cache = http_cache.HTTPCache("pypi")
+    # release index of projects, with the project metadata they were built from
+    self._release_indexes: MutableMapping[Project, Tuple[Any, ReleaseIndex]] = (
+      cachetools.LRUCache(maxsize=4 << 10)
     )
-    self.__get_known_vulnerabilities_cache = cast(
-      Dict[ProjectAndVersionStr, Tuple[KnownVulnerability, ...]],
-      cachetools.TTLCache(
-        maxsize=2 << 10,
-        ttl=datetime.timedelta(hours=2).total_seconds(),
-      ),
+
+  async def _get_project(self, project: str, semaphore: asyncio.Semaphore) -> Any:
+    # https://warehouse.pypa.io/api-reference/json.html#project
+    return await self.cache.get_json(
+      f"{self._package_index_url}/pypi/{project}/json",
+      _get_project_metadata,
+      semaphore,
+      PROJECT_SPEC,
     )
 
-  async def get_latest_version(
+  async def get_release_index(
     self,
     project: str,
-    version: str,
     semaphore: asyncio.Semaphore,
-  ) -> OptionalVersion:
-    try:
-      return self.__get_latest_version_cache[project, version]
-    except KeyError:
-      pass
-    async with semaphore:
-      latest_version = await self.__get_latest_version(project, version)
-    try:
-      self.__get_latest_version_cache[project, version] = latest_version
-    except ValueError:
-      pass
-    return latest_version
+  ) -> Tuple[Optional[ReleaseIndex], Any]:
+    """Return the release index of project, None if the project does not
+    exist, with the metadata of the project.
 
-  async def __get_latest_version(
+    The index is built again only when the metadata of the project changed.
+    """
+    project_data = await self._get_project(project, semaphore)
+    if "info" not in project_data:
+      return None, project_data
+    cached = self._release_indexes.get(project)
+    if cached is not None and cached[0] is project_data:
+      return cached[1], project_data
+    release_index = ReleaseIndex(
+      project_data["info"]["version"],
+      project_data["releases"],
+      # metadata cached before the releases were sorted has no sorted releases
+      # and no yanked releases.
+      project_data.get("sorted_releases"),
+      project_data.get("yanked", ()),
+    )
+    self._release_indexes[project] = (project_data, release_index)
+    return release_index, project_data
+
+  async def get_latest_version(
     self,
     project: str,
     version: str,
+    semaphore: asyncio.Semaphore,
   ) -> OptionalVersion:
     try:
-      # https://warehouse.pypa.io/api-reference/json.html#project
-      async with aiohttp_session.get_session().get(
-        f"{self._package_index_url}/pypi/{project}/json"
-      ) as resp:
-        project_data = await resp.json()
-    except (aiohttp.ClientError, ValueError, asyncio.TimeoutError):
+      release_index, _ = await self.get_release_index(project, semaphore)
+    except http_cache.FETCH_ERRORS:
       logger.warning(
         "Error fetching latest version for %s",
         project,
         exc_info=True,
       )
       return None
-    if "info" not in project_data:
+    if release_index is None:
       raise ProjectNotFound(project)
-    if version not in project_data["releases"]:
-      version = "0"
-    current = pkg_resources.parse_version(version)
-    latest = pkg_resources.parse_version(project_data["info"]["version"])
-    if latest > current:
-      return latest
-    return None
+    return release_index.get_latest_version(version)
 
-  async def get_known_vulnerabilities(
+  async def get_latest_version_in_series(
     self,
     project: str,
     version: str,
     semaphore: asyncio.Semaphore,
-  ) -> Tuple[KnownVulnerability, ...]:
-    try:
-      return self.__get_known_vulnerabilities_cache[project, version]
-    except KeyError:
-      pass
-    vulnerabilities = tuple(
-      [v async for v in self.__get_known_vulnerabilities(project, version, semaphore)]
-    )
+  ) -> OptionalVersion:
+    """The latest release of project with the same major version as
+    `version`, if it is newer than `version`.
+    """
     try:
-      self.__get_known_vulnerabilities_cache[project, version] = vulnerabilities
-    except ValueError:
-      pass
-    return vulnerabilities
+      release_index, _ = await self.get_release_index(project, semaphore)
+    except http_cache.FETCH_ERRORS:
+      logger.debug("Error fetching project %s", project, exc_info=True)
+      return None
+    if release_index is None:
+      return None
+    return release_index.get_latest_version_in_series(version)
+
+  async def find_release(
+    self,
+    project: str,
+    version: str,
+    semaphore: asyncio.Semaphore,
+  ) -> Tuple[str, Any]:
+    """Return the release of project equivalent to version, with the metadata
+    of the project.
+
+    Raises VersionNotFound if the project or the release does not exist.
+    """
+    release_index, project_data = await self.get_release_index(project, semaphore)
+    if release_index is None:
+      raise VersionNotFound((project, version))
+    release = release_index.find_release(version)
+    if release is None:
+      raise VersionNotFound((project, version))
+    return release, project_data
 
-  async def __get_known_vulnerabilities(
+  async def get_known_vulnerabilities(
     self,
     project: str,
     version: str,
     semaphore: asyncio.Semaphore,
-  ) -> AsyncIterable[KnownVulnerability]:
+  ) -> Tuple[KnownVulnerability, ...]:
+    release = version
+    if self._use_project_metadata:
+      try:
+        release, project_data = await self.find_release(project, version, semaphore)
+      except http_cache.FETCH_ERRORS:
+        logger.debug("Error fetching project %s", project, exc_info=True)
+      else:
+        # metadata cached before vulnerabilities were kept has no vulnerabilities
+        if (
+          release == project_data["info"]["version"]
+          and "vulnerabilities" in project_data
+        ):
+          return self._get_vulnerabilities(version, project_data["vulnerabilities"])
     try:
       # https://warehouse.pypa.io/api-reference/json.html#release
-      async with semaphore:
-        async with aiohttp_session.get_session().get(
-          f"{self._package_index_url}/pypi/{project}/{version}/json",
-        ) as resp:
-          project_data = await resp.json()
-    except (aiohttp.ClientError, ValueError, asyncio.TimeoutError):
+      release_data = await self.cache.get_json(
+        f"{self._package_index_url}/pypi/{project}/{release}/json",
+        _get_release_metadata,
+        semaphore,
+        RELEASE_SPEC,
+      )
+    except http_cache.FETCH_ERRORS:
       logger.warning(
         "Error fetching project release %s %s",
         project,
         version,
         exc_info=True,
       )
-    else:
-      if "info" not in project_data:
-        raise VersionNotFound((project, version))
-      parsed_version = pkg_resources.parse_version(version)
-      for vulnerability in (
-        converter.structure(v, KnownVulnerability)
-        for v in project_data.get("vulnerabilities", ())
-      ):
-        for fixed_in in (
-          pkg_resources.parse_version(f) for f in vulnerability.fixed_in
-        ):
-          if fixed_in > parsed_version:
-            yield vulnerability
-            break
+      return ()
+    if "info" not in release_data:
+      raise VersionNotFound((project, version))
+    return self._get_vulnerabilities(version, release_data["vulnerabilities"])
+
+  def _get_vulnerabilities(
+    self,
+    version: str,
+    vulnerabilities_data: List[Any],
+  ) -> Tuple[KnownVulnerability, ...]:
+    """The vulnerabilities not fixed in version."""
+    parsed_version = parse_version(version)
+    vulnerabilities = []
+    for vulnerability in (
+      converter.structure(v, KnownVulnerability) for v in vulnerabilities_data
+    ):
+      for fixed_in in (parse_version(f) for f in vulnerability.fixed_in):
+        if fixed_in > parsed_version:
+          vulnerabilities.append(vulnerability)
+          break
+    return tuple(vulnerabilities)
 
   def get_home_page_url(self, project: str, version: str) -> str:
     return f"{self._package_index_url}/project/{project}/{version}/"
@@ -0,0 +1,59 @@
+"""Canonical form of URIs.
+
+The same profile can be reached through different URIs, for example
+``file:///srv/a/../b.cfg`` and ``file:///srv//b.cfg`` when profiles extend
+each other with relative paths. URIs are used as cache keys, so they are
+normalized to one canonical URI, and interned so that equal URIs are the same
+string object.
+"""
+
+import functools
+import posixpath
+import sys
+import urllib.parse
+
+# number of URIs memoized by canonical_uri and join_uri
+CACHE_SIZE = 65536
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def canonical_uri(uri: str) -> str:
+  """Return the canonical form of uri.
+
+  The path is normalized like ``os.path.normpath``, removing ``.`` and
+  ``..`` segments and double slashes but keeping a trailing slash. The
+  scheme and host are lower case and ``file://localhost/`` is ``file:///``.
+  Relative paths are normalized the same way. Other parts of the URI are
+  kept as is.
+  """
+  parsed = urllib.parse.urlsplit(uri)
+  scheme = parsed.scheme.lower()
+  netloc = parsed.netloc.lower()
+  if scheme == "file" and netloc == "localhost":
+    netloc = ""
+  path = parsed.path
+  if path:
+    normalized_path = posixpath.normpath(path)
+    if normalized_path.startswith("//"):
+      normalized_path = normalized_path[1:]
+    if path.endswith("/") and not normalized_path.endswith("/"):
+      normalized_path += "/"
+    path = normalized_path
+  canonical = urllib.parse.urlunsplit(
+    parsed._replace(scheme=scheme, netloc=netloc, path=path)
+  )
+  if scheme == "file" and not canonical.startswith("file://"):
+    # urlunsplit writes file:/path when the host is empty
+    canonical = "file://" + canonical[len("file:") :]
+  return sys.intern(canonical)
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def join_uri(base: str, uri: str) -> str:
+  """Return the canonical form of uri relative to base."""
+  return canonical_uri(urllib.parse.urljoin(base, uri))
+
+
+def clear_cache() -> None:
+  canonical_uri.cache_clear()
+  join_uri.cache_clear()
@@ -0,0 +1,213 @@
+"""Index of the profiles of a workspace.
+
+Features looking for profiles in the workspace, like find references or
+completion of ``extends``, query this index instead of walking the file
+system. The index is built once, on first use, and is then updated from
+``workspace/didChangeWatchedFiles`` notifications.
+
+Directories where buildout installs things (``eggs``, ``parts``,
+``develop-eggs``) and version control or node directories are not indexed,
+nor are the paths ignored by ``.gitignore`` files.
+"""
+
+import logging
+import os
+import pathlib
+import re
+import urllib.parse
+import weakref
+from typing import Dict, Iterable, List, Optional, Pattern, Set
+
+from lsprotocol.types import FileChangeType, FileEvent
+from pygls.lsp.server import LanguageServer
+from pygls.workspace import Workspace
+
+logger = logging.getLogger(__name__)
+
+IGNORED_DIRECTORIES = frozenset(
+  (
+    ".git",
+    ".hg",
+    ".svn",
+    "develop-eggs",
+    "eggs",
+    "node_modules",
+    "parts",
+    "__pycache__",
+  )
+)
+PROFILE_SUFFIX = ".cfg"
+GITIGNORE = ".gitignore"
+
+
+class GitIgnorePattern:
+  """A pattern from a ``.gitignore`` file."""
+
+  def __init__(self, pattern: str):
+    self.negated = pattern.startswith("!")
+    if self.negated:
+      pattern = pattern[1:]
+    self.directory_only = pattern.endswith("/")
+    pattern = pattern.rstrip("/")
+    # patterns with a / are relative to the .gitignore, others match
+    # at any level.
+    self.anchored = "/" in pattern
+    self.regex = self._compile(pattern.lstrip("/"))
+
+  @staticmethod
+  def _compile(pattern: str) -> Pattern[str]:
+    regex = ""
+    i = 0
+    while i < len(pattern):
+      if pattern.startswith("**/", i):
+        regex += "(?:.*/)?"
+        i += 3
+      elif pattern.startswith("/**", i) and i + 3 == len(pattern):
+        regex += "/.*"
+        i += 3
+      elif pattern.startswith("**", i):
+        regex += ".*"
+        i += 2
+      elif pattern[i] == "*":
+        regex += "[^/]*"
+        i += 1
+      elif pattern[i] == "?":
+        regex += "[^/]"
+        i += 1
+      elif pattern[i] == "[" and (end := pattern.find("]", i + 1)) > i:
+        regex += "[" + pattern[i + 1 : end].replace("!", "^", 1) + "]"
+        i = end + 1
+      else:
+        regex += re.escape(pattern[i])
+        i += 1
+    return re.compile(regex + r"\Z")
+
+  def match(self, relative_path: str, is_directory: bool) -> bool:
+    if self.directory_only and not is_directory:
+      return False
+    if self.anchored:
+      return self.regex.match(relative_path) is not None
+    return self.regex.match(relative_path.rsplit("/", 1)[-1]) is not None
+
+
+def parseGitIgnore(path: str) -> List[GitIgnorePattern]:
+  """Read patterns of a ``.gitignore`` file."""
+  try:
+    with open(path, encoding="utf-8", errors="replace") as f:
+      lines = f.read().splitlines()
+  except OSError:
+    return []
+  patterns = []
+  for line in lines:
+    line = line.rstrip()
+    if line and not line.startswith("#"):
+      patterns.append(GitIgnorePattern(line))
+  return patterns
+
+
+class WorkspaceIndex:
+  """The profiles in a workspace directory."""
+
+  def __init__(self, root_path: str):
+    self.root_path = os.path.normpath(root_path)
+    self._profiles: Optional[Set[str]] = None
+    self._gitignores: Dict[str, List[GitIgnorePattern]] = {}
+
+  def _isIgnored(self, path: str, is_directory: bool) -> bool:
+    """Check if path is ignored, assuming its parent directory is not."""
+    if is_directory and os.path.basename(path) in IGNORED_DIRECTORIES:
+      return True
+    ignored = False
+    directory = os.path.dirname(path)
+    # Walk .gitignore files from the root to the directory of path, later
+    # patterns have priority.
+    parents: List[str] = []
+    while True:
+      parents.append(directory)
+      if len(directory) <= len(self.root_path):
+        break
+      directory = os.path.dirname(directory)
+    for directory in reversed(parents):
+      patterns = self._gitignores.get(directory)
+      if not patterns:
+        continue
+      relative_path = os.path.relpath(path, directory).replace(os.sep, "/")
+      for pattern in patterns:
+        if pattern.negated == ignored and pattern.match(relative_path, is_directory):
+          ignored = not pattern.negated
+    return ignored
+
+  def _isInIgnoredDirectory(self, path: str) -> bool:
+    directory = os.path.dirname(path)
+    while len(directory) > len(self.root_path):
+      if self._isIgnored(directory, is_directory=True):
+        return True
+      directory = os.path.dirname(directory)
+    return False
+
+  def _build(self) -> Set[str]:
+    profiles: Set[str] = set()
+    self._gitignores.clear()
+    for directory, dirnames, filenames in os.walk(self.root_path):
+      if GITIGNORE in filenames:
+        self._gitignores[directory] = parseGitIgnore(os.path.join(directory, GITIGNORE))
+      dirnames[:] = sorted(
+        dirname
+        for dirname in dirnames
+        if not self._isIgnored(os.path.join(directory, dirname), is_directory=True)
+      )
+      for filename in filenames:
+        if filename.endswith(PROFILE_SUFFIX):
+          path = os.path.join(directory, filename)
+          if not self._isIgnored(path, is_directory=False):
+            profiles.add(path)
+    logger.debug("Indexed %d profiles in %s", len(profiles), self.root_path)
+    return profiles
+
+  def getProfiles(self) -> List[pathlib.Path]:
+    """Return the paths of all profiles in the workspace, sorted."""
+    if self._profiles is None:
+      self._profiles = self._build()
+    return [pathlib.Path(path) for path in sorted(self._profiles)]
+
+  def _contains(self, path: str) -> bool:
+    return path.startswith(self.root_path + os.sep)
+
+  def update(self, changes: Iterable[FileEvent]) -> None:
+    """Update the index after files were changed in the workspace."""
+    if self._profiles is None:
+      return
+    for change in changes:
+      parsed_uri = urllib.parse.urlparse(change.uri)
+      if parsed_uri.scheme != "file":
+        continue
+      path = os.path.normpath(urllib.parse.unquote(parsed_uri.path))
+      if not self._contains(path):
+        continue
+      if os.path.basename(path) == GITIGNORE:
+        # ignored paths changed, rebuild everything
+        self._profiles = None
+        return
+      if not path.endswith(PROFILE_SUFFIX):
+        continue
+      if change.type == FileChangeType.Deleted:
+        self._profiles.discard(path)
+      elif not (
+        self._isIgnored(path, is_directory=False) or self._isInIgnoredDirectory(path)
+      ):
+        self._profiles.add(path)
+
+
+_workspace_indexes: "weakref.WeakKeyDictionary[Workspace, WorkspaceIndex]" = (
+  weakref.WeakKeyDictionary()
+)
+
+
+def getWorkspaceIndex(ls: LanguageServer) -> WorkspaceIndex:
+  """Return the index of profiles for the workspace of this language server."""
+  workspace = ls.workspace
+  root_path = os.path.normpath(workspace.root_path or os.getcwd())
+  index = _workspace_indexes.get(workspace)
+  if index is None or index.root_path != root_path:
+    index = _workspace_indexes[workspace] = WorkspaceIndex(root_path)
+  return index